@@ -57,12 +57,36 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
+    # JSON stays the default; clients ask for MessagePack with Accept: application/msgpack (core/formats.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'core.formats.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'core.formats.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# Token auth cache (see core/authentication.py)
+TOKEN_AUTH_CACHE = {
+    'MAX_ENTRIES': int(os.getenv("TOKEN_AUTH_CACHE_MAX_ENTRIES", "10000")),
+    'TTL': int(os.getenv("TOKEN_AUTH_CACHE_TTL", "60")),
+    'SHARED_CACHE': os.getenv("TOKEN_AUTH_SHARED_CACHE") or None,
+    'SHARED_TTL': int(os.getenv("TOKEN_AUTH_SHARED_TTL", "300")),
+    'TOKEN_TTL': int(os.getenv("TOKEN_TTL", "0")) or None,
 }
 
 MIDDLEWARE = [
+    "core.middleware.PerformanceMiddleware",
+    "core.middleware.CompressionMiddleware",
+    "core.middleware.ReplicaRoutingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -73,6 +97,81 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Per-route latency/SQL metrics (see core/middleware.py), served at /api/metrics/
+PERFORMANCE_METRICS = {
+    'ENABLED': os.getenv("PERFORMANCE_METRICS_ENABLED", "True").lower() == "true",
+    'SLOW_REQUEST_MS': int(os.getenv("SLOW_REQUEST_MS", "500")),
+    'SQL_SAMPLE_SIZE': int(os.getenv("SLOW_REQUEST_SQL_SAMPLE_SIZE", "5")),
+}
+
+# Token-bucket throttling for hot read endpoints (see core/throttling.py)
+THROTTLING = {
+    'ENABLED': os.getenv("THROTTLING_ENABLED", "True").lower() == "true",
+    'RATES': {
+        'user': os.getenv("THROTTLE_USER_RATE", "120/min"),
+        'anon': os.getenv("THROTTLE_ANON_RATE", "60/min"),
+    },
+    'SHARED_CACHE': os.getenv("THROTTLE_SHARED_CACHE") or None,
+}
+
+# Upper bound for /api/conversations/updates/ long-poll requests. 0 answers at once (short poll).
+# Each waiting client holds a worker thread, so only raise it with threaded workers sized for the
+# pollers (e.g. gunicorn --threads); it is capped at core.messaging.MAX_LONG_POLL_SECONDS.
+MESSAGING_LONG_POLL_SECONDS = int(os.getenv("MESSAGING_LONG_POLL_SECONDS", "0"))
+
+# Retention for core.archive; a value of 0 keeps that kind in the hot tables forever
+ARCHIVE = {
+    'MESSAGE_RETENTION_DAYS': int(os.getenv("ARCHIVE_MESSAGE_RETENTION_DAYS", "180")),
+    'NOTIFICATION_RETENTION_DAYS': int(os.getenv("ARCHIVE_NOTIFICATION_RETENTION_DAYS", "30")),
+    'BATCH_SIZE': int(os.getenv("ARCHIVE_BATCH_SIZE", "1000")),
+    'INTERVAL_MINUTES': int(os.getenv("ARCHIVE_INTERVAL_MINUTES", "1440")),
+}
+
+# Startup behaviour for scale-to-zero hosting (see core/startup.py and `manage.py startup_profile`)
+COLD_START = {
+    'LAZY_ROUTES': os.getenv("COLD_START_LAZY_ROUTES", "True").lower() == "true",
+    'PREWARM': os.getenv("COLD_START_PREWARM", "False").lower() == "true",
+    'BUDGET_MS': {
+        'setup': int(os.getenv("COLD_START_SETUP_BUDGET_MS", "1000")),
+        'first_request': int(os.getenv("COLD_START_FIRST_REQUEST_BUDGET_MS", "1200")),
+    },
+}
+
+# "Similar items" index (core/similarity.py), refreshed by `manage.py build_similar_items`
+SIMILAR_ITEMS = {
+    'NEIGHBOURS': int(os.getenv("SIMILAR_ITEMS_NEIGHBOURS", "20")),
+    'INTERVAL_MINUTES': int(os.getenv("SIMILAR_ITEMS_INTERVAL_MINUTES", "15")),
+}
+
+# In-memory search suggestions (core/suggest.py); the snapshot is written by `manage.py build_suggest_index`
+SUGGEST = {
+    'SNAPSHOT_PATH': os.getenv("SUGGEST_SNAPSHOT_PATH", str(BASE_DIR / 'var' / 'suggest.json.gz')),
+    'RELOAD_SECONDS': int(os.getenv("SUGGEST_RELOAD_SECONDS", "900")),
+}
+
+# Payment webhooks (core/payments.py); queued events are applied by `manage.py apply_payment_events`
+PAYMENTS = {
+    'WEBHOOK_SECRET': os.getenv("PAYMENT_WEBHOOK_SECRET") or None,
+    # Without a secret the webhook answers 403, unless unsigned events are allowed (the default with DEBUG)
+    'ALLOW_UNSIGNED': os.getenv("PAYMENT_WEBHOOK_ALLOW_UNSIGNED", str(DEBUG)).lower() == "true",
+    'FLUSH_WINDOW_MS': int(os.getenv("PAYMENT_WEBHOOK_FLUSH_WINDOW_MS", "5")),
+    'BATCH_SIZE': int(os.getenv("PAYMENT_EVENTS_BATCH_SIZE", "200")),
+}
+
+# gzip/brotli/zstd response compression (see core/compression.py)
+COMPRESSION = {
+    'ENABLED': os.getenv("COMPRESSION_ENABLED", "True").lower() == "true",
+    'MIN_SIZE': int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+    'CACHE_ENTRIES': int(os.getenv("COMPRESSION_CACHE_ENTRIES", "512")),
+    'CACHE_MAX_BYTES': int(os.getenv("COMPRESSION_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+}
+
+# POST /api/batch/ runs several GET requests in one round trip (see core/batch.py)
+BATCH_API = {
+    'MAX_REQUESTS': int(os.getenv("BATCH_API_MAX_REQUESTS", "20")),
+    'MAX_WORKERS': int(os.getenv("BATCH_API_MAX_WORKERS", "4")),
+}
+
 ROOT_URLCONF = "config.urls"
 
 TEMPLATES = [
@@ -100,7 +199,21 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+    },
+    # Local stand-in for a read replica; only used when listed in READ_REPLICAS['ALIASES']
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.getenv("DATABASE_REPLICA_NAME", str(BASE_DIR / "db.replica.sqlite3")),
+    },
+}
+
+DATABASE_ROUTERS = ["core.routers.ReplicaRouter"]
+
+# Read replicas for GET/HEAD/OPTIONS requests (see core/routers.py)
+READ_REPLICAS = {
+    'ALIASES': [alias for alias in os.getenv("READ_REPLICAS", "").split(",") if alias],
+    'PIN_SECONDS': int(os.getenv("REPLICA_PIN_SECONDS", "5")),
+    'RETRY_SECONDS': int(os.getenv("REPLICA_RETRY_SECONDS", "30")),
 }
 
 
@@ -147,3 +260,9 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Content-addressed image storage (core/storage.py); released files are removed by `manage.py collect_blobs`
+BLOB_STORAGE = {
+    'GC_GRACE_HOURS': int(os.getenv("BLOB_GC_GRACE_HOURS", "24")),
+    'GC_BATCH_SIZE': int(os.getenv("BLOB_GC_BATCH_SIZE", "500")),
+}
@@ -14,10 +14,13 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
+from core.storage import get_config as blob_config, serve_blob
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("core.urls")),
+    path(f"{settings.MEDIA_URL.strip('/')}/{blob_config()['DIRECTORY']}/<path:name>", serve_blob, name="blob"),
 ]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 application = get_wsgi_application()
+
+from core.startup import get_config, prewarm  # noqa: E402  (needs the settings configured above)
+
+if get_config()['PREWARM']:
+    prewarm()
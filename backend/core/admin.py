@@ -1,3 +1,224 @@
-from django.contrib import admin
+import json
 
-# Register your models here.
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from .availability import invalidate_occupancy, sync_availability
+from .history import change_status
+from .models import (
+    ArchiveSegment, Blob, Category, Conversation, ConversationParticipant, Dispute, Item, ItemBlackout,
+    Message, Notification, RentalRequest, RequestStatusChange, Transaction,
+)
+
+CANCELLABLE_STATUSES = ('Pending', 'Approved', 'AwaitingPayment')
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for tables with millions of rows.
+
+    The changelist never runs an unbounded ``COUNT(*)``. Lists are counted up
+    to ``MAX_COUNT`` rows. Past that, PostgreSQL uses the planner's estimate
+    (``pg_class`` for the whole table, ``EXPLAIN`` for a filtered list).
+    Other databases stop at ``MAX_COUNT + 1`` and set ``capped``, so pages
+    beyond it can't be reached and the admin says so.
+    """
+    MAX_COUNT = 10000
+    capped = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > self.MAX_COUNT:
+                return row[0]
+        counted = queryset.order_by().values('pk')[:self.MAX_COUNT + 1].count()
+        if counted <= self.MAX_COUNT:
+            return counted
+        if connection.vendor == 'postgresql':
+            return max(self.planner_estimate(queryset, connection), counted)
+        self.capped = True
+        return counted
+
+    @staticmethod
+    def planner_estimate(queryset, connection):
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelists for big tables: estimated counts, and orderings and filters that have an index."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ['-pk']
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is not None and changelist.paginator.capped:
+            self.message_user(
+                request,
+                f'Only the first {changelist.paginator.MAX_COUNT:,} matches are counted and paged; '
+                'narrow the filters to see the rest.',
+                messages.WARNING,
+            )
+        return response
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'parent', 'depth', 'available_item_count']
+    list_select_related = ['parent']
+    raw_id_fields = ['parent']
+    readonly_fields = ['path', 'depth', 'available_item_count']
+    search_fields = ['name_key']
+    ordering = ['path']
+
+
+class ItemBlackoutInline(admin.TabularInline):
+    model = ItemBlackout
+    extra = 0
+
+
+@admin.register(Item)
+class ItemAdmin(LargeTableAdmin):
+    list_display = ['id', 'name', 'category', 'owner_id', 'price_per_day', 'is_listed', 'is_available', 'created_at']
+    list_select_related = ['category']
+    list_filter = ['is_available']
+    raw_id_fields = ['category']
+    readonly_fields = ['geohash', 'rating', 'reviews_count']
+    search_fields = ['=id', '=owner_id', 'name']
+    inlines = [ItemBlackoutInline]
+
+
+class RequestStatusChangeInline(admin.TabularInline):
+    """The append-only status log; shown, never edited."""
+    model = RequestStatusChange
+    extra = 0
+    can_delete = False
+    ordering = ['changed_at', 'pk']
+    readonly_fields = ['from_status', 'to_status', 'changed_at', 'source']
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(RentalRequest)
+class RentalRequestAdmin(LargeTableAdmin):
+    list_display = [
+        'id', 'item', 'requester_name', 'owner_name', 'status', 'start_date', 'end_date',
+        'total_price', 'requested_at',
+    ]
+    list_select_related = ['item']
+    list_filter = ['status', 'requested_at']
+    ordering = ['-requested_at', '-pk']
+    raw_id_fields = ['item']
+    search_fields = ['=id', '=requester_id', '=owner_id']
+    readonly_fields = ['handover_code', 'return_code', 'requested_at']
+    inlines = [RequestStatusChangeInline]
+    actions = ['cancel_requests']
+
+    @admin.action(description='Cancel selected requests (pending, approved or awaiting payment)')
+    def cancel_requests(self, request, queryset):
+        queryset = queryset.filter(status__in=CANCELLABLE_STATUSES)
+        item_ids = set(queryset.values_list('item_id', flat=True))
+        cancelled = len(change_status(queryset, 'Cancelled', 'admin'))
+        # change_status() skips the signals that keep these in step
+        for item_id in item_ids:
+            invalidate_occupancy(item_id)
+        sync_availability(Item.objects.filter(pk__in=item_ids))
+        self.message_user(request, f'Cancelled {cancelled} requests.', messages.SUCCESS)
+
+
+@admin.register(Transaction)
+class TransactionAdmin(LargeTableAdmin):
+    list_display = ['id', 'rental_request', 'transaction_type', 'amount', 'status', 'created_at']
+    list_select_related = ['rental_request__item']
+    list_filter = ['status', 'transaction_type', 'created_at']
+    ordering = ['-created_at', '-pk']
+    raw_id_fields = ['rental_request']
+    search_fields = ['=id', '=rental_request__id', '=stripe_id']
+
+
+@admin.register(Dispute)
+class DisputeAdmin(LargeTableAdmin):
+    list_display = ['id', 'rental_request', 'reporter_id', 'status', 'created_at']
+    list_select_related = ['rental_request__item']
+    list_filter = ['status', 'created_at']
+    ordering = ['-created_at', '-pk']
+    raw_id_fields = ['rental_request']
+    search_fields = ['=id', '=rental_request__id', '=reporter_id']
+    actions = ['resolve_disputes']
+
+    @admin.action(description='Mark selected disputes as resolved')
+    def resolve_disputes(self, request, queryset):
+        queryset = queryset.filter(status='Open')
+        request_ids = list(queryset.values_list('rental_request_id', flat=True))
+        resolved = queryset.update(status='Resolved')
+        sync_availability(Item.objects.filter(requests__pk__in=request_ids))
+        self.message_user(request, f'Resolved {resolved} disputes.', messages.SUCCESS)
+
+
+@admin.register(Notification)
+class NotificationAdmin(LargeTableAdmin):
+    list_display = ['id', 'target_user_id', 'event_type', 'title', 'is_read', 'timestamp']
+    search_fields = ['=target_user_id']
+
+
+class ConversationParticipantInline(admin.TabularInline):
+    model = ConversationParticipant
+    extra = 0
+    readonly_fields = ['unread_count', 'last_read_at', 'last_activity_at']
+
+
+@admin.register(Conversation)
+class ConversationAdmin(LargeTableAdmin):
+    list_display = ['id', 'item_context', 'last_message_text', 'last_message_at']
+    list_select_related = ['item_context']
+    raw_id_fields = ['item_context', 'last_message']
+    search_fields = ['=id', '=memberships__user_id']
+    inlines = [ConversationParticipantInline]
+
+
+@admin.register(Message)
+class MessageAdmin(LargeTableAdmin):
+    list_display = ['id', 'conversation_id', 'sender_id', 'text', 'is_read', 'timestamp']
+    raw_id_fields = ['conversation']
+    search_fields = ['=conversation__id']
+
+
+@admin.register(ArchiveSegment)
+class ArchiveSegmentAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'owner_key', 'row_count', 'size_bytes', 'first_timestamp', 'last_timestamp']
+    list_filter = ['kind']
+    search_fields = ['=owner_key']
+    ordering = ['-pk']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Blob)
+class BlobAdmin(LargeTableAdmin):
+    list_display = ['id', 'name', 'size', 'ref_count', 'released_at', 'created_at']
+    search_fields = ['=name']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,173 @@
+"""
+Retention and cold storage for messages and notifications.
+
+Rows past their retention period are moved, in batches, out of the hot
+``Message``/``Notification`` tables into gzip-compressed NDJSON segment
+files in ``default_storage`` (``MEDIA_ROOT/archive/...`` by default). Each
+segment holds one conversation's (or one user's) rows and is indexed by a
+small ``ArchiveSegment`` row, so reading a conversation's history back is
+one indexed lookup plus the files it points to.
+
+Archived rows are stored in their API shape so views can return them
+next to hot rows unchanged. Notifications are only archived once read,
+and a conversation's last message stays hot for its inbox preview.
+"""
+import gzip
+import json
+from datetime import timedelta
+from itertools import groupby
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .models import ArchiveSegment, Conversation, Message, Notification
+from .serializers import MessageSerializer, NotificationSerializer
+
+MESSAGE = 'message'
+NOTIFICATION = 'notification'
+
+DEFAULTS = {
+    'MESSAGE_RETENTION_DAYS': 180,      # 0 disables archiving for that kind
+    'NOTIFICATION_RETENTION_DAYS': 30,
+    'BATCH_SIZE': 1000,
+    'INTERVAL_MINUTES': 1440,           # how often ``archive_history --loop`` runs
+    'DIRECTORY': 'archive',
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'ARCHIVE', {})}
+
+
+class Archiver:
+    def __init__(self, kind, model, owner_field, serializer_class, retention_setting, eligible=Q(), keep=None):
+        self.kind = kind
+        self.model = model
+        self.owner_field = owner_field
+        self.serializer_class = serializer_class
+        self.retention_setting = retention_setting
+        self.eligible = eligible
+        self.keep = keep
+
+    def cutoff(self, config, now=None):
+        days = config[self.retention_setting]
+        if not days:
+            return None
+        return (now or timezone.now()) - timedelta(days=days)
+
+    def candidates(self, cutoff):
+        queryset = self.model.objects.filter(self.eligible, timestamp__lt=cutoff)
+        if self.keep is not None:
+            queryset = queryset.exclude(self.keep)
+        return queryset.order_by(self.owner_field, 'id')
+
+    def archive(self, cutoff, batch_size, directory):
+        """Move everything older than ``cutoff``; returns ``(rows, segments)``."""
+        archived = segments = 0
+        while True:
+            with transaction.atomic():
+                batch = list(self.candidates(cutoff)[:batch_size])
+                if not batch:
+                    break
+                for owner, rows in groupby(batch, key=attrgetter(self.owner_field)):
+                    self.write_segment(str(owner), list(rows), directory)
+                    segments += 1
+                # Files are written before the delete commits: a failure leaves an orphan file, never lost rows
+                self.model.objects.filter(pk__in=[row.pk for row in batch]).delete()
+            archived += len(batch)
+        return archived, segments
+
+    def write_segment(self, owner_key, rows, directory):
+        data = self.serializer_class(rows, many=True).data
+        lines = ''.join(json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in data)
+        payload = gzip.compress(lines.encode('utf-8'))
+        first, last = rows[0], rows[-1]
+        name = f'{directory}/{self.kind}/{get_valid_filename(owner_key)}/{first.pk:012d}-{last.pk:012d}.ndjson.gz'
+        path = default_storage.save(name, ContentFile(payload))
+        return ArchiveSegment.objects.create(
+            kind=self.kind,
+            owner_key=owner_key,
+            path=path,
+            row_count=len(rows),
+            size_bytes=len(payload),
+            first_id=first.pk,
+            last_id=last.pk,
+            first_timestamp=min(row.timestamp for row in rows),
+            last_timestamp=max(row.timestamp for row in rows),
+        )
+
+
+ARCHIVERS = {
+    MESSAGE: Archiver(
+        MESSAGE, Message, 'conversation_id', MessageSerializer, 'MESSAGE_RETENTION_DAYS',
+        # Deleting it would null Conversation.last_message (SET_NULL) and blank the inbox preview
+        keep=Q(pk__in=Conversation.objects.filter(last_message__isnull=False).values('last_message_id')),
+    ),
+    NOTIFICATION: Archiver(
+        NOTIFICATION, Notification, 'target_user_id', NotificationSerializer, 'NOTIFICATION_RETENTION_DAYS',
+        eligible=Q(is_read=True),
+    ),
+}
+
+
+def archive_history(kinds=None, now=None):
+    """Run every (or the given) archiver once; returns ``{kind: (rows, segments)}``."""
+    config = get_config()
+    results = {}
+    for kind in kinds or ARCHIVERS:
+        archiver = ARCHIVERS[kind]
+        cutoff = archiver.cutoff(config, now)
+        if cutoff is not None:
+            results[kind] = archiver.archive(cutoff, config['BATCH_SIZE'], config['DIRECTORY'])
+    return results
+
+
+def pending_counts(now=None):
+    """How many rows the next run would move, per kind."""
+    config = get_config()
+    counts = {}
+    for kind, archiver in ARCHIVERS.items():
+        cutoff = archiver.cutoff(config, now)
+        counts[kind] = archiver.candidates(cutoff).count() if cutoff is not None else 0
+    return counts
+
+
+def read_segment(segment):
+    with default_storage.open(segment.path, 'rb') as fh, gzip.open(fh, 'rt', encoding='utf-8') as lines:
+        for line in lines:
+            yield json.loads(line)
+
+
+def archived_rows(segments, newest_first=False):
+    """Rows from ``segments`` in id order (or reversed)."""
+    segments = segments.order_by('-first_id' if newest_first else 'first_id')
+    for segment in segments:
+        rows = list(read_segment(segment))
+        yield from reversed(rows) if newest_first else rows
+
+
+def segments_for(kind, owner_key):
+    return ArchiveSegment.objects.filter(kind=kind, owner_key=str(owner_key))
+
+
+def find_archived(kind, pk):
+    """Look up one archived row by primary key via the segment id ranges."""
+    for segment in ArchiveSegment.objects.filter(kind=kind, first_id__lte=pk, last_id__gte=pk):
+        for row in read_segment(segment):
+            if row['id'] == pk:
+                return row
+    return None
+
+
+def purge_archive(kind, owner_key):
+    segments = segments_for(kind, owner_key)
+    for path in segments.values_list('path', flat=True):
+        default_storage.delete(path)
+    segments.delete()
@@ -0,0 +1,182 @@
+"""
+Token authentication backed by an in-process LRU and an optional shared cache.
+
+DRF's ``TokenAuthentication`` runs a ``Token`` + ``User`` join on every API
+call. ``CachedTokenAuthentication`` keeps recently seen tokens in a bounded
+per-process LRU and, when ``TOKEN_AUTH_CACHE['SHARED_CACHE']`` names a Django
+cache alias, in that cache as well so other workers can skip the query too.
+
+Entries are evicted when a token is deleted or its user is saved (see
+``core.signals``). Other processes only see deletions through the shared
+cache, so the local ``TTL`` bounds how long a revoked token can linger there.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .metrics import registry
+
+DEFAULTS = {
+    'MAX_ENTRIES': 10000,   # local LRU size
+    'TTL': 60,              # seconds an entry lives in the local LRU
+    'SHARED_CACHE': None,   # Django cache alias, e.g. 'default'
+    'SHARED_TTL': 300,      # seconds an entry lives in the shared cache
+    'TOKEN_TTL': None,      # seconds before a token expires, None = never
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'TOKEN_AUTH_CACHE', {})}
+
+
+def shared_cache_key(key):
+    # Never put raw tokens into a shared cache
+    return 'authtoken:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+class TokenCache:
+    """Thread-safe LRU of ``token key -> (user, created)`` with hit metrics."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        self.stats = dict.fromkeys(('hits', 'shared_hits', 'misses', 'evictions', 'invalidations'), 0)
+
+    def shared(self):
+        alias = get_config()['SHARED_CACHE']
+        return caches[alias] if alias else None
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                user, created, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return user, created
+                del self._entries[key]
+
+        shared = self.shared()
+        if shared is not None:
+            value = shared.get(shared_cache_key(key))
+            if value is not None:
+                self._store(key, *value)
+                with self._lock:
+                    self.stats['shared_hits'] += 1
+                return value
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def set(self, key, user, created):
+        self._store(key, user, created)
+        shared = self.shared()
+        if shared is not None:
+            shared.set(shared_cache_key(key), (user, created), get_config()['SHARED_TTL'])
+
+    def _store(self, key, user, created):
+        config = get_config()
+        with self._lock:
+            self._entries[key] = (user, created, time.monotonic() + config['TTL'])
+            self._entries.move_to_end(key)
+            while len(self._entries) > config['MAX_ENTRIES']:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self.stats['invalidations'] += 1
+        shared = self.shared()
+        if shared is not None:
+            shared.delete(shared_cache_key(key))
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            keys = [key for key, (user, _, _) in self._entries.items() if user.pk == user_id]
+        if self.shared() is not None:
+            keys = set(keys) | set(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+        for key in keys:
+            self.invalidate(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats, size=len(self._entries))
+        lookups = stats['hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['shared_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+token_cache = TokenCache()
+
+
+def collect_token_cache_metrics():
+    stats = token_cache.metrics()
+    return [
+        ('auth_token_cache_lookups_total', 'Token cache lookups by result.', 'counter', {
+            'result="hit"': stats['hits'],
+            'result="shared_hit"': stats['shared_hits'],
+            'result="miss"': stats['misses'],
+        }),
+        ('auth_token_cache_evictions_total', 'Entries dropped to keep the LRU bounded.', 'counter',
+         {'': stats['evictions']}),
+        ('auth_token_cache_size', 'Entries in the local token LRU.', 'gauge', {'': stats['size']}),
+        ('auth_token_cache_hit_ratio', 'Share of lookups served from cache.', 'gauge', {'': stats['hit_rate']}),
+    ]
+
+
+registry.register_collector(collect_token_cache_metrics)
+
+
+def is_expired(created):
+    ttl = get_config()['TOKEN_TTL']
+    return bool(ttl) and created < timezone.now() - timedelta(seconds=ttl)
+
+
+def get_valid_token(user):
+    """Return the user's token, replacing it first if it has expired."""
+    token, created = Token.objects.get_or_create(user=user)
+    if not created and is_expired(token.created):
+        token = rotate_token(user)
+    return token
+
+
+def rotate_token(user):
+    """Replace the user's token with a fresh one; the old key stops working."""
+    Token.objects.filter(user=user).delete()
+    return Token.objects.create(user=user)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user, token.created)
+        else:
+            user, created = entry
+            token = Token(key=key, user=user, created=created)
+
+        if is_expired(token.created):
+            token_cache.invalidate(key)
+            raise exceptions.AuthenticationFailed('Token has expired.')
+        return (user, token)
@@ -0,0 +1,183 @@
+"""
+Item occupancy and availability.
+
+Occupancy is which days an item can't be booked.
+
+A day is blocked when an active rental request (``BLOCKING_STATUSES``) or an
+owner blackout covers it. Each item's blocked days are cached as merged,
+sorted ``(start, end)`` ranges (inclusive) and dropped whenever one of its
+requests or blackouts is written, so calendar reads never touch the
+request table on a warm cache. Windows are cut from the cached ranges and
+sent either as ranges or as a bitmap (bit ``i`` = day ``from + i``, least
+significant bit first, base64).
+
+``Item.is_available`` is derived state: the owner's ``is_listed`` flag and
+"not currently with a renter" (``held_requests``). ``sync_availability``
+recomputes it with set-based UPDATEs, for one item after a status change
+or for the whole table from ``manage.py reconcile_availability``.
+"""
+import base64
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils.dateparse import parse_date
+
+from .categories import recount_categories
+from .models import Item, ItemBlackout, RentalRequest
+
+BLOCKING_STATUSES = ('Approved', 'AwaitingPayment', 'Paid', 'InHand')
+OCCUPANCY_CACHE_TIMEOUT = 3600
+MAX_WINDOW_DAYS = 366
+MAX_BATCH_ITEMS = 100
+ENCODINGS = ('ranges', 'bitmap')
+
+
+def occupancy_cache_key(item_id):
+    return f'core:occupancy:{item_id}'
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + timedelta(days=1):
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def load_occupancy(item_ids):
+    """Blocked ranges per item straight from the database (two queries)."""
+    ranges = {item_id: [] for item_id in item_ids}
+    requests = RentalRequest.objects.filter(item_id__in=item_ids, status__in=BLOCKING_STATUSES)
+    blackouts = ItemBlackout.objects.filter(item_id__in=item_ids)
+    for queryset in (requests, blackouts):
+        for item_id, start, end in queryset.values_list('item_id', 'start_date', 'end_date'):
+            ranges[item_id].append((start, end))
+    return {item_id: merge_ranges(item_ranges) for item_id, item_ranges in ranges.items()}
+
+
+def get_occupancy(item_ids):
+    """``{item_id: ranges}`` from the cache, loading the misses in one go."""
+    keys = {occupancy_cache_key(item_id): item_id for item_id in item_ids}
+    cached = cache.get_many(list(keys))
+    occupancy = {keys[key]: ranges for key, ranges in cached.items()}
+    missing = [item_id for item_id in item_ids if item_id not in occupancy]
+    if missing:
+        loaded = load_occupancy(missing)
+        cache.set_many({occupancy_cache_key(item_id): ranges for item_id, ranges in loaded.items()}, OCCUPANCY_CACHE_TIMEOUT)
+        occupancy.update(loaded)
+    return occupancy
+
+
+def invalidate_occupancy(item_id):
+    cache.delete(occupancy_cache_key(item_id))
+
+
+def clip(ranges, start, end):
+    return [(max(s, start), min(e, end)) for s, e in ranges if s <= end and e >= start]
+
+
+def is_booked(item_id, start, end, exclude_request=None):
+    """
+    Whether any day of ``start``..``end`` is blocked for the item.
+
+    ``exclude_request`` leaves that request's own days out, for moving an
+    existing booking; the cached ranges can't, so this reads the database.
+    """
+    if exclude_request is None:
+        return bool(clip(get_occupancy([item_id])[item_id], start, end))
+    overlapping = Q(item_id=item_id, start_date__lte=end, end_date__gte=start)
+    return (
+        RentalRequest.objects.filter(overlapping, status__in=BLOCKING_STATUSES).exclude(pk=exclude_request).exists()
+        or ItemBlackout.objects.filter(overlapping).exists()
+    )
+
+
+def encode_bitmap(ranges, start, end):
+    days = (end - start).days + 1
+    bits = bytearray((days + 7) // 8)
+    for s, e in ranges:
+        for offset in range((s - start).days, (e - start).days + 1):
+            bits[offset // 8] |= 1 << (offset % 8)
+    return base64.b64encode(bytes(bits)).decode('ascii')
+
+
+def calendar(ranges, start, end, encoding='ranges'):
+    window = clip(ranges, start, end)
+    payload = {
+        'from': start,
+        'to': end,
+        'blocked_days': sum((e - s).days + 1 for s, e in window),
+    }
+    if encoding == 'bitmap':
+        payload['bitmap'] = encode_bitmap(window, start, end)
+    else:
+        payload['ranges'] = window
+    return payload
+
+
+def parse_window(params, today):
+    """Read ``from``/``to``/``encoding``; defaults to 90 days from ``today``. Raises ``ValueError``."""
+    start = parse_date(params['from']) if params.get('from') else today
+    end = parse_date(params['to']) if params.get('to') else None
+    if start is None or (params.get('to') and end is None):
+        raise ValueError('from and to must be YYYY-MM-DD dates.')
+    end = end or start + timedelta(days=89)
+    if end < start:
+        raise ValueError('to must not be before from.')
+    if (end - start).days + 1 > MAX_WINDOW_DAYS:
+        raise ValueError(f'The window is limited to {MAX_WINDOW_DAYS} days.')
+    encoding = params.get('encoding', 'ranges')
+    if encoding not in ENCODINGS:
+        raise ValueError(f'encoding must be one of: {", ".join(ENCODINGS)}.')
+    return start, end, encoding
+
+
+def held_requests():
+    """Requests that keep their item away from other renters: out on rental or under open dispute."""
+    return RentalRequest.objects.filter(
+        Q(status='InHand') | Q(status='Disputed', dispute__status='Open'), item=OuterRef('pk'),
+    )
+
+
+def drifted_items(items=None):
+    """``(should_be_unavailable, should_be_available)`` querysets of items whose flag is stale."""
+    items = Item.objects.all() if items is None else items
+    held = Exists(held_requests())
+    return (
+        items.filter(Q(is_listed=False) | held, is_available=True),
+        items.filter(is_listed=True, is_available=False).exclude(held),
+    )
+
+
+def sync_availability(items=None, batch_size=1000, dry_run=False):
+    """
+    Fix stale ``is_available`` flags, ``batch_size`` rows per UPDATE.
+
+    Returns ``{'made_unavailable': n, 'made_available': n}``. Category
+    counts of the touched items are recounted in the same transaction.
+    """
+    to_unavailable, to_available = drifted_items(items)
+    report = {}
+    for key, queryset, value in (
+        ('made_unavailable', to_unavailable, False),
+        ('made_available', to_available, True),
+    ):
+        if dry_run:
+            report[key] = queryset.count()
+            continue
+        fixed = 0
+        while True:
+            with transaction.atomic():
+                ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+                if not ids:
+                    break
+                Item.objects.filter(pk__in=ids).update(is_available=value)
+                recount_categories(Item.objects.filter(pk__in=ids).values('category_id'))
+            fixed += len(ids)
+        report[key] = fixed
+    return report
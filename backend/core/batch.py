@@ -0,0 +1,152 @@
+"""
+Batched reads: several GET requests in one round trip.
+
+``POST /api/batch/`` takes ``{"requests": [{"path": "/items/?fields=id,name"}, ...]}``
+with paths relative to the API root, like the frontend's ``fetchApi``. It
+answers ``{"responses": [{"path", "status", "body"}, ...]}`` in the same
+order. The batch request is authenticated once and each sub-request reuses
+that user, so token lookups, sessions and the middleware stack are paid
+once per page instead of once per call. Views, permissions and throttles
+run as usual for every sub-request.
+
+Sub-requests run one after another on the request's database connection.
+With ``"parallel": true`` they are spread over up to ``MAX_WORKERS``
+threads, each on its own connection, unless the request is inside a
+transaction whose uncommitted rows other connections would not see.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connection, connections
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, get_resolver
+from rest_framework.response import Response
+
+from . import routers
+from .metrics import registry
+
+logger = logging.getLogger('django.request')
+
+DEFAULTS = {
+    'MAX_REQUESTS': 20,    # sub-requests per batch
+    'MAX_WORKERS': 4,      # threads for "parallel": true; 1 always runs them in order
+}
+_lock = threading.Lock()
+stats = {'batches': 0, 'sequential': 0, 'parallel': 0}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'BATCH_API', {})}
+
+
+def parse_batch(payload):
+    """The sub-request paths and the parallel flag of a batch body; raises ``ValueError``."""
+    requests = payload.get('requests') if isinstance(payload, dict) else None
+    if not isinstance(requests, list) or not requests:
+        raise ValueError('requests must be a non-empty list.')
+    limit = get_config()['MAX_REQUESTS']
+    if len(requests) > limit:
+        raise ValueError(f'A batch can hold at most {limit} requests.')
+    paths = []
+    for sub in requests:
+        if not isinstance(sub, dict) or not isinstance(sub.get('path'), str) or not sub['path'].startswith('/'):
+            raise ValueError('Each request needs a "path" starting with "/".')
+        if sub.get('method', 'GET').upper() != 'GET':
+            raise ValueError('Only GET requests can be batched.')
+        paths.append(sub['path'])
+    return paths, bool(payload.get('parallel'))
+
+
+def run_batch(request, root, paths, parallel):
+    """
+    Run ``paths`` (relative to ``root``) as GET requests for ``request``'s user.
+
+    ``request`` is the authenticated DRF request of the batch itself.
+    """
+    workers = min(get_config()['MAX_WORKERS'], len(paths))
+    parallel = parallel and workers > 1 and not connection.in_atomic_block
+    with _lock:
+        stats['batches'] += 1
+        stats['parallel' if parallel else 'sequential'] += len(paths)
+    if not parallel:
+        return [run_one(request, root, path) for path in paths]
+
+    state = routers.current()
+
+    def task(path):
+        try:
+            with routers.watching(state):
+                return run_one(request, root, path)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as pool:
+        # Each task gets its own copy of the context, so it reads where the batch reads
+        futures = [pool.submit(copy_context().run, task, path) for path in paths]
+        return [future.result() for future in futures]
+
+
+def run_one(request, root, path):
+    split = urlsplit(path)
+    try:
+        match = get_resolver(getattr(request, 'urlconf', None)).resolve(root + split.path.lstrip('/'))
+    except Resolver404:
+        return {'path': path, 'status': 404, 'body': {'detail': 'Not found.'}}
+    if match.url_name == 'batch':
+        return {'path': path, 'status': 400, 'body': {'error': 'Batches cannot be nested.'}}
+
+    sub = sub_request(request, root + split.path.lstrip('/'), split.query)
+    sub.resolver_match = match
+    try:
+        response = match.func(sub, *match.args, **match.kwargs)
+    except Exception:
+        logger.exception('Internal Server Error in batch: %s', path)
+        return {'path': path, 'status': 500, 'body': {'error': 'Internal server error.'}}
+
+    if isinstance(response, Response):
+        body = response.data
+    elif response.streaming:
+        return {'path': path, 'status': 400, 'body': {'error': 'Streaming responses cannot be batched.'}}
+    else:
+        body = response.content.decode(response.charset)
+    return {'path': path, 'status': response.status_code, 'body': body}
+
+
+def sub_request(request, path, query):
+    """A GET ``HttpRequest`` for ``path`` that carries ``request``'s authentication."""
+    outer = request._request
+    sub = HttpRequest()
+    sub.method = 'GET'
+    sub.path = sub.path_info = path
+    sub.META = {
+        **{key: value for key, value in outer.META.items() if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH')},
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+    }
+    sub.GET = QueryDict(query)
+    sub.COOKIES = outer.COOKIES
+    if hasattr(outer, 'session'):
+        sub.session = outer.session
+    sub.user = request.user
+    # DRF uses these instead of running the authentication classes again
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+    return sub
+
+
+def collect_batch_metrics():
+    with _lock:
+        snapshot = dict(stats)
+    return [
+        ('api_batch_requests_total', 'Batch requests served.', 'counter', {'': snapshot['batches']}),
+        ('api_batch_subrequests_total', 'Sub-requests run by batch requests.', 'counter', {
+            'mode="sequential"': snapshot['sequential'],
+            'mode="parallel"': snapshot['parallel'],
+        }),
+    ]
+
+
+registry.register_collector(collect_batch_metrics)
@@ -0,0 +1,186 @@
+"""
+In-process API benchmark runner.
+
+Drives endpoints through DRF's ``APIClient`` (full URL routing, middleware,
+authentication and rendering, no network) and reports throughput, latency
+percentiles and SQL query counts. Used by ``manage.py run_benchmark``.
+``measure_formats`` compares response formats and compressions for
+``manage.py benchmark_formats``.
+"""
+import json
+import platform
+import statistics
+import subprocess
+import time
+from contextlib import ExitStack
+
+import django
+from django.db import connections
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .middleware import QueryRecorder
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(name, path, latencies, queries, errors, elapsed):
+    ordered = sorted(latencies)
+    return {
+        'name': name,
+        'path': path,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'mean': round(statistics.fmean(ordered) * 1000, 3) if ordered else 0.0,
+            'p50': round(percentile(ordered, 50) * 1000, 3),
+            'p95': round(percentile(ordered, 95) * 1000, 3),
+            'p99': round(percentile(ordered, 99) * 1000, 3),
+            'max': round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        },
+        'queries': {
+            'mean': round(statistics.fmean(queries), 2) if queries else 0.0,
+            'max': max(queries, default=0),
+        },
+    }
+
+
+def run_endpoint(client, name, path, iterations, warmup=2, method='get', data=None):
+    """Hit ``path`` ``iterations`` times and summarize the timings."""
+    call = getattr(client, method)
+    for _ in range(warmup):
+        call(path, data, format='json')
+
+    latencies, queries, errors = [], [], 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        counter = QueryRecorder(sample_size=0)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            start = time.perf_counter()
+            response = call(path, data, format='json')
+            latencies.append(time.perf_counter() - start)
+        queries.append(counter.count)
+        if response.status_code >= 400:
+            errors += 1
+    return summarize(name, path, latencies, queries, errors, time.perf_counter() - started)
+
+
+def timed(fn, repeat):
+    """Median milliseconds of ``repeat`` calls to ``fn``."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return round(statistics.median(durations) * 1000, 3)
+
+
+def measure_formats(name, path, data, repeat=20):
+    """
+    Size and CPU cost of a response's ``data`` in each format and encoding.
+
+    Per row: ``bytes`` on the wire, ``encode_ms`` to render, ``compress_ms``
+    to compress, ``cached_ms`` for a body the compressed-body cache already
+    holds, and ``decode_ms`` for the client to decompress and parse.
+    """
+    import msgpack
+    from rest_framework.renderers import JSONRenderer
+
+    from .compression import CODECS, CompressedBodyCache, compress, decompress
+    from .formats import pack
+
+    formats = {
+        'json': (lambda: JSONRenderer().render(data), json.loads),
+        'msgpack': (lambda: pack(data), lambda body: msgpack.unpackb(body, raw=False)),
+    }
+    baseline = None
+    rows = []
+    for fmt, (encode, parse) in formats.items():
+        body = encode()
+        encode_ms = timed(encode, repeat)
+        baseline = baseline or len(body)
+        rows.append({
+            'format': fmt, 'encoding': 'identity', 'bytes': len(body),
+            'ratio': round(len(body) / baseline, 3), 'encode_ms': encode_ms,
+            'compress_ms': 0.0, 'cached_ms': 0.0, 'decode_ms': timed(lambda: parse(body), repeat),
+        })
+        for encoding in CODECS:
+            compressed = compress(body, encoding)
+            cache = CompressedBodyCache()
+            cache.compress(body, encoding)
+            rows.append({
+                'format': fmt, 'encoding': encoding, 'bytes': len(compressed),
+                'ratio': round(len(compressed) / baseline, 3), 'encode_ms': encode_ms,
+                'compress_ms': timed(lambda: compress(body, encoding), repeat),
+                'cached_ms': timed(lambda: cache.compress(body, encoding), repeat),
+                'decode_ms': timed(lambda: parse(decompress(compressed, encoding)), repeat),
+            })
+    return {'name': name, 'path': path, 'formats': rows}
+
+
+def benchmark_client(user=None):
+    """APIClient that reports server errors as 500s instead of raising."""
+    from rest_framework.authtoken.models import Token
+
+    client = APIClient(raise_request_exception=False)
+    if user is not None:
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return client
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(results, dataset):
+    return {
+        'timestamp': timezone.now().isoformat(),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connections['default'].vendor,
+        'dataset': dataset,
+        'results': results,
+    }
+
+
+def compare_reports(current, baseline):
+    """Return ``{name: {metric: percent change}}`` for endpoints in both reports."""
+    previous = {r['name']: r for r in baseline.get('results', [])}
+    changes = {}
+    for result in current['results']:
+        before = previous.get(result['name'])
+        if before is None:
+            continue
+        changes[result['name']] = {
+            'p50': pct_change(before['latency_ms']['p50'], result['latency_ms']['p50']),
+            'p95': pct_change(before['latency_ms']['p95'], result['latency_ms']['p95']),
+            'throughput': pct_change(before['throughput_rps'], result['throughput_rps']),
+            'queries': pct_change(before['queries']['mean'], result['queries']['mean']),
+        }
+    return changes
+
+
+def pct_change(before, after):
+    if not before:
+        return 0.0
+    return round((after - before) / before * 100, 1)
+
+
+def write_report(report, path):
+    with open(path, 'w') as fh:
+        json.dump(report, fh, indent=2)
@@ -0,0 +1,106 @@
+"""
+Category tree helpers.
+
+Categories keep a materialized ``path`` of zero-padded ids ("000001/000007/")
+so a whole subtree is one indexed range scan, and a denormalized
+``available_item_count`` of their own available items. Counts are kept in
+step by the ``Item`` signals in ``core.signals``; bulk writes that bypass
+signals call ``recount_categories``.
+"""
+from django.core.cache import cache
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Concat, Substr
+
+from .models import Category, Item
+
+PATH_WIDTH = 6
+TREE_CACHE_KEY = 'core:category-tree'
+TREE_CACHE_TIMEOUT = 300
+
+
+def path_segment(pk):
+    return f'{pk:0{PATH_WIDTH}d}/'
+
+
+def subtree_filter(path, field='path'):
+    """Everything whose ``field`` starts with ``path``, as an index-friendly range."""
+    return Q(**{f'{field}__gte': path, f'{field}__lt': path + '~'})
+
+
+def sync_category_path(category):
+    """Store the category's path/depth and move its descendants along with it."""
+    parent_path, parent_depth = '', -1
+    if category.parent_id:
+        parent_path, parent_depth = Category.objects.filter(pk=category.parent_id).values_list('path', 'depth').get()
+    path = parent_path + path_segment(category.pk)
+    depth = parent_depth + 1
+    old_path, old_depth = category.path, category.depth
+    if path == old_path and depth == old_depth:
+        return
+
+    Category.objects.filter(pk=category.pk).update(path=path, depth=depth)
+    if old_path:
+        Category.objects.filter(subtree_filter(old_path)).exclude(pk=category.pk).update(
+            path=Concat(Value(path), Substr('path', len(old_path) + 1)),
+            depth=F('depth') + (depth - old_depth),
+        )
+    category.path, category.depth = path, depth
+
+
+def is_descendant(category, candidate_parent):
+    """True when ``candidate_parent`` is ``category`` itself or inside its subtree."""
+    return bool(category.path) and candidate_parent.path.startswith(category.path)
+
+
+def counted_category_id(item):
+    return item.category_id if item.is_available else None
+
+
+def adjust_count(category_id, delta):
+    if category_id is not None:
+        Category.objects.filter(pk=category_id).update(available_item_count=F('available_item_count') + delta)
+
+
+def recount_categories(category_ids=None):
+    """Recompute available item counts with one set-based UPDATE."""
+    counts = (
+        Item.objects.filter(category=OuterRef('pk'), is_available=True)
+        .order_by().values('category').annotate(count=Count('pk')).values('count')
+    )
+    queryset = Category.objects.all()
+    if category_ids is not None:
+        queryset = queryset.filter(pk__in=category_ids)
+    queryset.update(available_item_count=Coalesce(Subquery(counts), 0))
+    invalidate_category_tree()
+
+
+def build_category_tree():
+    rows = Category.objects.order_by('path').values('id', 'name', 'parent_id', 'depth', 'available_item_count')
+    nodes, roots = {}, []
+    for row in rows:
+        node = {
+            'id': row['id'],
+            'name': row['name'],
+            'depth': row['depth'],
+            'item_count': row['available_item_count'],
+            'total_item_count': row['available_item_count'],
+            'children': [],
+        }
+        nodes[row['id']] = (node, row['parent_id'])
+        # Ordering by path guarantees parents come first
+        parent = nodes.get(row['parent_id'])
+        (parent[0]['children'] if parent else roots).append(node)
+
+    for node, parent_id in reversed(list(nodes.values())):
+        parent = nodes.get(parent_id)
+        if parent:
+            parent[0]['total_item_count'] += node['total_item_count']
+    return roots
+
+
+def get_category_tree():
+    return cache.get_or_set(TREE_CACHE_KEY, build_category_tree, TREE_CACHE_TIMEOUT)
+
+
+def invalidate_category_tree():
+    cache.delete(TREE_CACHE_KEY)
@@ -0,0 +1,182 @@
+"""
+Response compression with a cache of compressed bodies.
+
+``CompressionMiddleware`` (core/middleware.py) compresses responses for
+clients that accept it. Among the encodings the ``Accept-Encoding`` header
+allows, it takes the one with the highest q-value, and on a tie the first
+in ``ENCODINGS``: zstd, then brotli, then gzip. Bodies under ``MIN_SIZE``
+bytes are sent as they are, as are streaming responses, responses that
+already have an encoding, and types that are compressed already, such as
+images.
+
+Compressing a long list takes milliseconds (``manage.py
+benchmark_formats`` compares the codecs), and many responses repeat byte
+for byte, like the item list every anonymous visitor sees.
+``body_cache`` keeps compressed bodies in a bounded LRU keyed by a
+SHA-256 digest of the uncompressed body and the encoding. A repeated
+response then costs one hash instead of one compression. brotli and zstd
+are offered when their packages are installed; gzip always is.
+"""
+import gzip
+import hashlib
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+
+from .metrics import registry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULTS = {
+    'ENABLED': True,
+    'ENCODINGS': ['zstd', 'br', 'gzip'],  # preference order when the client rates several equally
+    'LEVELS': {'zstd': 3, 'br': 4, 'gzip': 6},
+    'MIN_SIZE': 1024,                     # smaller bodies gain less than the header costs
+    'CACHE_ENTRIES': 512,
+    'CACHE_MAX_BYTES': 32 * 1024 * 1024,
+}
+COMPRESSIBLE_TYPES = re.compile(r'(text/|application/(json|msgpack|javascript|xml)|image/svg\+xml)', re.IGNORECASE)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'COMPRESSION', {})}
+
+
+CODECS = {'gzip': lambda body, level: gzip.compress(body, compresslevel=level, mtime=0)}
+DECOMPRESSORS = {'gzip': gzip.decompress}
+if brotli is not None:
+    CODECS['br'] = lambda body, level: brotli.compress(body, quality=level)
+    DECOMPRESSORS['br'] = brotli.decompress
+if zstandard is not None:
+    # Compressor objects aren't thread-safe, and creating one is cheap next to compressing
+    CODECS['zstd'] = lambda body, level: zstandard.ZstdCompressor(level=level).compress(body)
+    DECOMPRESSORS['zstd'] = lambda body: zstandard.ZstdDecompressor().decompress(body)
+
+
+def available_encodings():
+    return [encoding for encoding in get_config()['ENCODINGS'] if encoding in CODECS]
+
+
+def compress(body, encoding):
+    level = get_config()['LEVELS'].get(encoding, DEFAULTS['LEVELS'][encoding])
+    return CODECS[encoding](body, level)
+
+
+def decompress(body, encoding):
+    return DECOMPRESSORS[encoding](body)
+
+
+def negotiate(header, encodings):
+    """The encoding of ``encodings`` that ``header`` (``Accept-Encoding``) rates highest, or ``None``."""
+    ratings = {}
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ratings[name] = quality
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = ratings.get(encoding, ratings.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compressible(response):
+    return (
+        not response.streaming
+        and response.status_code not in (204, 304)
+        and not response.has_header('Content-Encoding')
+        and COMPRESSIBLE_TYPES.match(response.get('Content-Type', '')) is not None
+    )
+
+
+class CompressedBodyCache:
+    """Thread-safe LRU of ``(body digest, encoding) -> compressed body``, bounded by count and bytes."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        self.stats = dict.fromkeys(('hits', 'misses', 'evictions'), 0)
+
+    def compress(self, body, encoding):
+        key = (hashlib.sha256(body).digest(), encoding)
+        with self._lock:
+            compressed = self._entries.get(key)
+            if compressed is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return compressed
+
+        compressed = compress(body, encoding)
+        config = get_config()
+        with self._lock:
+            self.stats['misses'] += 1
+            if key not in self._entries and len(compressed) <= config['CACHE_MAX_BYTES']:
+                self._entries[key] = compressed
+                self._bytes += len(compressed)
+            while self._entries and (
+                len(self._entries) > config['CACHE_ENTRIES'] or self._bytes > config['CACHE_MAX_BYTES']
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.stats['evictions'] += 1
+        return compressed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+body_cache = CompressedBodyCache()
+_lock = threading.Lock()
+responses = Counter()
+byte_counts = Counter()
+
+
+def record(encoding, before, after):
+    with _lock:
+        responses[encoding] += 1
+        byte_counts['uncompressed'] += before
+        byte_counts['compressed'] += after
+
+
+def collect_compression_metrics():
+    with _lock:
+        counts, sizes = dict(responses), dict(byte_counts)
+    return [
+        ('http_compressed_responses_total', 'Responses sent compressed by encoding.', 'counter',
+         {f'encoding="{encoding}"': counts.get(encoding, 0) for encoding in CODECS}),
+        ('http_compression_bytes_total', 'Body bytes of compressed responses before and after compression.', 'counter',
+         {f'stage="{stage}"': sizes.get(stage, 0) for stage in ('uncompressed', 'compressed')}),
+        ('http_compression_cache_total', 'Compressed bodies served from the cache or compressed anew.', 'counter',
+         {'result="hit"': body_cache.stats['hits'], 'result="miss"': body_cache.stats['misses']}),
+        ('http_compression_cache_evictions_total', 'Compressed bodies evicted from the cache.', 'counter',
+         {'': body_cache.stats['evictions']}),
+    ]
+
+
+registry.register_collector(collect_compression_metrics)
@@ -0,0 +1,221 @@
+"""
+Offline geocoding and geohash helpers for item proximity search.
+
+Locations are resolved against the bundled gazetteer in
+``core/data/gazetteer.csv``; there is no network geocoder. Items store a
+geohash next to their coordinates so radius and bounding-box queries become
+a handful of indexed range scans (``geohash >= 'w3g' AND geohash < 'w3g~'``)
+on any database, without PostGIS.
+"""
+import csv
+import math
+import re
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+
+from django.db.models import F, Q
+
+GAZETTEER_PATH = Path(__file__).resolve().parent / 'data' / 'gazetteer.csv'
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9          # ~5m cells, what we store per item
+MAX_COVER_CELLS = 16           # upper bound on range scans per query
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def normalize(name):
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9\- ]+', ' ', name.lower()).strip()
+
+
+@lru_cache(maxsize=1)
+def load_gazetteer():
+    places = {}
+    with open(GAZETTEER_PATH, newline='') as fh:
+        for row in csv.DictReader(fh):
+            coords = (float(row['latitude']), float(row['longitude']))
+            places[normalize(row['name'])] = coords
+            for alias in filter(None, row['aliases'].split('|')):
+                places[normalize(alias)] = coords
+    return places
+
+
+def geocode(location):
+    """
+    Resolve a free-text location to ``(latitude, longitude)`` or ``None``.
+
+    Tries the whole string first, then each comma separated part, so
+    "Makati, Metro Manila" resolves to Makati rather than Manila.
+    """
+    if not location:
+        return None
+    places = load_gazetteer()
+    candidates = [location] + location.split(',')
+    for candidate in candidates:
+        coords = places.get(normalize(candidate))
+        if coords:
+            return coords
+    return None
+
+
+def locate_item(item):
+    """
+    Fill ``latitude``/``longitude``/``geohash`` on an (unsaved) item.
+
+    A location found in the gazetteer wins; otherwise coordinates supplied
+    by the client are kept. A saved item whose location changed to an
+    unknown place loses the coordinates of its old one.
+    """
+    coords = geocode(item.location)
+    if coords:
+        item.latitude, item.longitude = coords
+    else:
+        saved = getattr(item, '_saved_place', None)
+        if saved and saved[0] != item.location and saved[1:] == (item.latitude, item.longitude):
+            item.latitude = item.longitude = None
+    if item.latitude is not None and item.longitude is not None:
+        item.geohash = encode_geohash(item.latitude, item.longitude)
+    else:
+        item.geohash = None
+    item._saved_place = (item.location, item.latitude, item.longitude)
+
+
+def check_coordinates(latitude, longitude):
+    # NaN fails every comparison, and infinities are out of range
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('Coordinates out of range.')
+
+
+def parse_point(value):
+    """Parse ``"lat,lon"`` or a gazetteer place name. Raises ``ValueError``."""
+    parts = value.split(',')
+    if len(parts) == 2:
+        try:
+            latitude, longitude = float(parts[0]), float(parts[1])
+        except ValueError:
+            pass
+        else:
+            check_coordinates(latitude, longitude)
+            return latitude, longitude
+    coords = geocode(value)
+    if coords is None:
+        raise ValueError(f'Unknown location "{value}".')
+    return coords
+
+
+def parse_bbox(value):
+    """Parse ``"min_lon,min_lat,max_lon,max_lat"`` into ``(min_lat, min_lon, max_lat, max_lon)``. Raises ``ValueError``."""
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise ValueError('bbox must be min_lon,min_lat,max_lon,max_lat.')
+    min_lon, min_lat, max_lon, max_lat = (float(part) for part in parts)
+    check_coordinates(min_lat, min_lon)
+    check_coordinates(max_lat, max_lon)
+    if min_lat > max_lat or min_lon > max_lon:
+        raise ValueError('bbox must be min_lon,min_lat,max_lon,max_lat.')
+    return min_lat, min_lon, max_lat, max_lon
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Return ``(lat_degrees, lon_degrees)`` covered by one geohash cell."""
+    total_bits = precision * 5
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Return ``(min_lat, min_lon, max_lat, max_lon)`` enclosing the circle."""
+    lat_delta = radius_km / KM_PER_DEGREE
+    cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+    lon_delta = min(radius_km / (KM_PER_DEGREE * cos_lat), 180.0)
+    return (
+        max(latitude - lat_delta, -90.0), max(longitude - lon_delta, -180.0),
+        min(latitude + lat_delta, 90.0), min(longitude + lon_delta, 180.0),
+    )
+
+
+def covering_cells(min_lat, min_lon, max_lat, max_lon):
+    """
+    Geohash prefixes that together cover the box.
+
+    Uses the finest precision that needs at most ``MAX_COVER_CELLS`` cells,
+    so each query is a few narrow index ranges.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_step, lon_step = cell_size(precision)
+        rows = math.floor(max_lat / lat_step) - math.floor(min_lat / lat_step) + 1
+        cols = math.floor(max_lon / lon_step) - math.floor(min_lon / lon_step) + 1
+        if rows * cols <= MAX_COVER_CELLS:
+            break
+
+    cells = set()
+    lat = min_lat
+    while True:
+        lon = min_lon
+        while True:
+            cells.add(encode_geohash(lat, lon, precision))
+            if lon >= max_lon:
+                break
+            lon = min(lon + lon_step, max_lon)
+        if lat >= max_lat:
+            break
+        lat = min(lat + lat_step, max_lat)
+    return sorted(cells)
+
+
+def geohash_filter(cells, field='geohash'):
+    """OR of index-friendly ``prefix <= value < prefix~`` range conditions."""
+    condition = Q()
+    for cell in cells:
+        condition |= Q(**{f'{field}__gte': cell, f'{field}__lt': cell + '~'})
+    return condition
+
+
+def bbox_filter(min_lat, min_lon, max_lat, max_lon):
+    cells = covering_cells(min_lat, min_lon, max_lat, max_lon)
+    return geohash_filter(cells) & Q(
+        latitude__gte=min_lat, latitude__lte=max_lat,
+        longitude__gte=min_lon, longitude__lte=max_lon,
+    )
+
+
+def distance_sq_expression(latitude, longitude):
+    """
+    Squared equirectangular distance in km², using only arithmetic so it runs
+    in SQL on every backend. Accurate enough for ranking and for radii up to
+    a few hundred km.
+    """
+    lon_scale = KM_PER_DEGREE * math.cos(math.radians(latitude))
+    dlat = (F('latitude') - latitude) * KM_PER_DEGREE
+    dlon = (F('longitude') - longitude) * lon_scale
+    return dlat * dlat + dlon * dlon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
@@ -0,0 +1,91 @@
+"""
+Scan-to-confirm for in-person handovers and returns.
+
+Every request has a unique handover code, valid while it is ``Paid``, and
+a unique return code, valid while it is ``InHand``. ``scan`` needs only
+the code. One conditional UPDATE finds the request through the code's
+unique index and moves it on, so there is no separate lookup first.
+On PostgreSQL and SQLite 3.35+, which support ``UPDATE ... RETURNING``,
+that UPDATE also reports which row changed; other databases lock the row
+with a SELECT first. The UPDATE bypasses the model signals, so the
+status log entry, notification and availability sync are done here, in
+the same transaction.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .availability import invalidate_occupancy, sync_availability
+from .models import CODE_LENGTH, Item, RentalRequest, RequestStatusChange
+
+# (code field, status it is valid in, status it moves the request to)
+TRANSITIONS = (
+    ('handover_code', 'Paid', 'InHand'),
+    ('return_code', 'InHand', 'Returned'),
+)
+SEPARATORS = re.compile(r'[\s-]+')
+
+
+def normalize_code(code):
+    """Scanners and people add spaces, dashes and lowercase; codes have none of them."""
+    return SEPARATORS.sub('', str(code or '')).upper()
+
+
+def scan(code, user_id):
+    """
+    Apply the transition ``code`` unlocks, if ``user_id`` takes part in the request.
+
+    Returns the updated ``RentalRequest``, or ``None`` if the code matches
+    no request in the right status.
+    """
+    code = normalize_code(code)
+    if len(code) != CODE_LENGTH:
+        return None
+    for field, from_status, to_status in TRANSITIONS:
+        with transaction.atomic():
+            pk = transition(field, code, from_status, to_status, str(user_id))
+            if pk is None:
+                continue
+            RequestStatusChange.objects.create(
+                rental_request_id=pk, from_status=from_status, to_status=to_status, source='scan',
+            )
+            rental_request = RentalRequest.objects.select_related('item').get(pk=pk)
+            notification = rental_request.lifecycle_notification()
+            if notification is not None:
+                notification.save()
+            invalidate_occupancy(rental_request.item_id)
+            sync_availability(Item.objects.filter(pk=rental_request.item_id))
+            return rental_request
+    return None
+
+
+def update_returning():
+    """Whether the connection supports ``UPDATE ... RETURNING`` (MariaDB only has it on INSERT and DELETE)."""
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+
+
+def transition(field, code, from_status, to_status, user_id):
+    """Move the request with ``field == code`` from ``from_status`` to ``to_status``; returns its id."""
+    if not update_returning():
+        pk = (
+            RentalRequest.objects.select_for_update()
+            .filter(Q(requester_id=user_id) | Q(owner_id=user_id), **{field: code}, status=from_status)
+            .values_list('pk', flat=True).first()
+        )
+        if pk is not None:
+            RentalRequest.objects.filter(pk=pk, status=from_status).update(status=to_status)
+        return pk
+
+    qn = connection.ops.quote_name
+    sql = (
+        f"UPDATE {qn(RentalRequest._meta.db_table)} SET {qn('status')} = %s "
+        f"WHERE {qn(field)} = %s AND {qn('status')} = %s AND ({qn('requester_id')} = %s OR {qn('owner_id')} = %s) "
+        f"RETURNING {qn('id')}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [to_status, code, from_status, user_id, user_id])
+        row = cursor.fetchone()
+    return row[0] if row else None
@@ -0,0 +1,190 @@
+"""
+Rental request status history.
+
+Every status change appends a ``RequestStatusChange`` row in the same
+transaction as the change. ``RentalRequest.save()`` logs single changes.
+Set-based changes go through ``change_status``, which locks a batch of
+requests, logs their transitions and updates them together.
+
+The analytics are computed in the database with window functions over the
+log, so they cost one query however many requests they cover.
+``LEAD(changed_at)`` over a request's rows gives the moment it left each
+status. A running ``MAX`` gives the latest time it entered a given status
+before each later transition. Only requests with transitions inside the
+requested period are read, through the ``(to_status, changed_at)`` and
+``(rental_request, changed_at)`` indexes.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import NotSupportedError, connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import Lead
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import RentalRequest, RequestStatusChange
+
+DEFAULT_DAYS = 30
+STATUSES = frozenset(status for status, _ in RentalRequest.STATUS_CHOICES)
+# SQL for the seconds from ``start`` to ``end`` per database vendor
+SECONDS_BETWEEN = {
+    'sqlite': "(julianday({end}) - julianday({start})) * 86400.0",
+    'postgresql': "EXTRACT(EPOCH FROM ({end} - {start}))",
+    'mysql': "TIMESTAMPDIFF(MICROSECOND, {start}, {end}) / 1000000.0",
+}
+
+
+def change_status(queryset, status, source, batch_size=1000):
+    """
+    Set ``status`` on the requests in ``queryset`` and log each transition.
+
+    ``batch_size`` requests are locked, logged and updated per transaction.
+    Returns the ids of the requests that changed. Like ``update()``, this
+    sends no model signals.
+    """
+    queryset = queryset.exclude(status=status).order_by('pk')
+    changed = []
+    while True:
+        with transaction.atomic():
+            rows = list(queryset.select_for_update().values_list('pk', 'status')[:batch_size])
+            if not rows:
+                return changed
+            now = timezone.now()
+            RequestStatusChange.objects.bulk_create([
+                RequestStatusChange(rental_request_id=pk, from_status=old, to_status=status, changed_at=now, source=source)
+                for pk, old in rows
+            ])
+            ids = [pk for pk, _ in rows]
+            RentalRequest.objects.filter(pk__in=ids).update(status=status)
+        changed.extend(ids)
+
+
+def timeline(rental_request):
+    """The request's transitions, oldest first, with how long it stayed in each status."""
+    changes = (
+        rental_request.status_changes
+        .annotate(left_at=Window(Lead('changed_at'), order_by=[F('changed_at').asc(), F('pk').asc()]))
+        .order_by('changed_at', 'pk')
+        .values('from_status', 'to_status', 'changed_at', 'left_at', 'source')
+    )
+    return [
+        {
+            'from': change['from_status'] or None,
+            'to': change['to_status'],
+            'at': change['changed_at'],
+            'source': change['source'],
+            'seconds': (change['left_at'] - change['changed_at']).total_seconds() if change['left_at'] else None,
+        }
+        for change in changes
+    ]
+
+
+def parse_stats_params(params, today):
+    """
+    Read ``since``/``until`` (inclusive dates) and the optional ``from``/``to`` statuses.
+
+    Returns ``(since, until, from_status, to_status)``, with ``until``
+    exclusive. The dates default to the last 30 days. Raises ``ValueError``.
+    """
+    since = parse_date(params['since']) if params.get('since') else today - timedelta(days=DEFAULT_DAYS - 1)
+    until = parse_date(params['until']) if params.get('until') else today
+    if since is None or until is None:
+        raise ValueError('since and until must be YYYY-MM-DD dates.')
+    if until < since:
+        raise ValueError('until must not be before since.')
+    from_status, to_status = params.get('from'), params.get('to')
+    if bool(from_status) != bool(to_status):
+        raise ValueError('from and to must be given together.')
+    if from_status and (from_status not in STATUSES or to_status not in STATUSES or from_status == to_status):
+        raise ValueError(f'from and to must be two different statuses out of: {", ".join(sorted(STATUSES))}.')
+    start = timezone.make_aware(datetime.combine(since, time.min))
+    end = timezone.make_aware(datetime.combine(until + timedelta(days=1), time.min))
+    return start, end, from_status, to_status
+
+
+def seconds_between(start, end):
+    try:
+        return SECONDS_BETWEEN[connection.vendor].format(start=start, end=end)
+    except KeyError:
+        raise NotSupportedError(f'Status analytics are not supported on {connection.vendor}.')
+
+
+def seconds(value):
+    # julianday() arithmetic is only exact to about a millisecond
+    return round(value, 3) if value is not None else None
+
+
+def adapt(since, until):
+    return connection.ops.adapt_datetimefield_value(since), connection.ops.adapt_datetimefield_value(until)
+
+
+def time_in_status(since, until):
+    """
+    Per status, the requests that entered it in ``[since, until)``.
+
+    Returns rows ``{'status', 'entered', 'left', 'avg_seconds', 'max_seconds'}``.
+    The times only count requests that have already left the status.
+    """
+    table = RequestStatusChange._meta.db_table
+    sql = f"""
+        WITH spans AS (
+            SELECT to_status, changed_at,
+                   LEAD(changed_at) OVER (PARTITION BY rental_request_id ORDER BY changed_at, id) AS left_at
+            FROM {table}
+            WHERE rental_request_id IN (
+                SELECT rental_request_id FROM {table} WHERE changed_at >= %s AND changed_at < %s
+            )
+        ), durations AS (
+            SELECT to_status, left_at, {seconds_between('changed_at', 'left_at')} AS seconds
+            FROM spans WHERE changed_at >= %s AND changed_at < %s
+        )
+        SELECT to_status, COUNT(*), COUNT(left_at), AVG(seconds), MAX(seconds)
+        FROM durations GROUP BY to_status ORDER BY to_status
+    """
+    since, until = adapt(since, until)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [since, until, since, until])
+        return [
+            {
+                'status': status, 'entered': entered, 'left': left,
+                'avg_seconds': seconds(avg), 'max_seconds': seconds(longest),
+            }
+            for status, entered, left, avg, longest in cursor.fetchall()
+        ]
+
+
+def transition_time(from_status, to_status, since, until):
+    """
+    How long requests took to get from ``from_status`` to ``to_status``.
+
+    Each move into ``to_status`` during ``[since, until)`` counts once. It is
+    measured from the most recent earlier entry into ``from_status``; a move
+    with no such entry is left out. Returns
+    ``{'count', 'avg_seconds', 'min_seconds', 'max_seconds'}``.
+    """
+    table = RequestStatusChange._meta.db_table
+    sql = f"""
+        WITH steps AS (
+            SELECT to_status, changed_at,
+                   MAX(CASE WHEN to_status = %s THEN changed_at END) OVER (
+                       PARTITION BY rental_request_id ORDER BY changed_at, id ROWS UNBOUNDED PRECEDING
+                   ) AS entered_at
+            FROM {table}
+            WHERE rental_request_id IN (
+                SELECT rental_request_id FROM {table} WHERE to_status = %s AND changed_at >= %s AND changed_at < %s
+            )
+        ), durations AS (
+            SELECT {seconds_between('entered_at', 'changed_at')} AS seconds
+            FROM steps
+            WHERE to_status = %s AND changed_at >= %s AND changed_at < %s AND entered_at IS NOT NULL
+        )
+        SELECT COUNT(*), AVG(seconds), MIN(seconds), MAX(seconds) FROM durations
+    """
+    since, until = adapt(since, until)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [from_status, to_status, since, until, to_status, since, until])
+        count, avg, shortest, longest = cursor.fetchone()
+    return {
+        'count': count, 'avg_seconds': seconds(avg),
+        'min_seconds': seconds(shortest), 'max_seconds': seconds(longest),
+    }
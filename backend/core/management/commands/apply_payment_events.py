@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.payments import apply_events, get_config
+
+
+class Command(BaseCommand):
+    help = 'Apply queued payment webhook events to transactions and rental requests in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Events per transaction (default PAYMENTS["BATCH_SIZE"])')
+        parser.add_argument('--loop', action='store_true', help='Keep polling the queue')
+
+    def handle(self, *args, **options):
+        while True:
+            report = apply_events(options['batch_size'])
+            if report or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Applied {report['Applied']} events, ignored {report['Ignored']}, failed {report['Failed']}"
+                ))
+            if not options['loop']:
+                break
+            if not report:
+                time.sleep(get_config()['INTERVAL_SECONDS'])
@@ -0,0 +1,31 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.archive import ARCHIVERS, archive_history, get_config, pending_counts
+
+
+class Command(BaseCommand):
+    help = 'Move old messages and read notifications into compressed archive segments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=sorted(ARCHIVERS), action='append', help='Limit to one kind (repeatable)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows would move')
+        parser.add_argument('--loop', action='store_true', help='Keep running every ARCHIVE["INTERVAL_MINUTES"]')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            for kind, count in pending_counts().items():
+                self.stdout.write(f'{kind}: {count} rows would be archived')
+            return
+
+        while True:
+            for kind, (rows, segments) in archive_history(options['kind']).items():
+                self.stdout.write(self.style.SUCCESS(f'{kind}: archived {rows} rows into {segments} segments'))
+            if not options['loop']:
+                break
+            interval = get_config()['INTERVAL_MINUTES'] * 60
+            self.stdout.write(f'Next run at {timezone.now() + timedelta(seconds=interval):%Y-%m-%d %H:%M}')
+            time.sleep(interval)
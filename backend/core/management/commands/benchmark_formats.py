@@ -0,0 +1,63 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test.utils import override_settings
+
+from core.benchmark import benchmark_client, build_report, measure_formats, write_report
+from core.models import Conversation, Item, Message, RentalRequest
+from core.throttling import get_config as throttling_config
+
+
+class Command(BaseCommand):
+    help = 'Compare JSON and MessagePack, each uncompressed and with gzip/brotli/zstd, on real API lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per measurement (the median is kept)')
+        parser.add_argument('--output', default='benchmark-formats.json')
+
+    def handle(self, *args, **options):
+        busiest = (
+            RentalRequest.objects.values('requester_id')
+            .annotate(n=Count('id')).order_by('-n').first()
+        )
+        if busiest is None:
+            raise CommandError('No data to benchmark. Run "manage.py seed_benchmark" first.')
+        user = User.objects.get(id=busiest['requester_id'])
+        conversation = Conversation.objects.annotate(n=Count('messages')).order_by('-n').first()
+
+        anonymous = benchmark_client()
+        client = benchmark_client(user)
+        endpoints = [
+            ('items-list', anonymous, '/api/items/'),
+            ('requests-list', client, '/api/requests/'),
+        ]
+        membership = conversation.memberships.first() if conversation is not None else None
+        if membership is not None:
+            participant = benchmark_client(User.objects.get(id=membership.user_id))
+            endpoints.append(('messages-list', participant, f'/api/messages/?conversation_id={conversation.id}'))
+
+        results = []
+        for name, api_client, path in endpoints:
+            with override_settings(THROTTLING={**throttling_config(), 'ENABLED': False}):
+                response = api_client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f'{path} answered {response.status_code}.')
+            result = measure_formats(name, path, response.data, options['repeat'])
+            results.append(result)
+            self.stdout.write(f'{name} ({len(response.data)} rows)')
+            for row in result['formats']:
+                self.stdout.write(
+                    f"  {row['format']:<8} {row['encoding']:<9} {row['bytes']:>10,} B  {row['ratio']:>6.3f}x  "
+                    f"encode {row['encode_ms']:>8.3f}ms  compress {row['compress_ms']:>8.3f}ms  "
+                    f"cached {row['cached_ms']:>7.3f}ms  decode {row['decode_ms']:>8.3f}ms"
+                )
+
+        report = build_report(results, {
+            'items': Item.objects.count(),
+            'requests': RentalRequest.objects.count(),
+            'messages': Message.objects.count(),
+            'user_id': user.id,
+            'repeat': options['repeat'],
+        })
+        write_report(report, options['output'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
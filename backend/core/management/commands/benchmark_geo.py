@@ -0,0 +1,122 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.benchmark import percentile, write_report
+from core.categories import recount_categories
+from core.geo import (
+    bbox_filter, bounding_box, distance_sq_expression, encode_geohash, load_gazetteer,
+)
+from core.models import Category, Item
+
+OWNER_ID = 'bench_geo'
+PH_BOUNDS = (5.0, 117.0, 19.0, 127.0)  # min_lat, min_lon, max_lat, max_lon
+
+
+class Command(BaseCommand):
+    help = 'Benchmark proximity search (geohash index vs full scan) over a large synthetic item table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--radius-km', type=float, default=5.0)
+        parser.add_argument('--limit', type=int, default=50, help='Results per query, like one API page')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=7)
+        parser.add_argument('--skip-scan', action='store_true', help="Don't run the unindexed baseline")
+        parser.add_argument('--cleanup', action='store_true', help='Delete the synthetic items afterwards')
+        parser.add_argument('--output', default='benchmark-geo.json')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        cities = list(set(load_gazetteer().values()))
+
+        existing = Item.objects.filter(owner_id=OWNER_ID).count()
+        if existing < options['items']:
+            self.seed(rng, cities, options['items'] - existing, options['batch_size'])
+
+        centers = [
+            (lat + rng.uniform(-0.05, 0.05), lon + rng.uniform(-0.05, 0.05))
+            for lat, lon in (rng.choice(cities) for _ in range(options['queries']))
+        ]
+        radius_km, limit = options['radius_km'], options['limit']
+
+        def indexed(lat, lon):
+            return (
+                Item.objects.filter(bbox_filter(*bounding_box(lat, lon, radius_km)))
+                .annotate(distance_sq=distance_sq_expression(lat, lon))
+                .filter(distance_sq__lte=radius_km ** 2)
+            )
+
+        def scan(lat, lon):
+            return (
+                Item.objects.annotate(distance_sq=distance_sq_expression(lat, lon))
+                .filter(distance_sq__lte=radius_km ** 2)
+            )
+
+        strategies = [('geohash', indexed)]
+        if not options['skip_scan']:
+            strategies.append(('full_scan', scan))
+
+        results = []
+        for name, build in strategies:
+            result = self.run(name, build, centers, limit)
+            results.append(result)
+            latency = result['latency_ms']
+            self.stdout.write(
+                f"{name:<10} p50 {latency['p50']:>8.2f}ms  p95 {latency['p95']:>8.2f}ms  "
+                f"p99 {latency['p99']:>8.2f}ms  avg results {result['mean_results']:.1f}"
+            )
+
+        write_report({
+            'items': Item.objects.filter(owner_id=OWNER_ID).count(),
+            'queries': options['queries'],
+            'radius_km': radius_km,
+            'limit': limit,
+            'results': results,
+        }, options['output'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options['cleanup']:
+            Item.objects.filter(owner_id=OWNER_ID).delete()
+
+    def seed(self, rng, cities, count, batch_size):
+        category, _ = Category.objects.get_or_create_by_name('Geo Benchmark')
+        min_lat, min_lon, max_lat, max_lon = PH_BOUNDS
+        self.stdout.write(f'Inserting {count} items...')
+        for offset in range(0, count, batch_size):
+            batch = []
+            for _ in range(min(batch_size, count - offset)):
+                # Most listings cluster around cities, the rest are spread out
+                if rng.random() < 0.7:
+                    lat, lon = rng.choice(cities)
+                    lat, lon = lat + rng.gauss(0, 0.1), lon + rng.gauss(0, 0.1)
+                else:
+                    lat, lon = rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)
+                batch.append(Item(
+                    name='Geo benchmark item', description='', price_per_day=1, category=category,
+                    owner_id=OWNER_ID, latitude=lat, longitude=lon, geohash=encode_geohash(lat, lon),
+                ))
+            with transaction.atomic():
+                Item.objects.bulk_create(batch, batch_size=batch_size)
+        recount_categories([category.id])
+
+    def run(self, name, build, centers, limit):
+        latencies, counts = [], []
+        for lat, lon in centers:
+            start = time.perf_counter()
+            ids = list(build(lat, lon).order_by('distance_sq').values_list('id', flat=True)[:limit])
+            latencies.append(time.perf_counter() - start)
+            counts.append(len(ids))
+        ordered = sorted(latencies)
+        return {
+            'name': name,
+            'latency_ms': {
+                'p50': round(percentile(ordered, 50) * 1000, 3),
+                'p95': round(percentile(ordered, 95) * 1000, 3),
+                'p99': round(percentile(ordered, 99) * 1000, 3),
+            },
+            'mean_results': sum(counts) / len(counts) if counts else 0.0,
+        }
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.similarity import build_similar_items, get_config
+
+
+class Command(BaseCommand):
+    help = 'Recompute "similar items" neighbour lists for items changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every listed item')
+        parser.add_argument('--loop', action='store_true', help='Keep rebuilding every --interval minutes')
+        parser.add_argument('--interval', type=float, default=None, help='Minutes between runs with --loop')
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or get_config()['INTERVAL_MINUTES']
+        while True:
+            report = build_similar_items(full=options['full'])
+            self.stdout.write(f"{report['items']} items reindexed, {report['neighbours']} neighbours stored")
+            if not options['loop']:
+                break
+            time.sleep(interval * 60)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.suggest import build_from_database, get_config, write_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Write the search suggestion snapshot that web processes load at startup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None, help="Snapshot file (default: SUGGEST['SNAPSHOT_PATH'])")
+
+    def handle(self, *args, **options):
+        path = options['path'] or get_config()['SNAPSHOT_PATH']
+        if not path:
+            raise CommandError("Set SUGGEST['SNAPSHOT_PATH'] or pass --path.")
+        index = build_from_database()
+        size = write_snapshot(index, path)
+        self.stdout.write(
+            f'{len(index.items.entries)} items, {len(index.categories.entries)} categories and '
+            f'{len(index.locations.entries)} locations written to {path} ({size} bytes)'
+        )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from core.storage import collect_blobs, recount_blobs
+
+
+class Command(BaseCommand):
+    help = 'Delete content-addressed image files no longer referenced, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--grace-hours', type=float, default=None, help='Keep released files this long (default: settings)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+        parser.add_argument('--recount', action='store_true', help='Recompute reference counts from the file fields first')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            fixed = recount_blobs(batch_size=options['batch_size'])
+            self.stdout.write(f'{fixed} reference counts corrected')
+        report = collect_blobs(
+            batch_size=options['batch_size'], grace_hours=options['grace_hours'], dry_run=options['dry_run'],
+        )
+        verb = 'would be' if options['dry_run'] else 'were'
+        self.stdout.write(
+            f"{report['deleted']} blobs ({report['bytes']} bytes) {verb} deleted, "
+            f"{report['repaired']} still referenced and repaired"
+        )
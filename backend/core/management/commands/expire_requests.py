@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
+from core.history import change_status
 from core.models import RentalRequest
 from datetime import timedelta
 
@@ -8,9 +9,9 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         threshold = timezone.now() - timedelta(hours=24)
-        expired_count = RentalRequest.objects.filter(
+        expired_count = len(change_status(RentalRequest.objects.filter(
             status='Pending', 
             requested_at__lt=threshold
-        ).update(status='Cancelled')
+        ), 'Cancelled', 'expire'))
         
         self.stdout.write(self.style.SUCCESS(f'Successfully cancelled {expired_count} expired requests'))
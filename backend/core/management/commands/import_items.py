@@ -0,0 +1,41 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.bulk import FORMATS, ItemImporter, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Bulk import items from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--owner', required=True, help='Owner user id or username')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--no-create-categories', action='store_true', help='Reject rows with unknown categories')
+        parser.add_argument('--dry-run', action='store_true', help='Validate without writing anything')
+
+    def handle(self, *args, **options):
+        owner = options['owner']
+        user = User.objects.filter(id=owner).first() if owner.isdigit() else None
+        user = user or User.objects.filter(username=owner).first()
+        if user is None:
+            raise CommandError(f'Unknown owner "{owner}"')
+
+        importer = ItemImporter(
+            owner_id=user.id,
+            batch_size=options['batch_size'],
+            create_categories=not options['no_create_categories'],
+            dry_run=options['dry_run'],
+        )
+        file_format = detect_format(options['path'], options['format'])
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as fh:
+                report = importer.run(read_rows(fh, file_format))
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        for error in report['errors']:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        verb = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {report['created']} items, {report['failed']} failed"))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.availability import drifted_items, sync_availability
+
+
+class Command(BaseCommand):
+    help = 'Recompute Item.is_available from listings and active rentals, fixing drift in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted items')
+        parser.add_argument('--loop', action='store_true', help='Keep reconciling every --interval minutes')
+        parser.add_argument('--interval', type=float, default=15, help='Minutes between runs with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            report = sync_availability(batch_size=options['batch_size'], dry_run=options['dry_run'])
+            verb = 'would be' if options['dry_run'] else 'were'
+            self.stdout.write(
+                f"{report['made_unavailable']} items {verb} marked unavailable, "
+                f"{report['made_available']} {verb} marked available"
+            )
+            if options['dry_run'] and options['verbosity'] > 1:
+                for label, queryset in zip(('unavailable', 'available'), drifted_items()):
+                    ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:50])
+                    self.stdout.write(f'  should be {label}: {ids}')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'] * 60)
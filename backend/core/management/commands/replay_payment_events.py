@@ -0,0 +1,77 @@
+import time
+import urllib.error
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+from core.benchmark import benchmark_client, summarize
+from core.models import PaymentEvent, RentalRequest
+from core.payments import PAYABLE_STATUSES, apply_events, fake_events, ingest_buffer, replay, webhook_enabled
+
+WEBHOOK_PATH = '/api/payments/webhook/'
+
+
+class Command(BaseCommand):
+    help = 'Play a fake payment provider: deliver a burst of webhook events for payable requests and time it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Payable rental requests to pay')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--duplicates', type=float, default=0.1, help='Share of events delivered twice')
+        parser.add_argument('--failures', type=float, default=0.1, help='Share of payments that fail first')
+        parser.add_argument('--refunds', type=float, default=0.05, help='Share of payments refunded')
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--url', help=f'Webhook URL of a running server (default: in-process {WEBHOOK_PATH})')
+        parser.add_argument('--apply', action='store_true', help='Run the queue worker afterwards and time it')
+
+    def handle(self, *args, **options):
+        if not options['url'] and not webhook_enabled():
+            raise CommandError('Set PAYMENT_WEBHOOK_SECRET (or PAYMENT_WEBHOOK_ALLOW_UNSIGNED=true) first.')
+        payable = list(
+            RentalRequest.objects.filter(status__in=PAYABLE_STATUSES).order_by('pk')
+            .values_list('pk', F('total_price') + F('deposit_amount'))[:options['requests']]
+        )
+        if not payable:
+            raise CommandError('No payable requests. Run "manage.py seed_benchmark" first.')
+        deliveries = fake_events(payable, options['duplicates'], options['failures'], options['refunds'], options['seed'])
+
+        queued_before = PaymentEvent.objects.count()
+        ingest_buffer.reset_metrics()
+        latencies, errors, elapsed = replay(deliveries, self.sender(options['url']), options['concurrency'])
+        result = summarize('payment-webhook', options['url'] or WEBHOOK_PATH, latencies, [], errors, elapsed)
+        latency = result['latency_ms']
+        self.stdout.write(
+            f"Delivered {len(deliveries)} events for {len(payable)} requests: {result['throughput_rps']:.1f} req/s  "
+            f"p50 {latency['p50']:.2f}ms  p95 {latency['p95']:.2f}ms  p99 {latency['p99']:.2f}ms  errors {errors}"
+        )
+        if not options['url']:
+            self.stdout.write(
+                f"{PaymentEvent.objects.count() - queued_before} events queued in {ingest_buffer.stats['flushes']} INSERTs"
+            )
+        if options['apply']:
+            started = time.perf_counter()
+            report = apply_events()
+            self.stdout.write(self.style.SUCCESS(
+                f"Applied {report['Applied']}, ignored {report['Ignored']}, failed {report['Failed']} "
+                f"in {time.perf_counter() - started:.2f}s"
+            ))
+
+    def sender(self, url):
+        if url:
+            def send(body, headers):
+                request = urllib.request.Request(
+                    url, data=body, method='POST', headers={**headers, 'Content-Type': 'application/json'},
+                )
+                try:
+                    with urllib.request.urlopen(request, timeout=30) as response:
+                        return response.status
+                except urllib.error.HTTPError as exc:
+                    return exc.code
+            return send
+
+        def send(body, headers):
+            client = benchmark_client()
+            extra = {f"HTTP_{name.upper().replace('-', '_')}": value for name, value in headers.items()}
+            return client.post(WEBHOOK_PATH, body, content_type='application/json', **extra).status_code
+        return send
@@ -0,0 +1,83 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test.utils import override_settings
+
+from core.benchmark import benchmark_client, build_report, compare_reports, run_endpoint, write_report
+from core.models import Item, RentalRequest, Notification, Conversation, Message, Category
+from core.throttling import get_config as throttling_config
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the main API endpoints in-process and write the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--output', default='benchmark-results.json')
+        parser.add_argument('--compare', help='Previous results file to compare against')
+        parser.add_argument('--only', help='Comma separated endpoint names to run')
+
+    def handle(self, *args, **options):
+        busiest = (
+            RentalRequest.objects.values('requester_id')
+            .annotate(n=Count('id')).order_by('-n').first()
+        )
+        if busiest is None:
+            raise CommandError('No data to benchmark. Run "manage.py seed_benchmark" first.')
+        user = User.objects.get(id=busiest['requester_id'])
+        item = Item.objects.order_by('id').first()
+        conversation = Conversation.objects.order_by('id').first()
+
+        anonymous = benchmark_client()
+        client = benchmark_client(user)
+        endpoints = [
+            ('items-list', anonymous, '/api/items/'),
+            ('items-list-sparse', anonymous, '/api/items/?fields=id,name,price_per_day,category_name'),
+            ('item-detail', anonymous, f'/api/items/{item.id}/'),
+            ('categories-list', anonymous, '/api/categories/'),
+            ('requests-list', client, '/api/requests/'),
+            ('notifications-list', client, '/api/notifications/'),
+            ('conversations-list', client, '/api/conversations/'),
+        ]
+        if conversation is not None:
+            endpoints.append(('messages-list', client, f'/api/messages/?conversation_id={conversation.id}'))
+        if options['only']:
+            selected = set(options['only'].split(','))
+            endpoints = [e for e in endpoints if e[0] in selected]
+
+        results = []
+        for name, api_client, path in endpoints:
+            # Measure the endpoints, not the rate limiter
+            with override_settings(THROTTLING={**throttling_config(), 'ENABLED': False}):
+                result = run_endpoint(api_client, name, path, options['iterations'])
+            results.append(result)
+            latency = result['latency_ms']
+            self.stdout.write(
+                f"{name:<20} {result['throughput_rps']:>9.1f} req/s  p50 {latency['p50']:>8.2f}ms  "
+                f"p95 {latency['p95']:>8.2f}ms  p99 {latency['p99']:>8.2f}ms  "
+                f"queries {result['queries']['mean']:>6.1f}  errors {result['errors']}"
+            )
+
+        report = build_report(results, {
+            'items': Item.objects.count(),
+            'categories': Category.objects.count(),
+            'requests': RentalRequest.objects.count(),
+            'conversations': Conversation.objects.count(),
+            'messages': Message.objects.count(),
+            'notifications': Notification.objects.count(),
+            'user_id': user.id,
+            'iterations': options['iterations'],
+        })
+        write_report(report, options['output'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare']) as fh:
+                baseline = json.load(fh)
+            for name, change in compare_reports(report, baseline).items():
+                self.stdout.write(
+                    f"{name:<20} p50 {change['p50']:+.1f}%  p95 {change['p95']:+.1f}%  "
+                    f"throughput {change['throughput']:+.1f}%  queries {change['queries']:+.1f}%"
+                )
@@ -0,0 +1,235 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core.availability import sync_availability
+from core.categories import recount_categories
+from core.geo import encode_geohash, geocode
+from core.models import (
+    Category, Item, ItemImage, RentalRequest, RequestStatusChange, Transaction, Dispute,
+    Notification, Conversation, ConversationParticipant, Message,
+)
+
+USERNAME_PREFIX = 'bench_user_'
+LIFECYCLE = ['Pending', 'Approved', 'AwaitingPayment', 'Paid', 'InHand', 'Returned', 'Completed']
+# Status history leading to each status, for the status_changes log
+STATUS_PATHS = {
+    **{status: LIFECYCLE[:i + 1] for i, status in enumerate(LIFECYCLE)},
+    'Rejected': ['Pending', 'Rejected'],
+    'Cancelled': ['Pending', 'Cancelled'],
+    'Disputed': LIFECYCLE[:5] + ['Disputed'],
+}
+CATEGORIES = ['Tools', 'Electronics', 'Camping', 'Sports', 'Party', 'Photography', 'Music', 'Garden', 'Vehicles', 'Kitchen']
+LOCATIONS = ['Manila', 'Quezon City', 'Makati', 'Pasig', 'Taguig', 'Cebu City', 'Davao City', 'Baguio', 'Iloilo City', 'Cagayan de Oro']
+ADJECTIVES = ['Compact', 'Heavy-duty', 'Portable', 'Professional', 'Wireless', 'Vintage', 'Lightweight', 'Premium']
+NOUNS = ['Drill', 'Tent', 'Camera', 'Projector', 'Bike', 'Speaker', 'Ladder', 'Kayak', 'Grill', 'Guitar', 'Lens', 'Mower']
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate realistic benchmark data (users, items, requests, conversations, notifications)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--items', type=int, default=2000)
+        parser.add_argument('--images-per-item', type=int, default=3)
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--conversations', type=int, default=1000)
+        parser.add_argument('--messages-per-conversation', type=int, default=10)
+        parser.add_argument('--notifications', type=int, default=10000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, so runs are reproducible')
+        parser.add_argument('--clear', action='store_true', help='Delete previously seeded benchmark data first')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+
+        with transaction.atomic():
+            if options['clear']:
+                self.clear()
+            users = self.seed_users(options['users'])
+            categories = self.seed_categories()
+            items = self.seed_items(options['items'], users, categories, options['images_per_item'])
+            self.seed_requests(options['requests'], users, items)
+            self.seed_conversations(options['conversations'], options['messages_per_conversation'], users, items)
+            self.seed_notifications(options['notifications'], users, items)
+            sync_availability()
+            recount_categories([c.id for c in categories])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {len(items)} items, {options['requests']} requests, "
+            f"{options['conversations']} conversations and {options['notifications']} notifications"
+        ))
+
+    def clear(self):
+        user_ids = [str(pk) for pk in User.objects.filter(username__startswith=USERNAME_PREFIX).values_list('id', flat=True)]
+        Notification.objects.filter(target_user_id__in=user_ids).delete()
+        Conversation.objects.filter(item_context__owner_id__in=user_ids).delete()
+        Item.objects.filter(owner_id__in=user_ids).delete()
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    def bulk(self, model, objs):
+        return model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+    def seed_users(self, count):
+        start = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+        password = make_password('benchmark')  # hashing once keeps seeding fast
+        users = self.bulk(User, [
+            User(username=f'{USERNAME_PREFIX}{start + i}', email=f'{USERNAME_PREFIX}{start + i}@example.com', password=password)
+            for i in range(count)
+        ])
+        self.bulk(Token, [Token(user=user, key=Token.generate_key()) for user in users])
+        return users
+
+    def seed_categories(self):
+        return [Category.objects.get_or_create_by_name(name)[0] for name in CATEGORIES]
+
+    def seed_items(self, count, users, categories, images_per_item):
+        rng = self.rng
+        items = []
+        for i in range(count):
+            # bulk_create skips the geocoding signal, so place items here (scattered ~5km around the city)
+            location = rng.choice(LOCATIONS)
+            latitude, longitude = geocode(location)
+            latitude += rng.uniform(-0.05, 0.05)
+            longitude += rng.uniform(-0.05, 0.05)
+            items.append(Item(
+                name=f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}',
+                description=f'Well maintained, available for pickup or delivery. Listing #{i}.',
+                price_per_day=Decimal(rng.randint(50, 5000)) / 10,
+                security_deposit=Decimal(rng.choice([0, 500, 1000, 2500])),
+                category=rng.choice(categories),
+                location=location,
+                latitude=latitude,
+                longitude=longitude,
+                geohash=encode_geohash(latitude, longitude),
+                rating=Decimal(rng.randint(0, 50)) / 10,
+                reviews_count=rng.randint(0, 200),
+                owner_id=str(rng.choice(users).id),
+                delivery_method=rng.choice(['Pickup', 'Delivery', 'Both']),
+                is_listed=rng.random() > 0.2,
+            ))
+        items = self.bulk(Item, items)
+        self.bulk(ItemImage, [
+            ItemImage(item=item, image=f'items/bench_{item.id}_{n}.jpg', is_primary=(n == 0))
+            for item in items for n in range(images_per_item)
+        ])
+        return items
+
+    def seed_requests(self, count, users, items):
+        rng = self.rng
+        statuses = [status for status, _ in RentalRequest.STATUS_CHOICES]
+        user_names = {str(u.id): u.username for u in users}
+        requests = []
+        for i in range(count):
+            item = rng.choice(items)
+            renter = rng.choice(users)
+            start = (self.now + timedelta(days=rng.randint(-90, 90))).date()
+            days = rng.randint(1, 14)
+            requests.append(RentalRequest(
+                item=item,
+                requester_name=renter.username,
+                owner_name=user_names.get(item.owner_id, ''),
+                requester_id=str(renter.id),
+                owner_id=item.owner_id,
+                start_date=start,
+                end_date=start + timedelta(days=days),
+                # every status is covered even in tiny data sets
+                status=statuses[i % len(statuses)],
+                total_price=item.price_per_day * days,
+                deposit_amount=item.security_deposit,
+            ))
+        requests = self.bulk(RentalRequest, requests)
+
+        changes = []
+        for req in requests:
+            changed_at = self.now - timedelta(days=rng.uniform(1, 60))
+            previous = ''
+            for status in STATUS_PATHS[req.status]:
+                changes.append(RequestStatusChange(
+                    rental_request=req, from_status=previous, to_status=status, changed_at=changed_at,
+                ))
+                previous = status
+                changed_at += timedelta(hours=rng.uniform(0.5, 48))
+        self.bulk(RequestStatusChange, changes)
+
+        paid = {'Paid', 'InHand', 'Returned', 'Completed', 'Disputed'}
+        self.bulk(Transaction, [
+            Transaction(rental_request=req, amount=req.total_price + req.deposit_amount,
+                        transaction_type='Payment', status='Success')
+            for req in requests if req.status in paid
+        ])
+        self.bulk(Dispute, [
+            Dispute(rental_request=req, reporter_id=req.requester_id, reason='Item returned damaged')
+            for req in requests if req.status == 'Disputed'
+        ])
+
+    def seed_conversations(self, count, messages_per_conversation, users, items):
+        rng = self.rng
+        conversations = self.bulk(Conversation, [
+            Conversation(
+                participant_ids=[str(u.id) for u in rng.sample(users, 2)] if len(users) > 1 else [str(users[0].id)],
+                item_context=rng.choice(items),
+            )
+            for _ in range(count)
+        ])
+        messages = self.bulk(Message, [
+            Message(
+                conversation=conv,
+                sender_id=rng.choice(conv.participant_ids),
+                text=f'Message {n}: is this still available?',
+                is_read=rng.random() > 0.3,
+            )
+            for conv in conversations for n in range(messages_per_conversation)
+        ])
+
+        # bulk_create skips the send path, so fill in the inbox summary it maintains
+        last_messages, unread = {}, {}
+        for message in messages:
+            last_messages[message.conversation_id] = message
+            if not message.is_read:
+                for user_id in message.conversation.participant_ids:
+                    if user_id != message.sender_id:
+                        key = (message.conversation_id, user_id)
+                        unread[key] = unread.get(key, 0) + 1
+        for conv in conversations:
+            last = last_messages.get(conv.id)
+            if last:
+                conv.last_message = last
+                conv.last_message_text = last.text
+                conv.last_message_sender_id = last.sender_id
+                conv.last_message_at = last.timestamp
+        Conversation.objects.bulk_update(
+            conversations, ['last_message', 'last_message_text', 'last_message_sender_id', 'last_message_at'],
+            batch_size=self.batch_size,
+        )
+        self.bulk(ConversationParticipant, [
+            ConversationParticipant(
+                conversation=conv, user_id=user_id, unread_count=unread.get((conv.id, user_id), 0),
+                last_activity_at=conv.last_message_at or self.now,
+            )
+            for conv in conversations for user_id in conv.participant_ids
+        ])
+
+    def seed_notifications(self, count, users, items):
+        rng = self.rng
+        self.bulk(Notification, [
+            Notification(
+                target_user_id=str(rng.choice(users).id),
+                event_type=rng.choice(['request_update', 'new_message', 'new_request']),
+                title='Request update',
+                message='Your request status changed.',
+                link='/requests',
+                is_read=rng.random() > 0.5,
+                related_item_id=str(rng.choice(items).id),
+            )
+            for _ in range(count)
+        ])
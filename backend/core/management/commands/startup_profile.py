@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.startup import profile_startup
+
+
+class Command(BaseCommand):
+    help = 'Profile cold start in fresh interpreters: time to app loading and first request, plus import breakdown'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help='Interpreters to start; the median is reported')
+        parser.add_argument('--top', type=int, default=10, help='Packages listed per stage')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+        parser.add_argument('--check', action='store_true', help='Fail when over budget or a deferred module loads eagerly')
+
+    def handle(self, *args, **options):
+        report = profile_startup(runs=options['runs'], top=options['top'])
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            for stage, ms in report['stages'].items():
+                limit = report['budget'].get(stage)
+                self.stdout.write(f'{stage:<18} {ms:>8.1f} ms' + (f'  (budget {limit} ms)' if limit else ''))
+                for package, package_ms in report['imports'].get(stage, []):
+                    self.stdout.write(f'    {package:<28} {package_ms:>8.1f} ms')
+            if report['eager_imports']:
+                self.stdout.write(f"Loaded during app setup: {', '.join(report['eager_imports'])}")
+        if options['check']:
+            problems = [f'{stage} over budget' for stage in report['over_budget']]
+            problems += [f'{name} imported during setup' for name in report['eager_imports']]
+            if report['status'] != '200 OK':
+                problems.append(f"health check returned {report['status']}")
+            if problems:
+                raise CommandError('; '.join(problems))
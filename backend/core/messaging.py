@@ -0,0 +1,127 @@
+"""
+Message send path and inbox fan-out.
+
+Sending a message writes the message, the conversation summary (last
+message, last activity) and every participant's unread counter in one
+transaction, so the inbox is a single read of ``ConversationParticipant``
+ordered by the ``(user_id, -last_activity_at)`` index.
+
+Recipients are told about new messages in two ways:
+
+* a ``Notification`` row, only for the first unread message of a
+  conversation so a busy chat doesn't flood the notification list;
+* after commit, ``inbox_hub`` wakes any long-poll request
+  (``/api/conversations/updates/``) waiting in this process. Waiters in
+  other processes still see the change on their next database check.
+"""
+import threading
+
+from django.db import transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from .models import Conversation, ConversationParticipant, Message, Notification
+
+PREVIEW_LENGTH = 255
+# Well below the usual 30 s worker timeout, whatever MESSAGING_LONG_POLL_SECONDS says
+MAX_LONG_POLL_SECONDS = 20
+
+
+class InboxHub:
+    """Per-user change counters that long-poll requests can wait on."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._versions = {}
+
+    def version(self, user_id):
+        with self._condition:
+            return self._versions.get(str(user_id), 0)
+
+    def publish(self, user_ids):
+        with self._condition:
+            for user_id in user_ids:
+                user_id = str(user_id)
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._condition.notify_all()
+
+    def wait(self, user_id, version, timeout):
+        """Block until ``user_id`` changes past ``version``; True if it did."""
+        user_id = str(user_id)
+        with self._condition:
+            return self._condition.wait_for(lambda: self._versions.get(user_id, 0) != version, timeout)
+
+
+inbox_hub = InboxHub()
+
+
+def sync_participants(conversation):
+    """Make the participant rows match ``conversation.participant_ids``."""
+    wanted = {str(user_id) for user_id in conversation.participant_ids}
+    existing = set(conversation.memberships.values_list('user_id', flat=True))
+    if existing - wanted:
+        conversation.memberships.filter(user_id__in=existing - wanted).delete()
+    if wanted - existing:
+        activity = conversation.last_message_at or conversation.updated_at or timezone.now()
+        ConversationParticipant.objects.bulk_create([
+            ConversationParticipant(conversation=conversation, user_id=user_id, last_activity_at=activity)
+            for user_id in wanted - existing
+        ], ignore_conflicts=True)
+
+
+def send_message(conversation, sender_id, text, sender_name=None):
+    sender_id = str(sender_id)
+    now = timezone.now()
+    with transaction.atomic():
+        message = Message.objects.create(conversation=conversation, sender_id=sender_id, text=text)
+        Conversation.objects.filter(pk=conversation.pk).update(
+            last_message=message,
+            last_message_text=text[:PREVIEW_LENGTH],
+            last_message_sender_id=sender_id,
+            last_message_at=message.timestamp,
+            updated_at=now,
+        )
+        memberships = ConversationParticipant.objects.filter(conversation=conversation)
+        # Recipients whose count was zero haven't been notified about this chat yet
+        to_notify = list(
+            memberships.filter(unread_count=0).exclude(user_id=sender_id).values_list('user_id', flat=True)
+        )
+        memberships.update(
+            last_activity_at=message.timestamp,
+            unread_count=Case(When(user_id=sender_id, then=0), default=F('unread_count') + 1),
+            last_read_at=Case(When(user_id=sender_id, then=now), default=F('last_read_at')),
+        )
+        if to_notify:
+            Notification.objects.bulk_create([
+                Notification(
+                    target_user_id=user_id,
+                    event_type='new_message',
+                    title='New Message',
+                    message=f'{sender_name}: {text[:100]}' if sender_name else text[:100],
+                    link=f'/messages?conversation={conversation.pk}',
+                    related_item_id=str(conversation.item_context_id) if conversation.item_context_id else None,
+                    related_user_id=sender_id,
+                    related_user_name=sender_name,
+                )
+                for user_id in to_notify
+            ])
+        recipients = [str(user_id) for user_id in conversation.participant_ids]
+        transaction.on_commit(lambda: inbox_hub.publish(recipients))
+    return message
+
+
+def mark_conversation_read(conversation, user_id):
+    """Reset ``user_id``'s unread count and flag the messages they received as read."""
+    user_id = str(user_id)
+    with transaction.atomic():
+        conversation.messages.filter(is_read=False).exclude(sender_id=user_id).update(is_read=True)
+        ConversationParticipant.objects.filter(conversation=conversation, user_id=user_id).update(
+            unread_count=0, last_read_at=timezone.now(),
+        )
+    transaction.on_commit(lambda: inbox_hub.publish([user_id]))
+
+
+def refresh_unread_count(conversation_id, user_id):
+    """Recount one participant's unread messages, e.g. after a single message is marked read."""
+    unread = Message.objects.filter(conversation_id=conversation_id, is_read=False).exclude(sender_id=user_id).count()
+    ConversationParticipant.objects.filter(conversation_id=conversation_id, user_id=user_id).update(unread_count=unread)
@@ -0,0 +1,130 @@
+"""
+In-process request metrics rendered in the Prometheus text format.
+
+``core.middleware.PerformanceMiddleware`` records one observation per request
+into ``registry``; ``core.views.metrics`` exposes it at ``/api/metrics/``.
+Everything lives in process memory, so each worker reports its own numbers.
+"""
+import threading
+from bisect import bisect_left
+from collections import Counter
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class RouteStats:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = 0.0
+        self.render_seconds = 0.0
+        self.response_bytes = 0
+        self.slow = 0
+        self.statuses = Counter()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+        self.collectors = []
+
+    def reset(self):
+        with self._lock:
+            self.routes = {}
+
+    def observe(self, route, method, status, latency, queries, db_seconds, render_seconds, response_bytes, slow):
+        with self._lock:
+            stats = self.routes.get((route, method))
+            if stats is None:
+                stats = self.routes[(route, method)] = RouteStats()
+            stats.latency.observe(latency)
+            stats.queries.observe(queries)
+            stats.db_seconds += db_seconds
+            stats.render_seconds += render_seconds
+            stats.response_bytes += response_bytes
+            stats.slow += slow
+            stats.statuses[status] += 1
+
+    def register_collector(self, collector):
+        """Add a callable returning ``(name, help, type, {labels: value})`` tuples."""
+        self.collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            routes = sorted(self.routes.items())
+            lines = []
+            self._render_histogram(lines, routes, 'http_request_duration_seconds',
+                                   'Request latency in seconds.', lambda s: s.latency)
+            self._render_histogram(lines, routes, 'http_request_db_queries',
+                                   'SQL queries executed per request.', lambda s: s.queries)
+            self._render_counter(lines, routes, 'http_request_db_seconds_total',
+                                 'Time spent in SQL in seconds.', lambda s: s.db_seconds)
+            self._render_counter(lines, routes, 'http_response_render_seconds_total',
+                                 'Time spent encoding responses (e.g. JSON rendering) in seconds; serializer work counts as view time.', lambda s: s.render_seconds)
+            self._render_counter(lines, routes, 'http_response_bytes_total',
+                                 'Response body size in bytes.', lambda s: s.response_bytes)
+            self._render_counter(lines, routes, 'http_slow_requests_total',
+                                 'Requests slower than the slow request threshold.', lambda s: s.slow)
+
+            lines.append('# HELP http_requests_total Requests by status code.')
+            lines.append('# TYPE http_requests_total counter')
+            for (route, method), stats in routes:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'http_requests_total{{{labels(route, method)},status="{status}"}} {count}')
+
+        for collector in self.collectors:
+            for name, help_text, metric_type, samples in collector():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for label_str, value in samples.items():
+                    lines.append(f'{name}{{{label_str}}} {value}' if label_str else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _render_histogram(self, lines, routes, name, help_text, get):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for (route, method), stats in routes:
+            histogram = get(stats)
+            label_str = labels(route, method)
+            for bound, count in histogram.cumulative():
+                lines.append(f'{name}_bucket{{{label_str},le="{bound}"}} {count}')
+            lines.append(f'{name}_sum{{{label_str}}} {histogram.sum}')
+            lines.append(f'{name}_count{{{label_str}}} {histogram.count}')
+
+    def _render_counter(self, lines, routes, name, help_text, get):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for (route, method), stats in routes:
+            lines.append(f'{name}{{{labels(route, method)}}} {get(stats)}')
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(route, method):
+    return f'route="{escape(route)}",method="{method}"'
+
+
+registry = MetricsRegistry()
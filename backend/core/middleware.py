@@ -0,0 +1,223 @@
+import hashlib
+import heapq
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.urls import Resolver404, get_resolver
+from django.utils.cache import patch_vary_headers
+
+from . import compression, routers
+from .metrics import registry
+
+logger = logging.getLogger('core.performance')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SLOW_REQUEST_MS': 500,
+    'SQL_SAMPLE_SIZE': 5,   # slowest statements logged with a slow request
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PERFORMANCE_METRICS', {})}
+
+
+class QueryRecorder:
+    """``execute_wrapper`` that counts queries and keeps the slowest few."""
+
+    def __init__(self, sample_size):
+        self.count = 0
+        self.seconds = 0.0
+        self.sample_size = sample_size
+        self.slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.seconds += duration
+            if self.sample_size:
+                entry = (duration, self.count, sql)
+                if len(self.slowest) < self.sample_size:
+                    heapq.heappush(self.slowest, entry)
+                elif duration > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, entry)
+
+
+class PerformanceMiddleware:
+    """
+    Records latency, SQL count/time, render time and response size per route.
+
+    Routes are keyed by URL name (e.g. ``item-list``) so that ids in the
+    path don't explode the number of series. Requests slower than
+    ``SLOW_REQUEST_MS`` are logged to ``core.performance`` with their
+    slowest SQL statements.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = get_config()
+        if not config['ENABLED']:
+            return self.get_response(request)
+
+        recorder = QueryRecorder(config['SQL_SAMPLE_SIZE'])
+        request._render_seconds = 0.0
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        latency = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        route = (match.view_name or match.route) if match else 'unmatched'
+        size = 0 if response.streaming else len(response.content)
+        slow = latency * 1000 >= config['SLOW_REQUEST_MS']
+
+        registry.observe(
+            route, request.method, response.status_code, latency,
+            recorder.count, recorder.seconds, request._render_seconds, size, slow,
+        )
+        if slow:
+            sample = '\n'.join(
+                f'  {duration * 1000:.1f}ms {sql}' for duration, _, sql in sorted(recorder.slowest, reverse=True)
+            )
+            logger.warning(
+                'Slow request %s %s (%s): %.1fms, %d queries, %.1fms SQL\n%s',
+                request.method, request.path, route, latency * 1000,
+                recorder.count, recorder.seconds * 1000, sample,
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time that step. Serializers
+        # build ``serializer.data`` inside the view, so their cost is part of the view time.
+        if not hasattr(request, '_render_seconds'):
+            return response
+        start = time.perf_counter()
+
+        def record_render(rendered):
+            request._render_seconds += time.perf_counter() - start
+
+        response.add_post_render_callback(record_render)
+        return response
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with the best encoding the client accepts (core/compression.py).
+
+    It sits inside ``PerformanceMiddleware``, so route latency includes the
+    compression and the recorded size is what goes over the wire.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        config = compression.get_config()
+        if not config['ENABLED'] or not compression.compressible(response):
+            return response
+        body = response.content
+        if len(body) < config['MIN_SIZE']:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = compression.negotiate(request.headers.get('Accept-Encoding', ''), compression.available_encodings())
+        if encoding is None:
+            return response
+        compressed = compression.body_cache.compress(body, encoding)
+        if len(compressed) >= len(body):
+            return response
+
+        response.content = compressed
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Content-Length'] = str(len(compressed))
+        # A strong ETag promises identical bytes, which the compressed body no longer is
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        compression.record(encoding, len(body), len(compressed))
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Sends the reads of safe-method requests to a read replica (core/routers.py).
+
+    Clients are told apart by their Authorization header, session cookie or
+    address. After a client's unsafe request (or any request that wrote) it
+    is pinned to the primary for ``READ_REPLICAS['PIN_SECONDS']``. A GET,
+    HEAD or OPTIONS request whose replica query failed is run again on the
+    primary. A read-only POST (a batch) is not, because its body has been
+    read; its response stands and the replica is marked down for the next.
+    """
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = routers.get_config()
+        if not config['ALIASES']:
+            return self.get_response(request)
+
+        pins = caches[config['PIN_CACHE']]
+        pin_key = self.pin_key(request)
+        safe = request.method in self.SAFE_METHODS or self.reads_only(request)
+        alias = None
+        if safe:
+            if pins.get(pin_key):
+                routers.count('pinned')
+            else:
+                alias = routers.choose_replica()
+
+        state, token = routers.activate(alias)
+        try:
+            with routers.watching(state):
+                response = self.get_response(request)
+            if state.failed:
+                routers.mark_down(alias)
+                if request.method in self.SAFE_METHODS:
+                    logger.warning('Replica %s failed on %s %s; retrying on the primary', alias, request.method, request.path)
+                    routers.deactivate(token)
+                    state, token = routers.activate(None)
+                    response = self.get_response(request)
+                else:
+                    logger.warning('Replica %s failed on %s %s', alias, request.method, request.path)
+        finally:
+            routers.deactivate(token)
+
+        routers.count('primary' if state.alias is None else 'replica')
+        if not safe or state.wrote:
+            pins.set(pin_key, 1, config['PIN_SECONDS'])
+        return response
+
+    @staticmethod
+    def reads_only(request):
+        # Views that only read despite their method (the batch endpoint) are routed like GETs
+        try:
+            match = get_resolver(getattr(request, 'urlconf', None)).resolve(request.path_info)
+        except Resolver404:
+            return False
+        return getattr(match.func, 'reads_only', False)
+
+    @staticmethod
+    def pin_key(request):
+        client = (
+            request.headers.get('Authorization')
+            or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+            or request.META.get('REMOTE_ADDR', '')
+        )
+        return 'replica-pin:' + hashlib.sha256(client.encode()).hexdigest()[:32]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:03
+
+from django.db import migrations, models
+
+
+def geocode_existing_items(apps, schema_editor):
+    from core.geo import geocode, encode_geohash
+
+    Item = apps.get_model('core', 'Item')
+    items = []
+    for item in Item.objects.exclude(location__isnull=True).exclude(location='').iterator():
+        coords = geocode(item.location)
+        if coords:
+            item.latitude, item.longitude = coords
+            item.geohash = encode_geohash(*coords)
+            items.append(item)
+    Item.objects.bulk_update(items, ['latitude', 'longitude', 'geohash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_item_security_deposit_rentalrequest_deposit_amount_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(geocode_existing_items, migrations.RunPython.noop),
+    ]
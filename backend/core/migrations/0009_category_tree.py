@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_category_tree(apps, schema_editor):
+    Category = apps.get_model('core', 'Category')
+    Item = apps.get_model('core', 'Item')
+    counts = {}
+    for category_id in Item.objects.filter(is_available=True).values_list('category_id', flat=True).iterator():
+        counts[category_id] = counts.get(category_id, 0) + 1
+
+    categories = list(Category.objects.all())
+    for category in categories:
+        # Every existing category becomes a root
+        category.name_key = category.name.strip().lower()
+        category.path = f'{category.pk:06d}/'
+        category.depth = 0
+        category.available_item_count = counts.get(category.pk, 0)
+    Category.objects.bulk_update(categories, ['name_key', 'path', 'depth', 'available_item_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_item_latitude_longitude_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='available_item_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='name_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='core.category'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_category_tree, migrations.RunPython.noop),
+    ]
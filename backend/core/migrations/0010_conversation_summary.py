@@ -0,0 +1,88 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def populate_conversation_summary(apps, schema_editor):
+    Conversation = apps.get_model('core', 'Conversation')
+    ConversationParticipant = apps.get_model('core', 'ConversationParticipant')
+    Message = apps.get_model('core', 'Message')
+    for conversation in Conversation.objects.all().iterator():
+        messages = Message.objects.filter(conversation=conversation)
+        last = messages.order_by('-timestamp', '-id').first()
+        if last:
+            conversation.last_message = last
+            conversation.last_message_text = last.text[:255]
+            conversation.last_message_sender_id = last.sender_id
+            conversation.last_message_at = last.timestamp
+            conversation.save(update_fields=['last_message', 'last_message_text', 'last_message_sender_id', 'last_message_at'])
+        activity = last.timestamp if last else conversation.updated_at
+        ConversationParticipant.objects.bulk_create([
+            ConversationParticipant(
+                conversation=conversation,
+                user_id=str(user_id),
+                last_activity_at=activity,
+                unread_count=messages.filter(is_read=False).exclude(sender_id=str(user_id)).count(),
+            )
+            for user_id in set(map(str, conversation.participant_ids))
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_category_tree'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=100)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_read_at', models.DateTimeField(blank=True, null=True)),
+                ('last_activity_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_sender_id',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_text',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'timestamp'], name='message_conversation_idx'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='conversation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='core.conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationparticipant',
+            index=models.Index(fields=['user_id', '-last_activity_at'], name='inbox_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversationparticipant',
+            constraint=models.UniqueConstraint(fields=('conversation', 'user_id'), name='unique_conversation_participant'),
+        ),
+        migrations.RunPython(populate_conversation_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:19
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_archive_segments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='monthly_discount_percent',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)]),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='weekly_discount_percent',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)]),
+        ),
+        migrations.CreateModel(
+            name='ItemBlackout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('reason', models.CharField(blank=True, default='', max_length=200)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blackouts', to='core.item')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['item', 'start_date'], name='blackout_item_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_pricing'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rentalrequest',
+            index=models.Index(fields=['item', 'status'], name='request_item_status_idx'),
+        ),
+    ]
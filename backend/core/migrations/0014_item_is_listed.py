@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:24
+
+from django.db import migrations, models
+
+
+def populate_is_listed(apps, schema_editor):
+    Item = apps.get_model('core', 'Item')
+    # Unavailable items out on rental were unlisted by the handover, not by their owner
+    Item.objects.filter(is_available=False).exclude(requests__status='InHand').update(is_listed=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_request_item_status_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='is_listed',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(populate_is_listed, migrations.RunPython.noop),
+    ]
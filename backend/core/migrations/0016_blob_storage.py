@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:35
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_admin_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dispute',
+            name='evidence_image',
+            field=models.ImageField(blank=True, db_index=True, null=True, storage=core.storage.get_blob_storage, upload_to='disputes/'),
+        ),
+        migrations.AlterField(
+            model_name='itemimage',
+            name='image',
+            field=models.ImageField(db_index=True, storage=core.storage.get_blob_storage, upload_to='items/'),
+        ),
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('ref_count', models.IntegerField(default=0)),
+                ('released_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('ref_count__lte', 0)), fields=['released_at'], name='blob_released_idx')],
+            },
+        ),
+    ]
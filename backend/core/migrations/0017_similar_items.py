@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_blob_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='similar_built_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='SimilarItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('item', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='similar_links', to='core.item')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.item')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('item', 'rank'), name='similar_item_rank_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:49
+
+from django.db import migrations, models
+
+
+def blank_stripe_ids_to_null(apps, schema_editor):
+    # Empty strings would collide under the new unique index; NULLs don't
+    apps.get_model('core', 'Transaction').objects.filter(stripe_id='').update(stripe_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_similar_items'),
+    ]
+
+    operations = [
+        migrations.RunPython(blank_stripe_ids_to_null, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='transaction',
+            name='stripe_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('event_type', models.CharField(max_length=100)),
+                ('stripe_id', models.CharField(max_length=255)),
+                ('rental_request_id', models.BigIntegerField(blank=True, null=True)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Applied', 'Applied'), ('Ignored', 'Ignored'), ('Failed', 'Failed')], default='Pending', max_length=20)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'Pending')), fields=['id'], name='payment_event_pending_idx')],
+            },
+        ),
+    ]
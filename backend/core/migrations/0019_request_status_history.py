@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:52
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_current_status(apps, schema_editor):
+    # Earlier transitions weren't recorded; start each timeline at the status the request has now
+    RentalRequest = apps.get_model('core', 'RentalRequest')
+    RequestStatusChange = apps.get_model('core', 'RequestStatusChange')
+    rows = RentalRequest.objects.values_list('pk', 'status', 'requested_at').iterator(chunk_size=2000)
+    RequestStatusChange.objects.bulk_create(
+        (RequestStatusChange(rental_request_id=pk, to_status=status, changed_at=requested_at, source='backfill')
+         for pk, status, requested_at in rows),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_payment_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestStatusChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(blank=True, default='', max_length=20)),
+                ('to_status', models.CharField(max_length=20)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('source', models.CharField(default='api', max_length=20)),
+                ('rental_request', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='status_changes', to='core.rentalrequest')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['rental_request', 'changed_at'], name='status_change_request_idx'), models.Index(fields=['to_status', 'changed_at'], name='status_change_status_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_current_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:58
+
+import core.models
+from django.db import migrations, models
+
+
+def regenerate_codes(apps, schema_editor):
+    # The old default was evaluated once per process, so rows share codes; give each its own
+    RentalRequest = apps.get_model('core', 'RentalRequest')
+    used = set()
+
+    def fresh():
+        code = core.models.generate_code()
+        while code in used:
+            code = core.models.generate_code()
+        used.add(code)
+        return code
+
+    batch = []
+    for request in RentalRequest.objects.only('pk').order_by('pk').iterator(chunk_size=2000):
+        request.handover_code, request.return_code = fresh(), fresh()
+        batch.append(request)
+        if len(batch) == 2000:
+            RentalRequest.objects.bulk_update(batch, ['handover_code', 'return_code'])
+            batch = []
+    RentalRequest.objects.bulk_update(batch, ['handover_code', 'return_code'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_request_status_history'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rentalrequest',
+            name='handover_code',
+            field=models.CharField(default=core.models.generate_code, max_length=8),
+        ),
+        migrations.AlterField(
+            model_name='rentalrequest',
+            name='return_code',
+            field=models.CharField(default=core.models.generate_code, max_length=8),
+        ),
+        migrations.RunPython(regenerate_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='rentalrequest',
+            name='handover_code',
+            field=models.CharField(default=core.models.generate_code, max_length=8, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='rentalrequest',
+            name='return_code',
+            field=models.CharField(default=core.models.generate_code, max_length=8, unique=True),
+        ),
+    ]
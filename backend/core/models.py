@@ -1,9 +1,37 @@
-import uuid
-from django.db import models
+import secrets
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import User
+from .storage import get_blob_storage
+
+# Handover/return codes are typed or scanned at pickup points: no 0/O or 1/I lookalikes
+CODE_ALPHABET = '23456789ABCDEFGHJKLMNPQRSTUVWXYZ'
+CODE_LENGTH = 8
+CODE_ATTEMPTS = 5
+
+def generate_code():
+    return ''.join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+
+class CategoryManager(models.Manager):
+    def get_or_create_by_name(self, name, parent=None):
+        """Case-insensitive get-or-create through the indexed ``name_key`` column."""
+        name = name.strip()
+        category = self.filter(name_key=name.lower(), parent=parent).order_by('id').first()
+        if category:
+            return category, False
+        return self.create(name=name, parent=parent), True
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    # Denormalized columns, maintained in core/categories.py and core/signals.py
+    name_key = models.CharField(max_length=100, db_index=True, editable=False, default='')
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='') # e.g. "000001/000007/"
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    available_item_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = CategoryManager()
     
     def __str__(self):
         return self.name
@@ -13,23 +41,85 @@ class Item(models.Model):
     description = models.TextField()
     price_per_day = models.DecimalField(max_digits=10, decimal_places=2)
     security_deposit = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    # Applied by core/pricing.py to rentals of 7+ and 30+ days
+    weekly_discount_percent = models.DecimalField(max_digits=5, decimal_places=2, default=0, validators=[MinValueValidator(0), MaxValueValidator(100)])
+    monthly_discount_percent = models.DecimalField(max_digits=5, decimal_places=2, default=0, validators=[MinValueValidator(0), MaxValueValidator(100)])
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='items')
     image_url = models.URLField(max_length=500, blank=True, null=True) # Fallback / External
     location = models.CharField(max_length=255, blank=True, null=True)
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    geohash = models.CharField(max_length=12, blank=True, null=True, db_index=True) # See core/geo.py
     rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.0)
     reviews_count = models.IntegerField(default=0)
     owner_id = models.CharField(max_length=100, db_index=True)
     delivery_method = models.CharField(max_length=50, default='Both')
+    is_listed = models.BooleanField(default=True) # Owner's choice; is_available also accounts for rentals (core/availability.py)
     is_available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    similar_built_at = models.DateTimeField(null=True, blank=True, editable=False) # see core/similarity.py
+
+    class Meta:
+        indexes = [
+            # Unavailable items are the few; this backs the admin's is_available filter
+            models.Index(fields=['-id'], name='item_unavailable_idx', condition=models.Q(is_available=False)),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember which category count this row contributes to (see core.signals)
+        if 'category_id' in field_names and 'is_available' in field_names:
+            instance._counted_category_id = instance.category_id if instance.is_available else None
+        # Where the row was, so a new location can drop coordinates that belonged to the old one (see core.geo)
+        if {'location', 'latitude', 'longitude'} <= set(field_names):
+            instance._saved_place = (instance.location, instance.latitude, instance.longitude)
+        return instance
 
     def __str__(self):
         return self.name
 
+class ItemBlackout(models.Model):
+    """Days the owner doesn't rent the item out (inclusive)."""
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='blackouts')
+    start_date = models.DateField()
+    end_date = models.DateField()
+    reason = models.CharField(max_length=200, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', 'start_date'], name='blackout_item_idx'),
+        ]
+
+class SimilarItem(models.Model):
+    """One precomputed neighbour of ``item`` (core/similarity.py); rank 0 is the most similar."""
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='similar_links', db_index=False)
+    similar = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'rank'], name='similar_item_rank_uniq'),
+        ]
+
+class Blob(models.Model):
+    """A file in the content-addressed store (core/storage.py) and how many fields point at it."""
+    name = models.CharField(max_length=255, unique=True) # e.g. "cas/ab/cd/<sha256>.jpg"
+    size = models.PositiveBigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    released_at = models.DateTimeField(null=True, blank=True) # when ref_count last dropped to 0
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['released_at'], name='blob_released_idx', condition=models.Q(ref_count__lte=0)),
+        ]
+
 class ItemImage(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='item_images')
-    image = models.ImageField(upload_to='items/')
+    image = models.ImageField(upload_to='items/', storage=get_blob_storage, db_index=True)
     is_primary = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -60,34 +150,165 @@ class RentalRequest(models.Model):
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     deposit_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     
-    # Handover Verification
-    handover_code = models.CharField(max_length=8, default=uuid.uuid4().hex[:8].upper())
-    return_code = models.CharField(max_length=8, default=uuid.uuid4().hex[:8].upper())
+    # Handover Verification (one code each per request, see POST /api/requests/scan/)
+    handover_code = models.CharField(max_length=CODE_LENGTH, default=generate_code, unique=True)
+    return_code = models.CharField(max_length=CODE_LENGTH, default=generate_code, unique=True)
     
     requested_at = models.DateTimeField(auto_now_add=True)
     rating_given = models.IntegerField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', 'status'], name='request_item_status_idx'),
+            models.Index(fields=['status', '-requested_at'], name='request_status_idx'),
+            models.Index(fields=['-requested_at'], name='request_requested_at_idx'),
+        ]
+
     def __str__(self):
         return f"Request for {self.item.name} by {self.requester_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The status the row had, so save() can log a transition (see core/history.py)
+        if 'status' in field_names:
+            instance._saved_status = instance.status
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'status' not in update_fields:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            if self._state.adding:
+                previous = None
+            elif hasattr(self, '_saved_status'):
+                previous = self._saved_status
+            else:
+                previous = RentalRequest.objects.filter(pk=self.pk).values_list('status', flat=True).first()
+            self._save_with_unique_codes(*args, **kwargs)
+            if previous != self.status:
+                RequestStatusChange.objects.create(rental_request=self, from_status=previous or '', to_status=self.status)
+        self._saved_status = self.status
+
+    def _save_with_unique_codes(self, *args, **kwargs):
+        """Save, drawing new codes when a generated one is already taken."""
+        for attempt in range(CODE_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                taken = [
+                    field for field in ('handover_code', 'return_code')
+                    if RentalRequest.objects.filter(**{field: getattr(self, field)}).exclude(pk=self.pk).exists()
+                ]
+                if not taken or attempt == CODE_ATTEMPTS - 1:
+                    raise
+                for field in taken:
+                    setattr(self, field, generate_code())
+
+    def lifecycle_notification(self):
+        """The unsaved ``Notification`` for this request's current status, or ``None``."""
+        status_messages = {
+            'Approved': ('Request Approved!', f'Your request for {self.item.name} was approved.'),
+            'Paid': ('Payment Confirmed', f'Payment for {self.item.name} received. Ready for handover!'),
+            'Rejected': ('Request Rejected', f'Your request for {self.item.name} was rejected.'),
+            'Returned': ('Item Returned', f'{self.requester_name} has returned {self.item.name}.'),
+            'Completed': ('Rental Completed', f'Thank you for renting {self.item.name}!'),
+            'Disputed': ('Dispute Opened', f'A dispute has been opened for {self.item.name}.'),
+        }
+        if self.status not in status_messages:
+            return None
+        title, message = status_messages[self.status]
+
+        # Renter for approval/payment/completion, owner for returns and disputes
+        if self.status in ['Approved', 'Paid', 'Rejected', 'Completed']:
+            target_id = self.requester_id
+        else: # Returned, Disputed
+            target_id = self.owner_id
+
+        return Notification(
+            target_user_id=target_id,
+            event_type='request_update',
+            title=title,
+            message=message,
+            link='/requests',
+            related_item_id=str(self.item_id),
+            related_user_id=self.owner_id if target_id == self.requester_id else self.requester_id,
+            related_user_name=self.owner_name if target_id == self.requester_id else self.requester_name
+        )
+
+class RequestStatusChange(models.Model):
+    """Append-only log of ``RentalRequest.status`` transitions, written with the change (core/history.py)."""
+    rental_request = models.ForeignKey(RentalRequest, on_delete=models.CASCADE, related_name='status_changes', db_index=False)
+    from_status = models.CharField(max_length=20, blank=True, default='') # '' when the request was created
+    to_status = models.CharField(max_length=20)
+    changed_at = models.DateTimeField(default=timezone.now)
+    source = models.CharField(max_length=20, default='api') # api, payment, expire, admin, ...
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['rental_request', 'changed_at'], name='status_change_request_idx'),
+            models.Index(fields=['to_status', 'changed_at'], name='status_change_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Request {self.rental_request_id}: {self.from_status or '-'} -> {self.to_status}"
+
 class Transaction(models.Model):
     TYPE_CHOICES = [('Payment', 'Payment'), ('Refund', 'Refund'), ('Payout', 'Payout')]
     
     rental_request = models.ForeignKey(RentalRequest, on_delete=models.CASCADE, related_name='transactions')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     transaction_type = models.CharField(max_length=20, choices=TYPE_CHOICES)
-    stripe_id = models.CharField(max_length=255, blank=True, null=True)
+    stripe_id = models.CharField(max_length=255, blank=True, null=True, unique=True) # provider payment/refund id
     status = models.CharField(max_length=50, default='Pending') # Pending, Success, Failed
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-created_at'], name='transaction_status_idx'),
+            models.Index(fields=['transaction_type', '-created_at'], name='transaction_type_idx'),
+            models.Index(fields=['-created_at'], name='transaction_created_idx'),
+        ]
+
+class PaymentEvent(models.Model):
+    """A payment provider webhook event, queued until core/payments.py applies it."""
+    STATUS_CHOICES = [('Pending', 'Pending'), ('Applied', 'Applied'), ('Ignored', 'Ignored'), ('Failed', 'Failed')]
+
+    event_id = models.CharField(max_length=255, unique=True) # provider event id; redeliveries are dropped
+    event_type = models.CharField(max_length=100)
+    stripe_id = models.CharField(max_length=255) # payment or refund the event is about
+    rental_request_id = models.BigIntegerField(null=True, blank=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
+    error = models.CharField(max_length=255, blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], name='payment_event_pending_idx', condition=models.Q(status='Pending')),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} ({self.status})"
+
 class Dispute(models.Model):
     rental_request = models.OneToOneField(RentalRequest, on_delete=models.CASCADE, related_name='dispute')
     reporter_id = models.CharField(max_length=100)
     reason = models.TextField()
-    evidence_image = models.ImageField(upload_to='disputes/', blank=True, null=True)
+    evidence_image = models.ImageField(upload_to='disputes/', storage=get_blob_storage, blank=True, null=True, db_index=True)
     status = models.CharField(max_length=20, default='Open') # Open, Resolved, Arbitrated
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-created_at'], name='dispute_status_idx'),
+            models.Index(fields=['-created_at'], name='dispute_created_idx'),
+        ]
+
 class Notification(models.Model):
     target_user_id = models.CharField(max_length=100, db_index=True)
     event_type = models.CharField(max_length=50)
@@ -100,6 +321,11 @@ class Notification(models.Model):
     related_user_id = models.CharField(max_length=100, blank=True, null=True)
     related_user_name = models.CharField(max_length=100, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['target_user_id', '-timestamp'], name='notification_inbox_idx'),
+        ]
+
     def __str__(self):
         return f"Notification for {self.target_user_id}: {self.title}"
 
@@ -108,6 +334,27 @@ class Conversation(models.Model):
     item_context = models.ForeignKey(Item, on_delete=models.SET_NULL, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Summary of the latest message, written by core.messaging.send_message
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_text = models.CharField(max_length=255, blank=True, default='')
+    last_message_sender_id = models.CharField(max_length=100, blank=True, default='')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+
+class ConversationParticipant(models.Model):
+    """One row per participant: the indexed inbox, with that user's unread count."""
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='memberships')
+    user_id = models.CharField(max_length=100)
+    unread_count = models.PositiveIntegerField(default=0)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user_id'], name='unique_conversation_participant'),
+        ]
+        indexes = [
+            models.Index(fields=['user_id', '-last_activity_at'], name='inbox_idx'),
+        ]
 
 class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
@@ -115,3 +362,32 @@ class Message(models.Model):
     text = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'timestamp'], name='message_conversation_idx'),
+        ]
+
+class ArchiveSegment(models.Model):
+    """A compressed NDJSON file of archived rows for one owner (see core/archive.py)."""
+    KIND_CHOICES = [('message', 'Message'), ('notification', 'Notification')]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    owner_key = models.CharField(max_length=100) # conversation id for messages, target user id for notifications
+    path = models.CharField(max_length=255)
+    row_count = models.PositiveIntegerField()
+    size_bytes = models.PositiveIntegerField()
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'owner_key', 'first_id'], name='archive_owner_idx'),
+            models.Index(fields=['kind', 'first_id', 'last_id'], name='archive_id_range_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} archive for {self.owner_key}: {self.row_count} rows"
@@ -0,0 +1,343 @@
+"""
+Payment provider webhooks, queued and applied in batches.
+
+The webhook only records events, and only signed ones unless
+``ALLOW_UNSIGNED`` is set (local development). ``IngestBuffer`` is a group commit: the
+first request of a burst waits ``FLUSH_WINDOW_MS`` while the requests
+arriving behind it add their events. The whole group is then written as
+one ``bulk_create``, and every request answers once that write is
+durable. Redelivered events are dropped by the unique ``event_id``.
+
+``apply_events`` (``manage.py apply_payment_events``) claims pending
+events ``BATCH_SIZE`` at a time and applies each batch in one transaction.
+It loads the requests and existing transactions with one query each,
+upserts ``Transaction`` rows keyed by the unique ``stripe_id``, and moves
+paid requests to ``Paid`` with ``history.change_status``. A payment for
+less than the request's price plus deposit fails instead. Set-based
+updates skip the model signals, so notifications, the occupancy cache and
+item availability are handled here.
+
+``fake_events`` and ``manage.py replay_payment_events`` play a local
+provider for load tests, with redeliveries and out-of-order events.
+"""
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .availability import invalidate_occupancy, sync_availability
+from .history import change_status
+from .metrics import registry
+from .models import Item, Notification, PaymentEvent, RentalRequest, Transaction
+
+DEFAULTS = {
+    'WEBHOOK_SECRET': None,   # HMAC-SHA256 key for the Payment-Signature header
+    'ALLOW_UNSIGNED': False,  # accept unsigned events when there is no secret (development only)
+    'FLUSH_WINDOW_MS': 5,     # how long the first webhook of a burst waits for others to share its INSERT
+    'MAX_FLUSH_SIZE': 500,
+    'BATCH_SIZE': 200,        # events applied per transaction
+    'INTERVAL_SECONDS': 2,    # idle wait of ``apply_payment_events --loop``
+}
+SIGNATURE_HEADER = 'Payment-Signature'
+# event type -> (transaction type, transaction status)
+EVENT_TYPES = {
+    'payment_intent.succeeded': ('Payment', 'Success'),
+    'payment_intent.payment_failed': ('Payment', 'Failed'),
+    'charge.refunded': ('Refund', 'Success'),
+}
+PAYABLE_STATUSES = ('Approved', 'AwaitingPayment')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PAYMENTS', {})}
+
+
+def sign(body, secret):
+    return 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def webhook_enabled():
+    """Whether the webhook can accept events: it needs a secret or the unsigned opt-in."""
+    config = get_config()
+    return bool(config['WEBHOOK_SECRET'] or config['ALLOW_UNSIGNED'])
+
+
+def verify_signature(body, header):
+    config = get_config()
+    if not config['WEBHOOK_SECRET']:
+        return config['ALLOW_UNSIGNED']
+    return hmac.compare_digest(sign(body, config['WEBHOOK_SECRET']), header or '')
+
+
+def parse_event(event):
+    """A ``PaymentEvent`` for a provider event, or ``None`` for types we don't handle."""
+    if not isinstance(event, dict) or not isinstance(event.get('id'), str) or not event['id']:
+        raise ValueError('Each event needs an "id".')
+    if event.get('type') not in EVENT_TYPES:
+        return None
+    data = event.get('data') or {}
+    obj = (data.get('object') or {}) if isinstance(data, dict) else None
+    if not isinstance(obj, dict) or not isinstance(obj.get('id'), str) or not obj['id']:
+        raise ValueError(f'Event {event["id"]} has no data.object.id.')
+    metadata = obj.get('metadata') or {}
+    if not isinstance(metadata, dict):
+        raise ValueError(f'Event {event["id"]} has invalid data.object.metadata.')
+    request_id = metadata.get('rental_request_id')
+    amount = obj.get('amount')
+    try:
+        return PaymentEvent(
+            event_id=event['id'][:255],
+            event_type=event['type'],
+            stripe_id=obj['id'][:255],
+            rental_request_id=int(request_id) if request_id is not None else None,
+            # Providers send minor units (cents)
+            amount=Decimal(int(amount)) / 100 if amount is not None else None,
+            payload=event,
+        )
+    except (TypeError, ValueError):
+        raise ValueError(f'Event {event["id"]} has an invalid amount or rental_request_id.')
+
+
+class IngestBuffer:
+    """Group commit for webhook events: concurrent callers share one INSERT."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._batch = None
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        self.stats = {'events': 0, 'flushes': 0}
+
+    def submit(self, events):
+        """Queue ``events`` (``PaymentEvent`` instances); returns once they are stored."""
+        config = get_config()
+        with self._lock:
+            batch = self._batch
+            leader = batch is None or len(batch['events']) >= config['MAX_FLUSH_SIZE']
+            if leader:
+                batch = self._batch = {'events': [], 'done': threading.Event(), 'error': None}
+            batch['events'].extend(events)
+            self.stats['events'] += len(events)
+        if not leader:
+            batch['done'].wait()
+            if batch['error'] is not None:
+                raise batch['error']
+            return
+        if config['FLUSH_WINDOW_MS']:
+            time.sleep(config['FLUSH_WINDOW_MS'] / 1000)
+        with self._lock:
+            if self._batch is batch:
+                self._batch = None
+            self.stats['flushes'] += 1
+        try:
+            # Redeliveries (same event id) are dropped by the unique index
+            PaymentEvent.objects.bulk_create(batch['events'], ignore_conflicts=True)
+        except Exception as exc:
+            batch['error'] = exc
+            raise
+        finally:
+            batch['done'].set()
+
+
+ingest_buffer = IngestBuffer()
+apply_stats = Counter()
+
+
+def apply_events(batch_size=None):
+    """Apply pending events oldest first; returns counts by outcome (``Applied``, ``Ignored``, ``Failed``)."""
+    batch_size = batch_size or get_config()['BATCH_SIZE']
+    pending = PaymentEvent.objects.filter(status='Pending').order_by('pk')
+    report = Counter()
+    while True:
+        with transaction.atomic():
+            events = list(pending.select_for_update(skip_locked=True)[:batch_size])
+            if not events:
+                break
+            outcomes = apply_batch(events)
+        report.update(outcome for outcome, _ in outcomes.values())
+    apply_stats.update(report)
+    return report
+
+
+def apply_batch(events):
+    """Apply ``events`` inside the caller's transaction; returns ``{event pk: (outcome, error)}``."""
+    requests = RentalRequest.objects.select_related('item').in_bulk(
+        {event.rental_request_id for event in events if event.rental_request_id is not None}
+    )
+    existing = {
+        stripe_id: status for stripe_id, status in
+        Transaction.objects.filter(stripe_id__in={event.stripe_id for event in events}).values_list('stripe_id', 'status')
+    }
+    created, status_changes, paid, outcomes = {}, {}, set(), {}
+    for event in events:
+        request = requests.get(event.rental_request_id)
+        if request is None:
+            outcomes[event.pk] = ('Failed', 'Unknown rental request.')
+            continue
+        kind, status = EVENT_TYPES[event.event_type]
+        if event.stripe_id in created:
+            current = created[event.stripe_id].status
+        else:
+            current = status_changes.get(event.stripe_id, existing.get(event.stripe_id))
+        if current == 'Success' or current == status:
+            # Redelivered, or a failure reported after the payment went through
+            outcomes[event.pk] = ('Ignored', '')
+            continue
+        amount_due = request.total_price + request.deposit_amount
+        if kind == 'Payment' and status == 'Success' and event.amount is not None and event.amount < amount_due:
+            outcomes[event.pk] = ('Failed', f'Underpayment: received {event.amount}, due {amount_due}.')
+            continue
+        if current is None:
+            created[event.stripe_id] = Transaction(
+                rental_request=request,
+                amount=event.amount if event.amount is not None else amount_due,
+                transaction_type=kind,
+                stripe_id=event.stripe_id,
+                status=status,
+            )
+        elif event.stripe_id in created:
+            created[event.stripe_id].status = status
+        else:
+            status_changes[event.stripe_id] = status
+        if kind == 'Payment' and status == 'Success' and request.status in PAYABLE_STATUSES:
+            paid.add(request.pk)
+        outcomes[event.pk] = ('Applied', '')
+
+    # A worker on another batch may insert the same stripe_id first; skip the clash, but let a success land
+    Transaction.objects.bulk_create(created.values(), ignore_conflicts=True)
+    status_changes.update({stripe_id: 'Success' for stripe_id, row in created.items() if row.status == 'Success'})
+    for status in set(status_changes.values()):
+        Transaction.objects.filter(
+            stripe_id__in=[stripe_id for stripe_id, new in status_changes.items() if new == status]
+        ).exclude(status='Success').update(status=status)  # a success is final, whoever wrote it
+    if paid:
+        mark_paid([requests[pk] for pk in paid])
+
+    now = timezone.now()
+    for (outcome, error), pks in group_by_outcome(outcomes).items():
+        PaymentEvent.objects.filter(pk__in=pks).update(status=outcome, error=error, processed_at=now)
+    return outcomes
+
+
+def mark_paid(requests):
+    """Move ``requests`` to ``Paid`` set-based and do what the ``post_save`` signals would."""
+    changed = set(change_status(
+        RentalRequest.objects.filter(pk__in=[r.pk for r in requests], status__in=PAYABLE_STATUSES), 'Paid', 'payment',
+    ))
+    requests = [request for request in requests if request.pk in changed]
+    for request in requests:
+        request.status = 'Paid'
+    Notification.objects.bulk_create([request.lifecycle_notification() for request in requests])
+    item_ids = {request.item_id for request in requests}
+    for item_id in item_ids:
+        invalidate_occupancy(item_id)
+    sync_availability(Item.objects.filter(pk__in=item_ids))
+
+
+def group_by_outcome(outcomes):
+    groups = {}
+    for pk, outcome in outcomes.items():
+        groups.setdefault(outcome, []).append(pk)
+    return groups
+
+
+def fake_events(requests, duplicate_ratio=0.1, failure_ratio=0.1, refund_ratio=0.05, seed=None):
+    """
+    Provider events paying ``requests`` (``(id, amount)`` pairs), in delivery order.
+
+    Some payments fail before succeeding, some are refunded, and a share
+    of events is delivered twice; deliveries are shuffled within a window
+    so they can arrive out of order, like real webhook bursts.
+    """
+    rng = random.Random(seed)
+
+    def event(event_type, object_id, request_id, amount):
+        return {
+            'id': f'evt_{uuid.UUID(int=rng.getrandbits(128)).hex}',
+            'type': event_type,
+            'created': int(time.time()),
+            'data': {'object': {
+                'id': object_id,
+                'amount': int(amount * 100),
+                'metadata': {'rental_request_id': str(request_id)},
+            }},
+        }
+
+    events = []
+    for request_id, amount in requests:
+        intent = f'pi_{uuid.UUID(int=rng.getrandbits(128)).hex[:24]}'
+        if rng.random() < failure_ratio:
+            events.append(event('payment_intent.payment_failed', intent, request_id, amount))
+        events.append(event('payment_intent.succeeded', intent, request_id, amount))
+        if rng.random() < refund_ratio:
+            events.append(event('charge.refunded', f're_{intent[3:]}', request_id, amount))
+    deliveries = events + [e for e in events if rng.random() < duplicate_ratio]
+    for i in range(0, len(deliveries), 20):
+        window = deliveries[i:i + 20]
+        rng.shuffle(window)
+        deliveries[i:i + 20] = window
+    return deliveries
+
+
+def replay(deliveries, send, concurrency=8):
+    """
+    Deliver events with ``concurrency`` threads calling ``send(body, headers) -> status``.
+
+    Returns ``(latencies, errors, elapsed seconds)``.
+    """
+    from django.db import connection
+
+    secret = get_config()['WEBHOOK_SECRET']
+    queue = list(reversed(deliveries))
+    lock = threading.Lock()
+    latencies, errors = [], []
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    event = queue.pop()
+                body = json.dumps(event).encode()
+                headers = {SIGNATURE_HEADER: sign(body, secret)} if secret else {}
+                start = time.perf_counter()
+                status = send(body, headers)
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    if status >= 400:
+                        errors.append(status)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f'replay-{i}') for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(errors), time.perf_counter() - started
+
+
+def collect_payment_metrics():
+    return [
+        ('payment_webhook_events_total', 'Webhook events accepted (before deduplication).', 'counter',
+         {'': ingest_buffer.stats['events']}),
+        ('payment_webhook_flushes_total', 'INSERTs that stored webhook events.', 'counter',
+         {'': ingest_buffer.stats['flushes']}),
+        ('payment_events_processed_total', 'Queued events processed by outcome.', 'counter',
+         {f'outcome="{outcome.lower()}"': apply_stats[outcome] for outcome in ('Applied', 'Ignored', 'Failed')}),
+    ]
+
+
+registry.register_collector(collect_payment_metrics)
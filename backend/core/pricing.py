@@ -0,0 +1,146 @@
+"""
+Server-side rental quotes.
+
+Everything a quote needs from an item is folded once into a cached
+``PriceSheet``: the per-day rate for each discount tier (already
+discounted and rounded), the deposit and the blackout ranges. A quote is
+then a multiplication and a range check. Quotes are cached under the
+sheet's ``version``, a digest of those inputs, so editing the item (which
+drops the sheet) makes old quotes unreachable without tracking them.
+
+Rental periods are inclusive: 10th to 12th is three days, as in the
+booking UI.
+"""
+import hashlib
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.cache import cache
+from django.utils.dateparse import parse_date
+
+from .models import Item, ItemBlackout
+
+SHEET_CACHE_TIMEOUT = 3600
+QUOTE_CACHE_TIMEOUT = 600
+MAX_QUOTE_RANGES = 50
+MAX_RENTAL_DAYS = 365
+WEEKLY_DAYS = 7
+MONTHLY_DAYS = 30
+CENT = Decimal('0.01')
+
+
+class QuoteError(ValueError):
+    pass
+
+
+def discounted(rate, percent):
+    return (rate * (100 - percent) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+@dataclass(frozen=True)
+class PriceSheet:
+    item_id: int
+    daily_rate: Decimal
+    weekly_rate: Decimal
+    monthly_rate: Decimal
+    deposit: Decimal
+    blackouts: tuple      # ((start, end, reason), ...) sorted by start
+    version: str
+
+    def rate_for(self, days):
+        if days >= MONTHLY_DAYS and self.monthly_rate < self.daily_rate:
+            return self.monthly_rate, 'monthly'
+        if days >= WEEKLY_DAYS and self.weekly_rate < self.daily_rate:
+            return self.weekly_rate, 'weekly'
+        return self.daily_rate, None
+
+    def blackout_for(self, start, end):
+        for blackout_start, blackout_end, reason in self.blackouts:
+            if blackout_start > end:
+                break
+            if blackout_end >= start:
+                return {'start_date': blackout_start, 'end_date': blackout_end, 'reason': reason}
+        return None
+
+
+def build_price_sheet(item):
+    daily = Decimal(item.price_per_day).quantize(CENT)
+    blackouts = tuple(
+        ItemBlackout.objects.filter(item_id=item.pk).order_by('start_date').values_list('start_date', 'end_date', 'reason')
+    )
+    sheet = {
+        'item_id': item.pk,
+        'daily_rate': daily,
+        'weekly_rate': discounted(daily, Decimal(item.weekly_discount_percent)),
+        'monthly_rate': discounted(daily, Decimal(item.monthly_discount_percent)),
+        'deposit': Decimal(item.security_deposit).quantize(CENT),
+        'blackouts': blackouts,
+    }
+    sheet['version'] = hashlib.sha1(repr(sorted(sheet.items())).encode()).hexdigest()[:12]
+    return PriceSheet(**sheet)
+
+
+def sheet_cache_key(item_id):
+    return f'core:price-sheet:{item_id}'
+
+
+def get_price_sheet(item):
+    """``item`` may be an ``Item`` or its id; raises ``Item.DoesNotExist``."""
+    item_id = item.pk if isinstance(item, Item) else item
+    sheet = cache.get(sheet_cache_key(item_id))
+    if sheet is None:
+        if not isinstance(item, Item):
+            item = Item.objects.get(pk=item_id)
+        sheet = build_price_sheet(item)
+        cache.set(sheet_cache_key(item_id), sheet, SHEET_CACHE_TIMEOUT)
+    return sheet
+
+
+def invalidate_price_sheet(item_id):
+    cache.delete(sheet_cache_key(item_id))
+
+
+def parse_period(data):
+    """Read ``start_date``/``end_date`` from a mapping; raises ``QuoteError``."""
+    try:
+        start = parse_date(str(data.get('start_date') or ''))
+        end = parse_date(str(data.get('end_date') or ''))
+    except ValueError:
+        start = end = None
+    if start is None or end is None:
+        raise QuoteError('start_date and end_date must be YYYY-MM-DD dates.')
+    if end < start:
+        raise QuoteError('end_date must not be before start_date.')
+    if (end - start).days + 1 > MAX_RENTAL_DAYS:
+        raise QuoteError(f'Rentals are limited to {MAX_RENTAL_DAYS} days.')
+    return start, end
+
+
+def compute_quote(sheet, start, end):
+    days = (end - start).days + 1
+    rate, discount = sheet.rate_for(days)
+    total = rate * days
+    blackout = sheet.blackout_for(start, end)
+    return {
+        'item': sheet.item_id,
+        'start_date': start,
+        'end_date': end,
+        'days': days,
+        'daily_rate': rate,
+        'discount': discount,
+        'savings': sheet.daily_rate * days - total,
+        'total_price': total,
+        'deposit_amount': sheet.deposit,
+        'amount_due': total + sheet.deposit,
+        'available': blackout is None,
+        'blackout': blackout,
+    }
+
+
+def get_quote(sheet, start, end):
+    key = f'core:quote:{sheet.item_id}:{sheet.version}:{start:%Y%m%d}:{end:%Y%m%d}'
+    return cache.get_or_set(key, lambda: compute_quote(sheet, start, end), QUOTE_CACHE_TIMEOUT)
+
+
+def quote_item(item, start, end):
+    return get_quote(get_price_sheet(item), start, end)
@@ -0,0 +1,167 @@
+"""
+Read replicas for safe-method requests.
+
+``ReplicaRoutingMiddleware`` (core/middleware.py) picks a replica from
+``READ_REPLICAS['ALIASES']`` for each GET/HEAD/OPTIONS request that isn't
+pinned, and ``ReplicaRouter`` sends that request's reads to it. Everything
+else reads from the primary: writes, unsafe requests, code outside a
+request (commands, background threads), queries inside a transaction the
+request opened, and the rest of a request once it has written anything.
+
+A client that just wrote is pinned to the primary for ``PIN_SECONDS`` so it
+reads its own writes despite replication lag. A replica that can't be
+reached, or whose query fails, is skipped for ``RETRY_SECONDS``; the
+request it failed is answered from the primary instead.
+"""
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, DEFAULT_DB_ALIAS, connections
+
+from .metrics import registry
+
+DEFAULTS = {
+    'ALIASES': [],
+    'PIN_SECONDS': 5,       # reads go to the primary this long after a client writes
+    'RETRY_SECONDS': 30,    # a failed replica is skipped this long
+    'PIN_CACHE': 'default',
+}
+WRITE_SQL = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'READ_REPLICAS', {})}
+
+
+class RoutingState:
+    """Where the current request reads from; ``alias`` is ``None`` for the primary."""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.failed = False
+        self.wrote = False
+        # Transactions already open when the request started (e.g. in tests) don't count
+        self.atomic_depth = len(connections[DEFAULT_DB_ALIAS].atomic_blocks)
+
+    def watch_replica(self, execute, sql, params, many, context):
+        """``execute_wrapper`` for the replica connection: remembers that a query failed."""
+        try:
+            return execute(sql, params, many, context)
+        except DatabaseError:
+            self.failed = True
+            raise
+
+    def watch_primary(self, execute, sql, params, many, context):
+        """``execute_wrapper`` for the primary: after a write, later reads must see it."""
+        if WRITE_SQL.match(sql):
+            self.alias = None
+            self.wrote = True
+        return execute(sql, params, many, context)
+
+
+_state = ContextVar('replica_routing', default=None)
+_lock = threading.Lock()
+_down_until = {}
+stats = {'replica': 0, 'primary': 0, 'pinned': 0, 'fallbacks': 0}
+
+
+def activate(alias):
+    state = RoutingState(alias)
+    return state, _state.set(state)
+
+
+def deactivate(token):
+    _state.reset(token)
+
+
+def current():
+    return _state.get()
+
+
+def watching(state):
+    """Install ``state``'s ``execute_wrapper``s on this thread's connections (no-op for ``None``)."""
+    stack = ExitStack()
+    if state is not None:
+        stack.enter_context(connections[DEFAULT_DB_ALIAS].execute_wrapper(state.watch_primary))
+        if state.alias is not None:
+            stack.enter_context(connections[state.alias].execute_wrapper(state.watch_replica))
+    return stack
+
+
+def count(key):
+    with _lock:
+        stats[key] += 1
+
+
+def mark_down(alias):
+    with _lock:
+        _down_until[alias] = time.monotonic() + get_config()['RETRY_SECONDS']
+        stats['fallbacks'] += 1
+
+
+def healthy_replicas():
+    now = time.monotonic()
+    return [alias for alias in get_config()['ALIASES'] if _down_until.get(alias, 0) <= now]
+
+
+def choose_replica():
+    replicas = healthy_replicas()
+    return random.choice(replicas) if replicas else None
+
+
+def reset():
+    with _lock:
+        _down_until.clear()
+        stats.update(dict.fromkeys(stats, 0))
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.alias is None:
+            return DEFAULT_DB_ALIAS
+        if len(connections[DEFAULT_DB_ALIAS].atomic_blocks) > state.atomic_depth:
+            return DEFAULT_DB_ALIAS
+        replica = connections[state.alias]
+        if replica.connection is None:
+            try:
+                replica.ensure_connection()
+            except DatabaseError:
+                mark_down(state.alias)
+                state.alias = None
+                return DEFAULT_DB_ALIAS
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+def collect_replica_metrics():
+    with _lock:
+        snapshot = dict(stats)
+    return [
+        ('db_read_routing_total', 'Requests by where their reads were sent.', 'counter', {
+            'target="replica"': snapshot['replica'],
+            'target="primary"': snapshot['primary'],
+        }),
+        ('db_read_pinned_total', 'Safe requests sent to the primary because the client wrote recently.', 'counter',
+         {'': snapshot['pinned']}),
+        ('db_replica_fallbacks_total', 'Replica failures answered from the primary.', 'counter',
+         {'': snapshot['fallbacks']}),
+        ('db_replicas_healthy', 'Configured replicas currently in use.', 'gauge', {'': len(healthy_replicas())}),
+    ]
+
+
+registry.register_collector(collect_replica_metrics)
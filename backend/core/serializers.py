@@ -1,13 +1,68 @@
+import math
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Item, Category, RentalRequest, Notification, Conversation, Message, ItemImage, Transaction, Dispute
+from .categories import is_descendant
+from .models import (
+    Item, Category, RentalRequest, Notification, Conversation, Message, ItemImage, ItemBlackout, Transaction, Dispute,
+)
 
-class UserSerializer(serializers.ModelSerializer):
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def parse_field_list(value):
+    """Split a comma separated query parameter into a set of names."""
+    if value is None:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def get_field_selection(request):
+    """
+    Return the ``(fields, expand)`` sets requested on a read.
+
+    Either item is ``None`` when the parameter was not sent (or the request
+    is a write), meaning "no restriction".
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None, None
+    fields = parse_field_list(request.query_params.get('fields')) or None
+    expand = parse_field_list(request.query_params.get('expand'))
+    return fields, expand
+
+
+class SparseFieldsMixin:
+    """
+    Lets clients pick the fields they need.
+
+    ``?fields=id,status`` keeps only the listed fields. ``?expand=`` controls
+    the nested fields named in ``Meta.expandable_fields``: when it is sent,
+    only the listed ones are rendered (``?expand=`` alone drops them all).
+    Only applied on safe (read) requests so writes always validate against
+    the full field set. Unknown names are ignored.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields, expand = get_field_selection(self.context.get('request'))
+        if fields is None and expand is None:
+            return
+        names = set(self.fields)
+        excluded = set()
+        if fields is not None:
+            excluded |= names - fields - (expand or set())
+        if expand is not None:
+            expandable = set(getattr(self.Meta, 'expandable_fields', ()))
+            excluded |= expandable - expand - (fields or set())
+        for name in excluded & names:
+            self.fields.pop(name)
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'email')
 
-class ItemSummarySerializer(serializers.ModelSerializer):
+class ItemSummarySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Item
         fields = ['id', 'name', 'image_url', 'price_per_day']
@@ -26,33 +81,65 @@ class RegisterSerializer(serializers.ModelSerializer):
         )
         return user
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
 
-class ItemImageSerializer(serializers.ModelSerializer):
+    def validate_parent(self, parent):
+        if parent and self.instance and is_descendant(self.instance, parent):
+            raise serializers.ValidationError("A category can't be moved under itself.")
+        return parent
+
+class ItemImageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ItemImage
         fields = ['id', 'image', 'is_primary']
 
-class ItemSerializer(serializers.ModelSerializer):
+class ItemBlackoutSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = ItemBlackout
+        fields = ['id', 'item', 'start_date', 'end_date', 'reason']
+
+    def validate(self, data):
+        start = data.get('start_date', getattr(self.instance, 'start_date', None))
+        end = data.get('end_date', getattr(self.instance, 'end_date', None))
+        if start and end and end < start:
+            raise serializers.ValidationError({'end_date': 'Must not be before start_date.'})
+        return data
+
+class ItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category_name = serializers.ReadOnlyField(source='category.name')
     owner_details = serializers.SerializerMethodField()
     item_images = ItemImageSerializer(many=True, read_only=True)
+    distance_km = serializers.SerializerMethodField()
     
     class Meta:
         model = Item
         fields = [
             'id', 'name', 'description', 'price_per_day', 'security_deposit', 
-            'category', 'category_name', 'image_url', 'item_images', 'location', 
-            'rating', 'reviews_count', 'is_available', 'owner_id', 'owner_details', 
+            'weekly_discount_percent', 'monthly_discount_percent', 'category', 'category_name', 'image_url', 'item_images', 'location', 
+            'latitude', 'longitude', 'distance_km', 'rating', 'reviews_count', 'is_available', 'is_listed', 'owner_id', 'owner_details', 
             'delivery_method', 'created_at', 'updated_at'
         ]
         extra_kwargs = {
             'category': {'required': True}
         }
+        read_only_fields = ['is_listed']
+        expandable_fields = ['item_images', 'owner_details']
+        field_dependencies = {'owner_details': ['owner_id']}
     
+    def validate(self, data):
+        # Owners list/unlist through is_available; ItemViewSet then re-derives it from active rentals
+        if 'is_available' in data:
+            data['is_listed'] = data['is_available']
+        return data
+
+    def get_distance_km(self, obj):
+        # Only set on proximity searches (?near=), see ItemViewSet
+        distance_sq = getattr(obj, 'distance_sq', None)
+        return round(math.sqrt(distance_sq), 3) if distance_sq is not None else None
+
     def get_owner_details(self, obj):
         from django.contrib.auth.models import User
         try:
@@ -69,17 +156,17 @@ class ItemSerializer(serializers.ModelSerializer):
                 "avatarUrl": "https://placehold.co/100x100.png"
             }
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = '__all__'
 
-class DisputeSerializer(serializers.ModelSerializer):
+class DisputeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Dispute
         fields = '__all__'
 
-class RentalRequestSerializer(serializers.ModelSerializer):
+class RentalRequestSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     item_details = ItemSummarySerializer(source='item', read_only=True)
     transactions = TransactionSerializer(many=True, read_only=True)
     dispute = DisputeSerializer(read_only=True)
@@ -92,42 +179,71 @@ class RentalRequestSerializer(serializers.ModelSerializer):
             'total_price', 'deposit_amount', 'handover_code', 'return_code', 
             'requested_at', 'rating_given', 'transactions', 'dispute'
         ]
-        read_only_fields = ['handover_code', 'return_code', 'requester_id', 'owner_id']
+        # Prices come from the quote engine (core/pricing.py), not the client
+        read_only_fields = ['handover_code', 'return_code', 'requester_id', 'owner_id', 'total_price', 'deposit_amount']
+        expandable_fields = ['item_details', 'transactions', 'dispute']
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = '__all__'
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = '__all__'
+        read_only_fields = ['sender_id']
 
-class ConversationSerializer(serializers.ModelSerializer):
+class ConversationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     messages = MessageSerializer(many=True, read_only=True)
     item_details = ItemSummarySerializer(source='item_context', read_only=True)
     participants_details = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+    unread_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Conversation
-        fields = ['id', 'participant_ids', 'participants_details', 'item_context', 'item_details', 'messages', 'created_at', 'updated_at']
+        fields = [
+            'id', 'participant_ids', 'participants_details', 'item_context', 'item_details',
+            'last_message', 'unread_count', 'messages', 'created_at', 'updated_at',
+        ]
+        expandable_fields = ['participants_details', 'item_details', 'messages']
+        field_dependencies = {
+            'participants_details': ['participant_ids'],
+            'last_message': ['last_message', 'last_message_text', 'last_message_sender_id', 'last_message_at'],
+        }
+
+    def get_last_message(self, obj):
+        if not obj.last_message_id:
+            return None
+        return {
+            'id': obj.last_message_id,
+            'conversation': obj.id,
+            'sender_id': obj.last_message_sender_id,
+            'text': obj.last_message_text,
+            'timestamp': serializers.DateTimeField().to_representation(obj.last_message_at),
+        }
+
+    def get_unread_count(self, obj):
+        # Annotated per requesting user by ConversationViewSet
+        return getattr(obj, 'unread_count', 0)
+
+    def get_participant_users(self, obj):
+        # In a list, load the users for every conversation at once
+        if getattr(self, '_participant_users', None) is None:
+            conversations = self.parent.instance if isinstance(self.parent, serializers.ListSerializer) else [obj]
+            ids = {uid for conv in conversations for uid in conv.participant_ids if str(uid).isdigit()}
+            self._participant_users = {str(u.id): u for u in User.objects.filter(id__in=ids)}
+        return self._participant_users
 
     def get_participants_details(self, obj):
-        from django.contrib.auth.models import User
+        users = self.get_participant_users(obj)
         details = []
         for uid in obj.participant_ids:
-            try:
-                user = User.objects.get(id=uid)
-                details.append({
-                    "id": str(user.id),
-                    "name": user.username,
-                    "avatarUrl": "https://placehold.co/40x40.png"
-                })
-            except (User.DoesNotExist, ValueError):
-                details.append({
-                    "id": uid,
-                    "name": f"User {uid}",
-                    "avatarUrl": "https://placehold.co/40x40.png"
-                })
+            user = users.get(str(uid))
+            details.append({
+                "id": str(user.id) if user else uid,
+                "name": user.username if user else f"User {uid}",
+                "avatarUrl": "https://placehold.co/40x40.png"
+            })
         return details
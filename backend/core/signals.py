@@ -1,42 +1,26 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.db import transaction
 from django.dispatch import receiver
 from django.db.models import Avg
-from .models import RentalRequest, Notification, Item
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from .authentication import token_cache
+from .availability import invalidate_occupancy, sync_availability
+from .categories import (
+    adjust_count, counted_category_id, invalidate_category_tree, sync_category_path,
+)
+from .geo import locate_item
+from .messaging import sync_participants
+from .models import RentalRequest, Item, ItemBlackout, Category, Conversation, Dispute, SimilarItem
+from .pricing import invalidate_price_sheet
+from . import suggest
 
 @receiver(post_save, sender=RentalRequest)
 def handle_rental_lifecycle_notifications(sender, instance, created, **kwargs):
     # Only notify on status changes (not just creation, though creation is a status change)
-    # Map status to human friendly messages
-    status_messages = {
-        'Approved': ('Request Approved!', f'Your request for {instance.item.name} was approved.'),
-        'Paid': ('Payment Confirmed', f'Payment for {instance.item.name} received. Ready for handover!'),
-        'Rejected': ('Request Rejected', f'Your request for {instance.item.name} was rejected.'),
-        'Returned': ('Item Returned', f'{instance.requester_name} has returned {instance.item.name}.'),
-        'Completed': ('Rental Completed', f'Thank you for renting {instance.item.name}!'),
-        'Disputed': ('Dispute Opened', f'A dispute has been opened for {instance.item.name}.'),
-    }
-
-    if instance.status in status_messages:
-        title, message = status_messages[instance.status]
-        
-        # Determine who gets the notification
-        # Usually renter for approval/payment/return-success
-        # Usually owner for return-received
-        if instance.status in ['Approved', 'Paid', 'Rejected', 'Completed']:
-            target_id = instance.requester_id
-        else: # Returned, Disputed
-            target_id = instance.owner_id
-
-        Notification.objects.create(
-            target_user_id=target_id,
-            event_type='request_update',
-            title=title,
-            message=message,
-            link='/requests',
-            related_item_id=str(instance.item.id),
-            related_user_id=instance.owner_id if target_id == instance.requester_id else instance.requester_id,
-            related_user_name=instance.owner_name if target_id == instance.requester_id else instance.requester_name
-        )
+    notification = instance.lifecycle_notification()
+    if notification is not None:
+        notification.save()
 
 @receiver(post_save, sender=RentalRequest)
 def update_item_rating(sender, instance, **kwargs):
@@ -58,3 +42,119 @@ def update_item_rating(sender, instance, **kwargs):
         item.rating = avg_rating or 0.0
         item.reviews_count = count
         item.save()
+
+@receiver(post_delete, sender=Token)
+def evict_deleted_token(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+@receiver(post_save, sender=User)
+def evict_user_tokens(sender, instance, update_fields=None, **kwargs):
+    # Cached entries hold the user object, so any change (deactivation included) drops them.
+    # last_login bumps don't affect authentication and happen on every session login.
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    token_cache.invalidate_user(instance.pk)
+
+@receiver(pre_save, sender=Item)
+def geocode_item(sender, instance, update_fields=None, **kwargs):
+    # Partial saves that don't touch the location keep their coordinates
+    if update_fields is not None and not {'location', 'latitude', 'longitude'} & set(update_fields):
+        return
+    locate_item(instance)
+
+@receiver(pre_save, sender=Category)
+def set_category_name_key(sender, instance, **kwargs):
+    instance.name_key = instance.name.strip().lower()
+
+@receiver(post_save, sender=Category)
+def update_category_tree(sender, instance, **kwargs):
+    sync_category_path(instance)
+    invalidate_category_tree()
+
+@receiver(post_delete, sender=Category)
+def remove_category_from_tree(sender, instance, **kwargs):
+    invalidate_category_tree()
+
+@receiver(pre_save, sender=Item)
+def remember_counted_category(sender, instance, **kwargs):
+    # Rows loaded with deferred fields (or never loaded) don't know what they counted towards
+    if instance._state.adding:
+        instance._counted_category_id = None
+    elif not hasattr(instance, '_counted_category_id'):
+        old = Item.objects.filter(pk=instance.pk).values_list('category_id', 'is_available').first()
+        instance._counted_category_id = old[0] if old and old[1] else None
+
+@receiver(post_save, sender=Item)
+def update_category_counts(sender, instance, **kwargs):
+    old, new = instance._counted_category_id, counted_category_id(instance)
+    if old != new:
+        adjust_count(old, -1)
+        adjust_count(new, 1)
+        invalidate_category_tree()
+    instance._counted_category_id = new
+
+@receiver(post_delete, sender=Item)
+def decrement_category_count(sender, instance, **kwargs):
+    old = getattr(instance, '_counted_category_id', counted_category_id(instance))
+    if old is not None:
+        adjust_count(old, -1)
+        invalidate_category_tree()
+
+@receiver(post_save, sender=Conversation)
+def update_conversation_participants(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is None or 'participant_ids' in update_fields:
+        sync_participants(instance)
+
+@receiver(post_delete, sender=Conversation)
+def purge_conversation_archive(sender, instance, **kwargs):
+    # Imported here: core.archive pulls in the serializers, which app loading doesn't need
+    from .archive import MESSAGE, purge_archive
+    purge_archive(MESSAGE, instance.pk)
+
+@receiver(post_save, sender=Item)
+def update_suggest_item(sender, instance, **kwargs):
+    transaction.on_commit(lambda: suggest.sync_item(instance))
+
+@receiver(post_delete, sender=Item)
+def drop_suggest_item(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: suggest.drop_item(pk))
+
+@receiver(post_save, sender=Category)
+def update_suggest_category(sender, instance, **kwargs):
+    transaction.on_commit(lambda: suggest.sync_category(instance))
+
+@receiver(post_delete, sender=Category)
+def drop_suggest_category(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: suggest.drop_category(pk))
+
+@receiver(pre_delete, sender=Item)
+def mark_similar_lists_stale(sender, instance, **kwargs):
+    # The cascade removes this item from other lists; have build_similar_items refill them
+    listers = SimilarItem.objects.filter(similar_id=instance.pk).values('item_id')
+    Item.objects.filter(pk__in=listers).update(similar_built_at=None)
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def drop_item_price_sheet(sender, instance, **kwargs):
+    invalidate_price_sheet(instance.pk)
+
+@receiver(post_save, sender=ItemBlackout)
+@receiver(post_delete, sender=ItemBlackout)
+def drop_blackout_price_sheet(sender, instance, **kwargs):
+    invalidate_price_sheet(instance.item_id)
+    invalidate_occupancy(instance.item_id)
+
+@receiver(post_save, sender=RentalRequest)
+@receiver(post_delete, sender=RentalRequest)
+def drop_item_occupancy(sender, instance, **kwargs):
+    invalidate_occupancy(instance.item_id)
+
+@receiver(post_save, sender=RentalRequest)
+def sync_item_availability(sender, instance, **kwargs):
+    sync_availability(Item.objects.filter(pk=instance.item_id))
+
+@receiver(post_save, sender=Dispute)
+def sync_disputed_item_availability(sender, instance, **kwargs):
+    sync_availability(Item.objects.filter(requests__pk=instance.rental_request_id))
@@ -0,0 +1,211 @@
+"""
+Precomputed "similar items".
+
+Every listed item is turned into a feature vector with four blocks, each
+L2-normalized and scaled by the square root of its weight: TF-IDF of the
+name (counted twice) and description, the category and its ancestors, a
+log2 price band, and the geohash cell. The dot product of two vectors
+is then the weighted sum of per-feature cosine similarities. A
+block missing on either side (no location, say) contributes nothing.
+Scores come from NumPy matrix products, ``BATCH_SIZE`` items at a time
+against the whole matrix, and the top ``NEIGHBOURS`` are stored as
+``SimilarItem`` rows so the API reads them with one indexed query.
+
+Rebuilds are incremental. An item is stale when it changed after its
+neighbours were computed (``updated_at > similar_built_at``). A run
+recomputes the stale items and every item whose list could change
+because of them: items listing a stale item, and items a stale item now
+beats the weakest neighbour of.
+"""
+import math
+import re
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from .models import Item, SimilarItem
+
+DEFAULTS = {
+    'NEIGHBOURS': 20,
+    'TEXT_FEATURES': 512,   # most common terms kept for TF-IDF
+    'BATCH_SIZE': 256,      # items scored per matrix product
+    'WEIGHTS': {'text': 0.5, 'category': 0.25, 'price': 0.15, 'location': 0.1},
+    'INTERVAL_MINUTES': 15, # how often ``build_similar_items --loop`` runs
+}
+PRICE_BANDS = 16
+TOKEN = re.compile(r'[a-z0-9]{2,}')
+STOPWORDS = frozenset(
+    'and are for from has have in is it its of on or the this to with you your'.split()
+)
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'SIMILAR_ITEMS', {})}
+    config['WEIGHTS'] = {**DEFAULTS['WEIGHTS'], **config['WEIGHTS']}
+    return config
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall((text or '').lower()) if token not in STOPWORDS]
+
+
+def normalize_rows(block):
+    norms = np.linalg.norm(block, axis=1, keepdims=True)
+    return np.divide(block, norms, out=np.zeros_like(block), where=norms > 0)
+
+
+def text_block(documents, max_features):
+    """Sublinear TF-IDF over the ``max_features`` terms found in the most documents."""
+    counts = [Counter(doc) for doc in documents]
+    df = Counter(term for doc in counts for term in doc)
+    # A term in a single document can't make two items similar
+    vocabulary = [term for term, n in df.most_common() if n > 1][:max_features]
+    columns = {term: i for i, term in enumerate(vocabulary)}
+    idf = np.array([math.log((1 + len(documents)) / (1 + df[term])) + 1 for term in vocabulary], dtype=np.float32)
+    block = np.zeros((len(documents), len(vocabulary)), dtype=np.float32)
+    for row, doc in enumerate(counts):
+        for term, n in doc.items():
+            if term in columns:
+                block[row, columns[term]] = 1 + math.log(n)
+    return block * idf
+
+
+def one_hot_block(keys_per_row):
+    """``keys_per_row`` holds ``{key: value}`` per row; each distinct key gets a column."""
+    columns = {}
+    for keys in keys_per_row:
+        for key in keys:
+            columns.setdefault(key, len(columns))
+    block = np.zeros((len(keys_per_row), len(columns)), dtype=np.float32)
+    for row, keys in enumerate(keys_per_row):
+        for key, value in keys.items():
+            block[row, columns[key]] = value
+    return block
+
+
+def category_keys(path):
+    # Own category 1, parent 0.5, grandparent 0.25, ...
+    segments = [s for s in (path or '').split('/') if s]
+    return {segment: 0.5 ** depth for depth, segment in enumerate(reversed(segments))}
+
+
+def price_keys(price):
+    band = min(PRICE_BANDS - 1, max(0, int(math.log2(max(float(price), 1)))))
+    return {band: 1.0, band - 1: 0.5, band + 1: 0.5}
+
+
+def location_keys(geohash):
+    if not geohash:
+        return {}
+    return {geohash[:3]: 1.0, '~' + geohash[:2]: 0.5}
+
+
+def feature_matrix(rows, config):
+    """One float32 row per item from ``(pk, name, description, category path, price, geohash)`` tuples."""
+    weights = config['WEIGHTS']
+    blocks = {
+        'text': text_block([tokenize(name) * 2 + tokenize(description) for _, name, description, *_ in rows],
+                           config['TEXT_FEATURES']),
+        'category': one_hot_block([category_keys(row[3]) for row in rows]),
+        'price': one_hot_block([price_keys(row[4]) for row in rows]),
+        'location': one_hot_block([location_keys(row[5]) for row in rows]),
+    }
+    return np.hstack([normalize_rows(block) * np.float32(math.sqrt(weights[name])) for name, block in blocks.items()])
+
+
+def load_items():
+    return list(
+        Item.objects.filter(is_listed=True).order_by('pk')
+        .values_list('pk', 'name', 'description', 'category__path', 'price_per_day', 'geohash')
+    )
+
+
+def top_neighbours(matrix, rows, k):
+    """``(indices, scores)`` of the ``k`` best other items for each row index in ``rows``."""
+    scores = matrix[rows] @ matrix.T
+    scores[np.arange(len(rows)), rows] = -np.inf  # never your own neighbour
+    k = min(k, matrix.shape[0] - 1)
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def affected_rows(matrix, pks, stale, config):
+    """Row indices whose neighbour lists may change because ``stale`` (row indices) changed."""
+    position = {pk: i for i, pk in enumerate(pks)}
+    stale_pks = [pks[i] for i in stale]
+    affected = set(stale)
+    listing = SimilarItem.objects.filter(similar_id__in=stale_pks).values_list('item_id', flat=True)
+    affected.update(position[pk] for pk in listing if pk in position)
+
+    # Lists that aren't full take any positive score; full ones only beat their weakest entry
+    weakest = np.zeros(len(pks), dtype=np.float32)
+    lists = SimilarItem.objects.values('item_id').annotate(weakest=Min('score'), size=Count('pk'))
+    for pk, score, size in lists.values_list('item_id', 'weakest', 'size'):
+        if pk in position and size >= config['NEIGHBOURS']:
+            weakest[position[pk]] = score
+    for start in range(0, len(stale), config['BATCH_SIZE']):
+        batch = stale[start:start + config['BATCH_SIZE']]
+        scores = matrix[batch] @ matrix.T
+        scores[np.arange(len(batch)), batch] = -np.inf
+        affected.update(np.flatnonzero(scores.max(axis=0) > weakest).tolist())
+    return sorted(affected)
+
+
+def build_similar_items(full=False):
+    """
+    Recompute stale neighbour lists (all of them with ``full``).
+
+    Returns ``{'items': n, 'neighbours': n}``: lists rewritten and rows stored.
+    """
+    config = get_config()
+    started = timezone.now()
+    # Neighbours that were unlisted since the last run are dropped; their listers get recomputed below
+    unlisted = SimilarItem.objects.filter(Q(item__is_listed=False) | Q(similar__is_listed=False))
+    Item.objects.filter(pk__in=unlisted.values('item_id')).update(similar_built_at=None)
+    unlisted.delete()
+
+    rows = load_items()
+    report = {'items': 0, 'neighbours': 0}
+    if len(rows) < 2:
+        SimilarItem.objects.all().delete()
+        return report
+    pks = [row[0] for row in rows]
+    matrix = feature_matrix(rows, config)
+    if full:
+        targets = list(range(len(pks)))
+    else:
+        stale_pks = set(
+            Item.objects.filter(is_listed=True)
+            .filter(Q(similar_built_at__isnull=True) | Q(updated_at__gt=F('similar_built_at')))
+            .values_list('pk', flat=True)
+        )
+        stale = [i for i, pk in enumerate(pks) if pk in stale_pks]
+        if not stale:
+            return report
+        targets = affected_rows(matrix, pks, stale, config)
+
+    for start in range(0, len(targets), config['BATCH_SIZE']):
+        batch = targets[start:start + config['BATCH_SIZE']]
+        neighbours, scores = top_neighbours(matrix, np.array(batch), config['NEIGHBOURS'])
+        links = [
+            SimilarItem(item_id=pks[row], similar_id=pks[j], rank=rank, score=float(score))
+            for row, row_neighbours, row_scores in zip(batch, neighbours, scores)
+            for rank, (j, score) in enumerate(
+                (j, score) for j, score in zip(row_neighbours, row_scores) if score > 0
+            )
+        ]
+        batch_pks = [pks[row] for row in batch]
+        with transaction.atomic():
+            SimilarItem.objects.filter(item_id__in=batch_pks).delete()
+            SimilarItem.objects.bulk_create(links)
+            # Edits made while this ran are newer than ``started`` and stay stale
+            Item.objects.filter(pk__in=batch_pks).update(similar_built_at=started)
+        report['items'] += len(batch)
+        report['neighbours'] += len(links)
+    return report
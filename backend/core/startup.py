@@ -0,0 +1,162 @@
+"""
+Cold-start support for scale-to-zero hosting.
+
+``django.setup()`` runs on the first request of every new instance, so app
+loading only imports what the models and signals need. DRF's router, the
+serializers and the views are imported when the first API route is
+resolved (``LazyRoutes``), and the health check answers without them.
+With ``COLD_START['PREWARM']`` the WSGI/ASGI entry points start that
+import on a background thread as soon as the app object exists.
+
+``profile_startup`` measures all of this in fresh interpreters;
+``manage.py startup_profile`` reports it against ``COLD_START['BUDGET_MS']``.
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import threading
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.http import require_safe
+
+DEFAULTS = {
+    'LAZY_ROUTES': True,
+    'PREWARM': False,
+    # Milliseconds after the interpreter starts: app loading, and the first health check answered
+    'BUDGET_MS': {'setup': 1000, 'first_request': 1200},
+}
+
+# Modules app loading must not import; each one here is a cold-start regression
+DEFERRED_MODULES = (
+    'rest_framework.routers', 'rest_framework.serializers', 'core.serializers', 'core.views', 'PIL.Image', 'numpy',
+)
+PROFILE_MARKER = 'startup-profile:'
+IMPORT_LINE = re.compile(r'^import time:\s*(\d+) \|\s*(\d+) \| (\s*)(\S+)')
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'COLD_START', {})}
+    config['BUDGET_MS'] = {**DEFAULTS['BUDGET_MS'], **config['BUDGET_MS']}
+    return config
+
+
+@require_safe
+def health_check(request):
+    return JsonResponse({"status": "ok", "message": "Backend is running"})
+
+
+class LazyRoutes:
+    """URLconf stand-in whose ``urlpatterns`` come from ``build()`` on first access."""
+
+    def __init__(self, build):
+        self._build = build
+        self._patterns = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._patterns is not None
+
+    @property
+    def urlpatterns(self):
+        if self._patterns is None:
+            with self._lock:
+                if self._patterns is None:
+                    self._patterns = self._build()
+        return self._patterns
+
+
+def prewarm():
+    """Build the API routes (importing DRF and the views) and load the suggest index on a daemon thread."""
+    from django.db import connection
+    from .suggest import get_index
+    from .urls import api_routes
+
+    def warm():
+        api_routes.urlpatterns
+        try:
+            get_index()
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=warm, name='prewarm', daemon=True)
+    thread.start()
+    return thread
+
+
+# Runs in a fresh interpreter; each stage is reported in ms since the script started
+PROFILE_SCRIPT = '''
+import io, json, sys, time
+start = time.perf_counter()
+def mark(stage):
+    sys.stderr.write(%(marker)r + stage + "\\n")
+    stages[stage] = round((time.perf_counter() - start) * 1000, 1)
+stages = {}
+import django
+django.setup()
+mark("setup")
+eager = [name for name in %(deferred)r if name in sys.modules]
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+host = next((h for h in settings.ALLOWED_HOSTS if h not in ("*", "") and not h.startswith(".")), "localhost")
+environ = {
+    "REQUEST_METHOD": "GET", "PATH_INFO": "/api/health/", "QUERY_STRING": "", "SERVER_NAME": host,
+    "SERVER_PORT": "80", "HTTP_HOST": host, "wsgi.input": io.BytesIO(), "wsgi.url_scheme": "http",
+}
+statuses = []
+response = WSGIHandler()(environ, lambda status, headers: statuses.append(status))
+b"".join(response)
+mark("first_request")
+from django.urls import resolve
+resolve("/api/items/")
+mark("first_api_request")
+print(json.dumps({"stages": stages, "status": statuses[0], "eager_imports": eager}))
+'''
+
+
+def run_profile_script(importtime=False):
+    script = PROFILE_SCRIPT % {'marker': PROFILE_MARKER, 'deferred': DEFERRED_MODULES}
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', script]
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+    result = subprocess.run(command, capture_output=True, text=True, cwd=settings.BASE_DIR, env=env, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def import_breakdown(stderr, top=10):
+    """Top-level packages by import time (ms) for each stage of a ``-X importtime`` run."""
+    breakdown, totals = {}, {}
+    for line in stderr.splitlines():
+        if line.startswith(PROFILE_MARKER):
+            breakdown[line[len(PROFILE_MARKER):]] = sorted(totals.items(), key=lambda pair: -pair[1])[:top]
+            totals = {}
+            continue
+        match = IMPORT_LINE.match(line)
+        if match and not match.group(3):  # only outermost imports, their time already includes the nested ones
+            package = match.group(4).split('.')[0]
+            totals[package] = round(totals.get(package, 0) + int(match.group(2)) / 1000, 1)
+    return breakdown
+
+
+def profile_startup(runs=3, top=10):
+    """
+    Start ``runs`` fresh interpreters and report the median time to each stage.
+
+    An extra run under ``-X importtime`` provides the per-package breakdown
+    (its own timings are inflated by the tracing, so they aren't used).
+    """
+    samples = [run_profile_script()[0] for _ in range(runs)]
+    traced, stderr = run_profile_script(importtime=True)
+    budget = get_config()['BUDGET_MS']
+    stages = {stage: statistics.median(s['stages'][stage] for s in samples) for stage in samples[0]['stages']}
+    return {
+        'stages': stages,
+        'status': samples[0]['status'],
+        'eager_imports': traced['eager_imports'],
+        'imports': import_breakdown(stderr, top),
+        'budget': budget,
+        'over_budget': [stage for stage, limit in budget.items() if stages.get(stage, 0) > limit],
+    }
@@ -0,0 +1,237 @@
+"""
+Content-addressed storage for uploaded images.
+
+``BlobStorage`` names every upload after the SHA-256 of its bytes
+(``cas/ab/cd/<sha256>.jpg``). The hash is taken while the upload is
+streamed, and the file is only written when that content isn't stored
+yet, so a photo shared by fifty listings is written and kept once.
+
+Each stored file has a ``Blob`` row counting the fields that point at it.
+Saving a file takes a reference; ``delete()``, which django_cleanup calls
+when a row is deleted or its image replaced, only releases one. Files are
+removed by ``collect_blobs`` in batches, after a grace period and after
+re-checking that no field still names them.
+
+A name always means the same bytes, so ``serve_blob`` marks responses as
+immutable and uses the hash as the ETag.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from collections import Counter
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils import timezone
+from django.views.decorators.http import require_safe
+
+DEFAULTS = {
+    'DIRECTORY': 'cas',
+    'CHUNK_SIZE': 64 * 1024,
+    'GC_GRACE_HOURS': 24,       # released blobs are kept this long before collect_blobs removes them
+    'GC_BATCH_SIZE': 500,
+    'CACHE_MAX_AGE': 31536000,  # one year
+}
+EXTENSION = re.compile(r'\.[a-z0-9]{1,8}')
+BLOB_NAME = re.compile(r'[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[a-z0-9]{1,8})?')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'BLOB_STORAGE', {})}
+
+
+def blob_model():
+    # Resolved lazily: core.models needs this module to declare its file fields
+    return apps.get_model('core', 'Blob')
+
+
+def acquire(name, size):
+    """Take a reference to ``name``, creating its ``Blob`` row if needed."""
+    Blob = blob_model()
+    while True:
+        with transaction.atomic():
+            blob, created = Blob.objects.get_or_create(name=name, defaults={'size': size, 'ref_count': 1})
+            if created or Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1, released_at=None):
+                return blob
+        # collect_blobs removed the row between the two queries; start over
+
+
+def release(name):
+    blob_model().objects.filter(name=name, ref_count__gt=0).update(
+        ref_count=F('ref_count') - 1,
+        released_at=Case(When(ref_count=1, then=Value(timezone.now())), default=F('released_at')),
+    )
+
+
+class BlobStorage(FileSystemStorage):
+    def is_blob(self, name):
+        return name.startswith(get_config()['DIRECTORY'] + '/')
+
+    def get_available_name(self, name, max_length=None):
+        # The stored name comes from the content in _save; the upload's name can't clash
+        return name
+
+    def _save(self, name, content):
+        config = get_config()
+        sha = hashlib.sha256()
+        size = 0
+        for chunk in content.chunks(config['CHUNK_SIZE']):
+            sha.update(chunk)
+            size += len(chunk)
+        digest = sha.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        blob_name = f"{config['DIRECTORY']}/{digest[:2]}/{digest[2:4]}/{digest}"
+        blob_name += extension if EXTENSION.fullmatch(extension) else ''
+
+        # The reference is taken before the file is placed, so collect_blobs never deletes a file being saved
+        acquire(blob_name, size)
+        try:
+            path = self.path(blob_name)
+            if not os.path.exists(path):
+                self._place(path, content, config)
+        except Exception:
+            release(blob_name)
+            raise
+        return blob_name
+
+    def _place(self, path, content, config):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            if hasattr(content, 'temporary_file_path'):
+                os.close(fd)
+                file_move_safe(content.temporary_file_path(), temp_path, allow_overwrite=True)
+            else:
+                with os.fdopen(fd, 'wb') as fh:
+                    for chunk in content.chunks(config['CHUNK_SIZE']):
+                        fh.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            os.replace(temp_path, path)  # concurrent saves of the same content write the same bytes
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def delete(self, name):
+        if name and self.is_blob(name):
+            release(name)
+        else:
+            super().delete(name)
+
+    def remove_file(self, name):
+        """Actually delete a blob's file; only ``collect_blobs`` should call this."""
+        super().delete(name)
+
+
+blob_storage = BlobStorage()
+
+
+def get_blob_storage():
+    return blob_storage
+
+
+def referencing_fields():
+    """``(model, field name)`` for every file field stored in the blob store."""
+    return [
+        (model, field.name)
+        for model in apps.get_models()
+        for field in model._meta.concrete_fields
+        if isinstance(field, models.FileField) and field.storage is blob_storage
+    ]
+
+
+def count_references(names):
+    counts = Counter()
+    for model, field in referencing_fields():
+        rows = model._default_manager.filter(**{f'{field}__in': names}).values_list(field, flat=True)
+        counts.update(rows)
+    return counts
+
+
+def collect_blobs(batch_size=None, grace_hours=None, dry_run=False, now=None):
+    """
+    Delete released blobs past the grace period, ``batch_size`` per transaction.
+
+    A blob that some field still names (a reference taken without going
+    through the storage) gets its count repaired instead. Returns
+    ``{'deleted': n, 'bytes': n, 'repaired': n}``.
+    """
+    config = get_config()
+    batch_size = batch_size or config['GC_BATCH_SIZE']
+    grace = config['GC_GRACE_HOURS'] if grace_hours is None else grace_hours
+    cutoff = (now or timezone.now()) - timedelta(hours=grace)
+    Blob = blob_model()
+    candidates = Blob.objects.filter(ref_count__lte=0, released_at__lt=cutoff).order_by('released_at', 'pk')
+    if dry_run:
+        totals = candidates.aggregate(deleted=models.Count('pk'), bytes=models.Sum('size'))
+        return {'deleted': totals['deleted'], 'bytes': totals['bytes'] or 0, 'repaired': 0}
+
+    report = {'deleted': 0, 'bytes': 0, 'repaired': 0}
+    while True:
+        with transaction.atomic():
+            batch = list(candidates.select_for_update(skip_locked=True)[:batch_size])
+            if not batch:
+                break
+            counts = count_references([blob.name for blob in batch])
+            doomed = []
+            for blob in batch:
+                if counts[blob.name]:
+                    Blob.objects.filter(pk=blob.pk).update(ref_count=counts[blob.name], released_at=None)
+                    report['repaired'] += 1
+                else:
+                    doomed.append(blob)
+            for blob in doomed:
+                blob_storage.remove_file(blob.name)
+            Blob.objects.filter(pk__in=[blob.pk for blob in doomed]).delete()
+        report['deleted'] += len(doomed)
+        report['bytes'] += sum(blob.size for blob in doomed)
+    return report
+
+
+def recount_blobs(batch_size=None):
+    """Recompute every ``ref_count`` from the file fields; returns how many were wrong."""
+    Blob = blob_model()
+    batch_size = batch_size or get_config()['GC_BATCH_SIZE']
+    fixed, last_pk = 0, 0
+    while True:
+        batch = list(Blob.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'name', 'ref_count')[:batch_size])
+        if not batch:
+            return fixed
+        counts = count_references([name for _, name, _ in batch])
+        now = timezone.now()
+        for pk, name, ref_count in batch:
+            if counts[name] != ref_count:
+                Blob.objects.filter(pk=pk).update(
+                    ref_count=counts[name], released_at=None if counts[name] else now,
+                )
+                fixed += 1
+        last_pk = batch[-1][0]
+
+
+@require_safe
+def serve_blob(request, name):
+    match = BLOB_NAME.fullmatch(name)
+    if not match:
+        raise Http404
+    etag = f'"{match.group(1)}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f"public, max-age={get_config()['CACHE_MAX_AGE']}, immutable",
+    }
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponseNotModified(headers=headers)
+    try:
+        fh = blob_storage.open(f"{get_config()['DIRECTORY']}/{name}", 'rb')
+    except FileNotFoundError:
+        raise Http404
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    return FileResponse(fh, content_type=content_type, headers=headers)
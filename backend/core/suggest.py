@@ -0,0 +1,328 @@
+"""
+Search-box suggestions from an in-memory prefix index.
+
+Item names, category names and item locations are normalized (lowercase,
+no accents or punctuation) and indexed under every word suffix, so
+"power dr" finds "Cordless power drill". Each kind is a sorted list of
+``(key, ref)`` pairs searched with ``bisect``. The best matches for one-
+and two-character prefixes, whose ranges are large, are memoized and
+dropped per prefix on writes. Items rank by rating and review count,
+categories by available items, locations by how many listed items they
+have.
+
+The index is loaded on first use (or by ``startup.prewarm``) from the
+snapshot written by ``manage.py build_suggest_index``, or from the
+database when there is none. ``Item``/``Category`` signals, and the bulk
+importer for the rows it inserts, keep this process's index in step after
+each commit. Indexes older than
+``RELOAD_SECONDS`` (including one loaded from an old snapshot) are
+rebuilt from the database in the background, which is how other
+workers catch up.
+"""
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import Category, Item
+
+DEFAULTS = {
+    'SNAPSHOT_PATH': None,
+    'RELOAD_SECONDS': 900,
+    'LIMIT': 5,
+    'MAX_LIMIT': 20,
+}
+SHORT_PREFIX = 2
+SNAPSHOT_VERSION = 1
+NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'SUGGEST', {})}
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii')
+    return NON_WORD.sub(' ', text.lower()).strip()
+
+
+def suffix_keys(text):
+    """``'Cordless power drill'`` -> ``('cordless power drill', 'power drill', 'drill')``."""
+    words = normalize(text).split()
+    return tuple(dict.fromkeys(' '.join(words[i:]) for i in range(len(words))))
+
+
+def item_score(rating, reviews_count):
+    return float(rating or 0) + math.log1p(reviews_count or 0)
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.keys = []      # sorted (key, ref)
+        self.entries = {}   # ref -> (label, score, keys)
+        self._short = {}    # memoized best refs for short prefixes
+
+    def load(self, rows):
+        """Replace the contents with ``(ref, label, score)`` rows in one sort."""
+        self.entries = {ref: (label, score, suffix_keys(label)) for ref, label, score in rows}
+        self.keys = sorted((key, ref) for ref, entry in self.entries.items() for key in entry[2])
+        self._short = {}
+
+    def put(self, ref, label, score):
+        entry = self.entries.get(ref)
+        if entry and entry[0] == label:
+            self.entries[ref] = (label, score, entry[2])
+            self._forget(entry[2])
+            return
+        self.remove(ref)
+        keys = suffix_keys(label)
+        if not keys:
+            return
+        self.entries[ref] = (label, score, keys)
+        for key in keys:
+            insort(self.keys, (key, ref))
+        self._forget(keys)
+
+    def remove(self, ref):
+        entry = self.entries.pop(ref, None)
+        if entry is None:
+            return
+        for key in entry[2]:
+            i = bisect_left(self.keys, (key, ref))
+            if i < len(self.keys) and self.keys[i] == (key, ref):
+                del self.keys[i]
+        self._forget(entry[2])
+
+    def _forget(self, keys):
+        for key in keys:
+            for n in range(1, SHORT_PREFIX + 1):
+                self._short.pop(key[:n], None)
+
+    def search(self, prefix, limit, max_limit):
+        if len(prefix) > SHORT_PREFIX:
+            return self._best(prefix, limit)
+        best = self._short.get(prefix)
+        if best is None:
+            best = self._short[prefix] = self._best(prefix, max_limit)
+        return best[:limit]
+
+    def _best(self, prefix, limit):
+        start = bisect_left(self.keys, (prefix,))
+        end = bisect_left(self.keys, (prefix + '\x7f',), start)
+        refs = {ref for _, ref in self.keys[start:end]}
+        return heapq.nsmallest(limit, refs, key=lambda ref: (-self.entries[ref][1], self.entries[ref][0]))
+
+
+class SuggestIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.items = PrefixIndex()
+        self.categories = PrefixIndex()
+        self.locations = PrefixIndex()       # ref: normalized location
+        self.item_locations = {}             # item id -> normalized location
+        self.location_counts = Counter()
+        self.loaded_at = time.monotonic()
+        self.built_at = timezone.now()
+
+    @classmethod
+    def from_rows(cls, items, categories, built_at=None):
+        """``items``: ``(id, name, location, score)``; ``categories``: ``(id, name, score)``."""
+        index = cls()
+        labels = {}
+        for pk, _, location, _ in items:
+            key = normalize(location)
+            if key:
+                index.item_locations[pk] = key
+                index.location_counts[key] += 1
+                labels.setdefault(key, location.strip())
+        index.items.load((pk, name, score) for pk, name, _, score in items)
+        index.categories.load(categories)
+        index.locations.load((key, labels[key], count) for key, count in index.location_counts.items())
+        index.built_at = built_at or index.built_at
+        return index
+
+    def put_item(self, pk, name, location, score):
+        with self.lock:
+            self.items.put(pk, name, score)
+            self._move_location(pk, normalize(location), (location or '').strip())
+
+    def drop_item(self, pk):
+        with self.lock:
+            self.items.remove(pk)
+            self._move_location(pk, '', '')
+
+    def _move_location(self, pk, key, label):
+        old = self.item_locations.pop(pk, '')
+        if old == key:
+            if key:
+                self.item_locations[pk] = key
+            return
+        if old:
+            self.location_counts[old] -= 1
+            if self.location_counts[old] > 0:
+                self.locations.put(old, self.locations.entries[old][0], self.location_counts[old])
+            else:
+                del self.location_counts[old]
+                self.locations.remove(old)
+        if key:
+            self.item_locations[pk] = key
+            self.location_counts[key] += 1
+            entry = self.locations.entries.get(key)
+            self.locations.put(key, entry[0] if entry else label, self.location_counts[key])
+
+    def put_category(self, pk, name, score):
+        with self.lock:
+            self.categories.put(pk, name, score)
+
+    def drop_category(self, pk):
+        with self.lock:
+            self.categories.remove(pk)
+
+    def suggest(self, query, limit, max_limit):
+        prefix = normalize(query)
+        if not prefix:
+            return {'items': [], 'categories': [], 'locations': []}
+        with self.lock:
+            items = self.items.search(prefix, limit, max_limit)
+            categories = self.categories.search(prefix, limit, max_limit)
+            locations = self.locations.search(prefix, limit, max_limit)
+            return {
+                'items': [{'id': pk, 'name': self.items.entries[pk][0]} for pk in items],
+                'categories': [{'id': pk, 'name': self.categories.entries[pk][0]} for pk in categories],
+                'locations': [
+                    {'name': self.locations.entries[key][0], 'count': self.location_counts[key]} for key in locations
+                ],
+            }
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'version': SNAPSHOT_VERSION,
+                'built_at': self.built_at.isoformat(),
+                'items': [
+                    [pk, label, self.locations.entries[self.item_locations[pk]][0] if pk in self.item_locations else '', score]
+                    for pk, (label, score, _) in self.items.entries.items()
+                ],
+                'categories': [[pk, label, score] for pk, (label, score, _) in self.categories.entries.items()],
+            }
+
+
+def build_from_database():
+    built_at = timezone.now()
+    items = [
+        (pk, name, location or '', item_score(rating, reviews))
+        for pk, name, location, rating, reviews in Item.objects.filter(is_listed=True)
+        .values_list('pk', 'name', 'location', 'rating', 'reviews_count').iterator(chunk_size=5000)
+    ]
+    categories = list(Category.objects.values_list('pk', 'name', 'available_item_count'))
+    return SuggestIndex.from_rows(items, categories, built_at)
+
+
+def write_snapshot(index, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    payload = gzip.compress(json.dumps(index.snapshot(), separators=(',', ':')).encode('utf-8'))
+    temp_path = f'{path}.part'
+    with open(temp_path, 'wb') as fh:
+        fh.write(payload)
+    os.replace(temp_path, path)
+    return len(payload)
+
+
+def read_snapshot(path):
+    """The index stored at ``path``, or ``None`` if it's missing or from another version."""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if data.get('version') != SNAPSHOT_VERSION:
+        return None
+    index = SuggestIndex.from_rows(
+        [tuple(row) for row in data['items']], [tuple(row) for row in data['categories']],
+        datetime.fromisoformat(data['built_at']),
+    )
+    # Age counts from when the snapshot was built, so an old one is refreshed soon after startup
+    index.loaded_at -= (timezone.now() - index.built_at).total_seconds()
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+_reloading = threading.Event()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                path = get_config()['SNAPSHOT_PATH']
+                _index = (path and read_snapshot(path)) or build_from_database()
+    if time.monotonic() - _index.loaded_at > get_config()['RELOAD_SECONDS'] and not _reloading.is_set():
+        _reloading.set()
+        threading.Thread(target=_reload, name='suggest-reload', daemon=True).start()
+    return _index
+
+
+def _reload():
+    global _index
+    try:
+        _index = build_from_database()
+    finally:
+        connection.close()
+        _reloading.clear()
+
+
+def reset_index():
+    global _index
+    _index = None
+
+
+def suggest(query, limit=None):
+    config = get_config()
+    limit = max(1, min(limit or config['LIMIT'], config['MAX_LIMIT']))
+    return get_index().suggest(query, limit, config['MAX_LIMIT'])
+
+
+# Signal hooks: they only update an index this process already has, never build one
+
+def sync_item(item):
+    if _index is not None:
+        if item.is_listed:
+            _index.put_item(item.pk, item.name, item.location, item_score(item.rating, item.reviews_count))
+        else:
+            _index.drop_item(item.pk)
+
+
+def drop_item(pk):
+    if _index is not None:
+        _index.drop_item(pk)
+
+
+def sync_category(category):
+    if _index is not None:
+        _index.put_category(category.pk, category.name, category.available_item_count)
+
+
+def sync_categories(pks):
+    """Refresh categories whose counts changed without a save (e.g. ``recount_categories``)."""
+    if _index is not None:
+        for category in Category.objects.filter(pk__in=pks):
+            _index.put_category(category.pk, category.name, category.available_item_count)
+
+
+def drop_category(pk):
+    if _index is not None:
+        _index.drop_category(pk)
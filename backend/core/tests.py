@@ -1,7 +1,50 @@
-from django.test import TestCase
+import base64
+import csv
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from unittest import mock
+from decimal import Decimal
+from datetime import timedelta
+from io import StringIO
+import msgpack
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
-from .models import Item, Category, RentalRequest
+from .admin import EstimatedCountPaginator
+from .authentication import CachedTokenAuthentication, token_cache
+from .bulk import ItemImporter
+from .categories import recount_categories
+from . import compression
+from .formats import pack
+from .geo import bounding_box, covering_cells, encode_geohash, haversine_km
+from .archive import archive_history
+from .availability import sync_availability
+from .messaging import inbox_hub, send_message
+from .payments import apply_events, fake_events, ingest_buffer, parse_event, sign
+from .pricing import get_price_sheet
+from . import batch, routers
+from .similarity import build_similar_items
+from . import suggest
+from .startup import LazyRoutes
+from .storage import collect_blobs
+from .throttling import SingleFlight, bucket_store, single_flight
+from .urls import api_routes
+from .metrics import registry
+from .models import (
+    Item, Category, RentalRequest, Transaction, Dispute, Conversation, ConversationParticipant, Notification,
+    Message, ArchiveSegment, ItemBlackout, ItemImage, Blob, SimilarItem, PaymentEvent, RequestStatusChange,
+)
 
 class RentalLifecycleTest(TestCase):
     def setUp(self):
@@ -50,3 +93,1713 @@ class RentalLifecycleTest(TestCase):
         req.refresh_from_db()
         self.assertEqual(req.status, 'InHand')
         self.assertFalse(req.item.is_available)
+
+
+class RentalRequestQueryCountTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.renter = User.objects.create_user(username='renter', password='password')
+        self.category = Category.objects.create(name='Tools')
+
+    def create_requests(self, count):
+        for i in range(count):
+            item = Item.objects.create(
+                name=f'Item {i}',
+                description='Test item',
+                price_per_day=10.0,
+                category=self.category,
+                owner_id=str(self.owner.id)
+            )
+            req = RentalRequest.objects.create(
+                item=item,
+                requester_name='Renter',
+                owner_name='Owner',
+                requester_id=str(self.renter.id),
+                owner_id=str(self.owner.id),
+                start_date='2026-02-10',
+                end_date='2026-02-12',
+                total_price=20.0,
+                status='Disputed'
+            )
+            Transaction.objects.create(rental_request=req, amount=20.0, transaction_type='Payment', status='Success')
+            Dispute.objects.create(rental_request=req, reporter_id=str(self.renter.id), reason='Broken')
+
+    def test_list_query_count_is_constant(self):
+        self.client.force_authenticate(user=self.renter)
+        self.create_requests(2)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/requests/')
+        self.assertEqual(len(response.data), 2)
+
+        self.create_requests(5)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/requests/')
+        self.assertEqual(len(response.data), 7)
+        self.assertEqual(len(response.data[0]['transactions']), 1)
+        self.assertEqual(response.data[0]['dispute']['reason'], 'Broken')
+
+    def test_sparse_fields_skip_nested_payloads(self):
+        self.client.force_authenticate(user=self.renter)
+        self.create_requests(3)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/requests/', {'fields': 'id,status'})
+        self.assertEqual(set(response.data[0].keys()), {'id', 'status'})
+
+
+class SparseFieldsetTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.category = Category.objects.create(name='Tools')
+        for i in range(3):
+            Item.objects.create(
+                name=f'Item {i}',
+                description='Test item',
+                price_per_day=10.0,
+                category=self.category,
+                owner_id=str(self.owner.id)
+            )
+
+    def test_full_payload_by_default(self):
+        response = self.client.get('/api/items/')
+        self.assertIn('item_images', response.data[0])
+        self.assertEqual(response.data[0]['owner_details']['name'], 'owner')
+
+    def test_fields_trim_columns_and_relations(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/items/', {'fields': 'id,name'})
+        self.assertEqual(set(response.data[0].keys()), {'id', 'name'})
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/items/', {'fields': 'id,name'})
+        self.assertNotIn('description', ctx.captured_queries[0]['sql'])
+
+    def test_expand_selects_nested_fields(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/items/', {'fields': 'id,category_name', 'expand': 'item_images'})
+        self.assertEqual(set(response.data[0].keys()), {'id', 'category_name', 'item_images'})
+
+        response = self.client.get('/api/items/', {'expand': ''})
+        self.assertNotIn('item_images', response.data[0])
+        self.assertNotIn('owner_details', response.data[0])
+        self.assertIn('description', response.data[0])
+
+    def test_fields_ignored_on_writes(self):
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.post('/api/items/?fields=id', {
+            'name': 'Saw',
+            'description': 'Hand saw',
+            'price_per_day': '5.00',
+            'category': self.category.id,
+            'owner_id': str(self.owner.id),
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('name', response.data)
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='renter', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        token_cache.clear()
+        token_cache.reset_metrics()
+
+    def test_repeat_requests_skip_auth_query(self):
+        with CaptureQueriesContext(connection) as first:
+            self.client.get('/api/notifications/')
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get('/api/notifications/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(second), len(first) - 1)
+        self.assertEqual(token_cache.metrics()['hits'], 1)
+        self.assertEqual(token_cache.metrics()['hit_rate'], 0.5)
+
+    def test_deleted_token_is_evicted(self):
+        self.client.get('/api/notifications/')
+        self.token.delete()
+        self.assertEqual(self.client.get('/api/notifications/').status_code, 401)
+
+    def test_deactivated_user_is_evicted(self):
+        self.client.get('/api/notifications/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/notifications/').status_code, 401)
+
+    def test_expired_token_rejected_and_rotated_on_login(self):
+        Token.objects.filter(pk=self.token.pk).update(created=timezone.now() - timedelta(days=2))
+        with self.settings(TOKEN_AUTH_CACHE={'TOKEN_TTL': 3600}):
+            self.assertEqual(self.client.get('/api/notifications/').status_code, 401)
+            response = self.client.post('/api/auth/login/', {'username': 'renter', 'password': 'password'})
+        self.assertNotEqual(response.data['token'], self.token.key)
+
+    def test_rotate_token(self):
+        response = self.client.post('/api/auth/token/rotate/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/notifications/').status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {response.data['token']}")
+        self.assertEqual(self.client.get('/api/notifications/').status_code, 200)
+
+    def test_lru_is_bounded(self):
+        with self.settings(TOKEN_AUTH_CACHE={'MAX_ENTRIES': 2}):
+            for i in range(3):
+                token_cache.set(f'key{i}', self.user, timezone.now())
+        self.assertIsNone(token_cache.get('key0'))
+        self.assertEqual(token_cache.metrics()['evictions'], 1)
+
+
+class PerformanceMiddlewareTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser(username='admin', password='password')
+        self.category = Category.objects.create(name='Tools')
+        registry.reset()
+
+    def test_records_queries_per_route(self):
+        for i in range(3):
+            Item.objects.create(name=f'Item {i}', description='Test', price_per_day=10.0,
+                                category=self.category, owner_id=str(self.admin.id))
+        self.client.get('/api/items/')
+        stats = registry.routes[('item-list', 'GET')]
+        self.assertEqual(stats.latency.count, 1)
+        # items + images prefetch + one owner lookup per item
+        self.assertEqual(stats.queries.sum, 5)
+        self.assertGreater(stats.response_bytes, 0)
+        self.assertGreater(stats.render_seconds, 0)
+        self.assertEqual(stats.statuses[200], 1)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/health/')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get('/api/metrics/')
+        body = response.content.decode()
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('http_request_duration_seconds_count{route="health_check",method="GET"} 1', body)
+        self.assertIn('http_request_db_queries_bucket{route="health_check",method="GET",le="0"} 1', body)
+        self.assertIn('auth_token_cache_hit_ratio', body)
+
+    def test_slow_requests_are_logged_with_sql(self):
+        with self.settings(PERFORMANCE_METRICS={'SLOW_REQUEST_MS': 0}):
+            with self.assertLogs('core.performance', level='WARNING') as logs:
+                self.client.get('/api/categories/')
+        self.assertIn('category-list', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+        self.assertEqual(registry.routes[('category-list', 'GET')].slow, 1)
+
+    def test_disabled(self):
+        with self.settings(PERFORMANCE_METRICS={'ENABLED': False}):
+            self.assertEqual(self.client.get('/api/categories/').status_code, 200)
+        self.assertEqual(registry.routes, {})
+
+
+class BenchmarkCommandTest(TestCase):
+    def test_seed_and_run(self):
+        call_command('seed_benchmark', users=5, items=20, requests=30, conversations=4,
+                     messages_per_conversation=3, notifications=40, stdout=StringIO())
+        statuses = set(RentalRequest.objects.values_list('status', flat=True))
+        self.assertEqual(statuses, {status for status, _ in RentalRequest.STATUS_CHOICES})
+        self.assertEqual(Item.objects.count(), 20)
+        self.assertEqual(Dispute.objects.count(), 3)
+        self.assertEqual(ConversationParticipant.objects.count(), 8)
+        self.assertFalse(Conversation.objects.filter(last_message__isnull=True).exists())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'bench.json')
+            call_command('run_benchmark', iterations=3, output=output,
+                         only='items-list,requests-list', stdout=StringIO())
+            with open(output) as fh:
+                report = json.load(fh)
+        self.assertEqual([r['name'] for r in report['results']], ['items-list', 'requests-list'])
+        result = report['results'][1]
+        self.assertEqual(result['requests'], 3)
+        self.assertEqual(result['errors'], 0)
+        self.assertIn('p99', result['latency_ms'])
+        self.assertGreater(result['queries']['mean'], 0)
+        self.assertEqual(report['dataset']['items'], 20)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'formats.json')
+            call_command('benchmark_formats', repeat=1, output=output, stdout=StringIO())
+            with open(output) as fh:
+                report = json.load(fh)
+        self.assertEqual([r['name'] for r in report['results']], ['items-list', 'requests-list', 'messages-list'])
+        rows = {(row['format'], row['encoding']): row for row in report['results'][0]['formats']}
+        self.assertEqual(rows['json', 'identity']['ratio'], 1.0)
+        self.assertLess(rows['msgpack', 'identity']['bytes'], rows['json', 'identity']['bytes'])
+        self.assertLess(rows['json', 'gzip']['bytes'], rows['json', 'identity']['bytes'])
+
+
+class ProximitySearchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Tools')
+        for name, location in [('Makati drill', 'Makati'), ('BGC ladder', 'BGC, Taguig'),
+                               ('Cebu tent', 'Cebu City'), ('Unknown', 'Somewhere')]:
+            Item.objects.create(name=name, description='Test', price_per_day=10.0,
+                                category=self.category, owner_id='1', location=location)
+
+    def test_items_are_geocoded_from_location(self):
+        item = Item.objects.get(name='BGC ladder')
+        self.assertAlmostEqual(item.latitude, 14.5509, places=3)
+        self.assertEqual(item.geohash, encode_geohash(item.latitude, item.longitude))
+        self.assertIsNone(Item.objects.get(name='Unknown').geohash)
+
+        item.location = 'Cebu'
+        item.save()
+        self.assertAlmostEqual(item.latitude, 10.3157, places=3)
+
+        # A place we can't find must not keep the old place's coordinates
+        item.location = 'Atlantis'
+        item.save()
+        item.refresh_from_db()
+        self.assertEqual((item.latitude, item.longitude, item.geohash), (None, None, None))
+        # ...but coordinates given along with it are kept
+        item.location, item.latitude, item.longitude = 'Camp site', 14.6, 121.0
+        item.save()
+        self.assertEqual(item.geohash, encode_geohash(14.6, 121.0))
+
+    def test_radius_search_sorted_by_distance(self):
+        response = self.client.get('/api/items/', {'near': '14.5547,121.0244', 'radius_km': 5})
+        self.assertEqual([i['name'] for i in response.data], ['Makati drill', 'BGC ladder'])
+        self.assertEqual(response.data[0]['distance_km'], 0.0)
+        self.assertAlmostEqual(response.data[1]['distance_km'], haversine_km(14.5547, 121.0244, 14.5509, 121.0503), places=2)
+
+        response = self.client.get('/api/items/', {'near': 'Cebu', 'radius_km': 1})
+        self.assertEqual([i['name'] for i in response.data], ['Cebu tent'])
+
+    def test_bbox_search(self):
+        response = self.client.get('/api/items/', {'bbox': '120.9,14.4,121.1,14.7'})
+        self.assertEqual({i['name'] for i in response.data}, {'Makati drill', 'BGC ladder'})
+
+    def test_invalid_params(self):
+        self.assertEqual(self.client.get('/api/items/', {'near': 'Atlantis'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/items/', {'bbox': '1,2,3'}).status_code, 400)
+        for bbox in ('-inf,-inf,inf,inf', '-1e308,-1e308,1e308,1e308', 'nan,0,1,1', '-181,0,0,1'):
+            self.assertEqual(self.client.get('/api/items/', {'bbox': bbox}).status_code, 400)
+        for radius in ('inf', 'nan', '-1'):
+            self.assertEqual(self.client.get('/api/items/', {'near': 'Cebu', 'radius_km': radius}).status_code, 400)
+
+    def test_geohash_cover_matches_brute_force(self):
+        rng = random.Random(1)
+        points = [(rng.uniform(14, 15), rng.uniform(120.5, 121.5)) for _ in range(500)]
+        for lat, lon in [(14.5, 121.0), (14.55, 120.98)]:
+            box = bounding_box(lat, lon, 8)
+            cells = covering_cells(*box)
+            self.assertLessEqual(len(cells), 16)
+            for p_lat, p_lon in points:
+                if haversine_km(lat, lon, p_lat, p_lon) <= 8:
+                    self.assertTrue(any(encode_geohash(p_lat, p_lon).startswith(c) for c in cells))
+
+    def test_benchmark_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'geo.json')
+            call_command('benchmark_geo', items=300, queries=5, output=output, stdout=StringIO())
+            with open(output) as fh:
+                report = json.load(fh)
+        geohash, scan = report['results']
+        self.assertEqual(geohash['mean_results'], scan['mean_results'])
+
+
+class BulkItemImportTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(username='seller', password='password')
+        self.client.force_authenticate(user=self.owner)
+        self.tools = Category.objects.create(name='Tools')
+
+    def upload(self, content, name='items.csv', **extra):
+        upload = SimpleUploadedFile(name, content.encode())
+        return self.client.post('/api/items/import/', {'file': upload, **extra}, format='multipart')
+
+    def test_csv_import_reports_row_errors(self):
+        csv_content = (
+            'name,description,price_per_day,category,location,image_url\n'
+            'Drill,Power drill,100,tools,Makati,\n'
+            'Tent,4 person tent,250.5,Camping,,https://example.com/tent.jpg\n'
+            ',Missing name,10,Tools,,\n'
+            'Saw,Hand saw,abc,Tools,,not-a-url\n'
+            'Ladder,Steel ladder,50,%s,,\n'
+        ) % self.tools.id
+        # Creating "Camping" costs three of these; known categories are one lookup per batch
+        with self.assertNumQueries(9):
+            response = self.upload(csv_content)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(response.data['failed'], 2)
+        self.assertEqual([e['row'] for e in response.data['errors']], [3, 4])
+        self.assertEqual(set(response.data['errors'][1]['errors']), {'price_per_day', 'image_url'})
+
+        drill = Item.objects.get(name='Drill')
+        self.assertEqual(drill.category, self.tools)
+        self.assertEqual(drill.owner_id, str(self.owner.id))
+        self.assertIsNotNone(drill.geohash)
+        self.assertTrue(Category.objects.filter(name='Camping').exists())
+
+    def test_ndjson_import_and_dry_run(self):
+        content = '{"name": "Kayak", "description": "Single", "price_per_day": 300, "category": "Water"}\nnot json\n'
+        response = self.upload(content, name='items.ndjson', dry_run='true')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'], [{'row': 2, 'errors': {'row': 'Invalid JSON object.'}}])
+        self.assertFalse(Item.objects.exists())
+        self.assertFalse(Category.objects.filter(name='Water').exists())
+
+        response = self.upload(content, name='items.ndjson')
+        self.assertEqual(Item.objects.get().category.name, 'Water')
+
+    def test_non_utf8_file_is_a_row_error(self):
+        latin1 = 'name,description,price_per_day,category\nPiñata,Party,10,Tools\n'.encode('latin-1')
+        upload = SimpleUploadedFile('items.csv', latin1)
+        response = self.client.post('/api/items/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'][0]['row'], 1)
+        self.assertIn('UTF-8', response.data['errors'][0]['errors']['row'])
+
+    def test_export_round_trip(self):
+        Item.objects.create(name='Drill', description='Power drill', price_per_day=100,
+                            category=self.tools, owner_id=str(self.owner.id), location='Makati')
+        Item.objects.create(name='Other', description='Not mine', price_per_day=1,
+                            category=self.tools, owner_id='999')
+
+        response = self.client.get('/api/items/export/')
+        body = b''.join(response.streaming_content).decode()
+        rows = list(csv.DictReader(StringIO(body)))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['category'], 'Tools')
+
+        response = self.client.get('/api/items/export/', {'file_format': 'ndjson'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(json.loads(lines[0])['name'], 'Drill')
+
+        Item.objects.all().delete()
+        self.upload(body)
+        self.assertEqual(Item.objects.get().name, 'Drill')
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as fh:
+            fh.write('name,description,price_per_day,category\nDrill,Power drill,100,Tools\nBad,,1,Tools\n')
+        try:
+            stderr = StringIO()
+            call_command('import_items', fh.name, owner='seller', stdout=StringIO(), stderr=stderr)
+        finally:
+            os.unlink(fh.name)
+        self.assertEqual(Item.objects.count(), 1)
+        self.assertIn('Row 2', stderr.getvalue())
+
+
+class CategoryTreeTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='owner', password='password')
+        self.outdoor = Category.objects.create(name='Outdoor')
+        self.camping = Category.objects.create(name='Camping', parent=self.outdoor)
+        self.tents = Category.objects.create(name='Tents', parent=self.camping)
+        self.tools = Category.objects.create(name='Tools')
+        cache.clear()
+
+    def add_item(self, category, **kwargs):
+        return Item.objects.create(name='Thing', description='Test', price_per_day=1,
+                                   category=category, owner_id=str(self.user.id), **kwargs)
+
+    def count(self, category):
+        return Category.objects.get(pk=category.pk).available_item_count
+
+    def test_paths(self):
+        self.tents.refresh_from_db()
+        self.assertEqual(self.tents.path, f'{self.outdoor.id:06d}/{self.camping.id:06d}/{self.tents.id:06d}/')
+        self.assertEqual(self.tents.depth, 2)
+
+        self.camping.parent = self.tools
+        self.camping.save()
+        self.tents.refresh_from_db()
+        self.assertEqual(self.tents.path, f'{self.tools.id:06d}/{self.camping.id:06d}/{self.tents.id:06d}/')
+
+    def test_counts_follow_item_writes(self):
+        item = self.add_item(self.tents)
+        self.add_item(self.tents, is_available=False)
+        self.assertEqual(self.count(self.tents), 1)
+
+        item = Item.objects.get(pk=item.pk)
+        item.category = self.tools
+        item.save()
+        self.assertEqual((self.count(self.tents), self.count(self.tools)), (0, 1))
+
+        item.is_available = False
+        item.save()
+        self.assertEqual(self.count(self.tools), 0)
+
+        item.is_available = True
+        item.save()
+        Item.objects.get(pk=item.pk).delete()
+        self.assertEqual(self.count(self.tools), 0)
+
+    def test_tree_endpoint_is_cached(self):
+        self.add_item(self.tents)
+        self.add_item(self.camping)
+        response = self.client.get('/api/categories/tree/')
+        outdoor = response.data[0]
+        self.assertEqual(outdoor['name'], 'Outdoor')
+        self.assertEqual(outdoor['total_item_count'], 2)
+        self.assertEqual(outdoor['children'][0]['item_count'], 1)
+        self.assertEqual(outdoor['children'][0]['children'][0]['name'], 'Tents')
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/categories/tree/')
+        self.add_item(self.tools)
+        response = self.client.get('/api/categories/tree/')
+        self.assertEqual(response.data[1]['total_item_count'], 1)
+
+    def test_get_or_create_by_name(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/api/categories/get_or_create/', {'name': ' tools '})
+        self.assertEqual((response.status_code, response.data['id']), (200, self.tools.id))
+        response = self.client.post('/api/categories/get_or_create/', {'name': 'Sleeping bags', 'parent': self.camping.id})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['depth'], 2)
+        self.assertEqual(self.client.get('/api/categories/', {'name': 'TOOLS'}).data[0]['id'], self.tools.id)
+
+    def test_items_in_subtree(self):
+        self.add_item(self.tents)
+        self.add_item(self.tools)
+        response = self.client.get('/api/items/', {'category_id': self.outdoor.id, 'include_descendants': 'true'})
+        self.assertEqual(len(response.data), 1)
+
+    def test_cannot_move_under_descendant(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.patch(f'/api/categories/{self.outdoor.id}/', {'parent': self.tents.id})
+        self.assertEqual(response.status_code, 400)
+
+    def test_recount(self):
+        self.add_item(self.tents)
+        Category.objects.update(available_item_count=7)
+        recount_categories()
+        self.assertEqual((self.count(self.tents), self.count(self.tools)), (1, 0))
+
+
+class MessagingTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.carol = User.objects.create_user(username='carol', password='password')
+        self.conversation = Conversation.objects.create(participant_ids=[str(self.alice.id), str(self.bob.id)])
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.alice)
+
+    def send(self, user, text):
+        self.client.force_authenticate(user=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/messages/', {'conversation': self.conversation.id, 'text': text})
+
+    def unread(self, user):
+        return ConversationParticipant.objects.get(conversation=self.conversation, user_id=str(user.id)).unread_count
+
+    def test_send_updates_summary_and_unread_counts(self):
+        version = inbox_hub.version(self.bob.id)
+        response = self.send(self.alice, 'Is the tent still available?')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['sender_id'], str(self.alice.id))
+        self.send(self.alice, 'Hello?')
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_text, 'Hello?')
+        self.assertEqual((self.unread(self.alice), self.unread(self.bob)), (0, 2))
+        self.assertGreater(inbox_hub.version(self.bob.id), version)
+        # Only the first unread message of a conversation notifies
+        self.assertEqual(Notification.objects.filter(target_user_id=str(self.bob.id), event_type='new_message').count(), 1)
+
+        self.send(self.bob, 'Yes it is')
+        self.assertEqual((self.unread(self.alice), self.unread(self.bob)), (1, 0))
+
+    def test_inbox_is_one_query(self):
+        other = Conversation.objects.create(participant_ids=[str(self.alice.id), str(self.carol.id)])
+        self.send(self.bob, 'First')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(user=self.carol)
+            self.client.post('/api/messages/', {'conversation': other.id, 'text': 'Newest'})
+
+        self.client.force_authenticate(user=self.alice)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/conversations/', {'expand': 'item_details'})
+        self.assertEqual([c['id'] for c in response.data], [other.id, self.conversation.id])
+        self.assertEqual(response.data[0]['last_message']['text'], 'Newest')
+        self.assertEqual(response.data[0]['unread_count'], 1)
+
+    def test_mark_read(self):
+        self.send(self.bob, 'One')
+        self.send(self.bob, 'Two')
+        self.client.force_authenticate(user=self.alice)
+        self.assertEqual(self.client.post(f'/api/conversations/{self.conversation.id}/read/').status_code, 200)
+        self.assertEqual(self.unread(self.alice), 0)
+        self.assertFalse(self.conversation.messages.filter(is_read=False).exists())
+
+    def test_non_participant_cannot_send_or_read(self):
+        self.send(self.alice, 'Private')
+        self.assertEqual(self.send(self.carol, 'Hi').status_code, 403)
+        self.assertEqual(self.client.get('/api/messages/', {'conversation_id': self.conversation.id}).data, [])
+
+    def test_updates_long_poll(self):
+        since = timezone.now()
+        response = self.client.get('/api/conversations/updates/', {'since': since.isoformat(), 'timeout': 0})
+        self.assertEqual(response.data['conversations'], [])
+        self.send(self.bob, 'Ping')
+        self.client.force_authenticate(user=self.alice)
+        response = self.client.get('/api/conversations/updates/', {'since': since.isoformat(), 'timeout': 0})
+        self.assertEqual(len(response.data['conversations']), 1)
+        self.assertGreater(response.data['cursor'], since.isoformat())
+        self.assertEqual(self.client.get('/api/conversations/updates/', {'since': 'yesterday'}).status_code, 400)
+
+    def test_updates_wait_is_bounded(self):
+        self.client.force_authenticate(user=self.alice)
+        params = {'since': timezone.now().isoformat(), 'timeout': 600}
+        with mock.patch.object(inbox_hub, 'wait', return_value=False) as wait:
+            self.client.get('/api/conversations/updates/', params)  # short poll by default
+            with override_settings(MESSAGING_LONG_POLL_SECONDS=600):
+                self.client.get('/api/conversations/updates/', params)
+        self.assertEqual(wait.call_count, 1)
+        self.assertEqual(wait.call_args.args[2], 20)
+
+
+class ArchiveTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media.name)
+        self.settings_override.enable()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.conversation = Conversation.objects.create(participant_ids=[str(self.alice.id), str(self.bob.id)])
+        old = timezone.now() - timedelta(days=365)
+        for number in range(5):
+            Message.objects.create(conversation=self.conversation, sender_id=str(self.bob.id), text=f'old {number}')
+        Message.objects.update(timestamp=old)
+        self.recent = Message.objects.create(conversation=self.conversation, sender_id=str(self.alice.id), text='new')
+        for is_read in (True, False):
+            Notification.objects.create(target_user_id=str(self.alice.id), event_type='x', title='t', message='m', is_read=is_read)
+        Notification.objects.update(timestamp=old)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.alice)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media.cleanup()
+
+    @override_settings(ARCHIVE={'BATCH_SIZE': 2})
+    def test_archive_moves_rows_in_batches(self):
+        results = archive_history()
+        self.assertEqual(results['message'], (5, 3))
+        self.assertEqual(results['notification'], (1, 1))
+        self.assertEqual(list(Message.objects.values_list('text', flat=True)), ['new'])
+        self.assertEqual(Notification.objects.count(), 1)
+        segment = ArchiveSegment.objects.filter(kind='message').first()
+        self.assertTrue(os.path.exists(os.path.join(self.media.name, segment.path)))
+        self.assertTrue(segment.path.endswith('.ndjson.gz'))
+
+    def test_reads_through_archive(self):
+        old_id = Message.objects.order_by('id').first().id
+        archive_history()
+        response = self.client.get('/api/messages/', {'conversation_id': self.conversation.id})
+        self.assertEqual([m['text'] for m in response.data], ['old 0', 'old 1', 'old 2', 'old 3', 'old 4', 'new'])
+        response = self.client.get(f'/api/messages/{old_id}/', {'fields': 'id,text'})
+        self.assertEqual(response.data, {'id': old_id, 'text': 'old 0'})
+
+        response = self.client.get('/api/notifications/', {'include_archived': 'true'})
+        self.assertEqual([n['is_read'] for n in response.data], [False, True])
+        self.assertEqual(len(self.client.get('/api/notifications/').data), 1)
+
+    def test_last_message_kept_for_inbox_preview(self):
+        quiet = Conversation.objects.create(participant_ids=[str(self.alice.id), str(self.bob.id)])
+        last = send_message(quiet, self.bob.id, 'old hello')
+        Message.objects.filter(pk=last.pk).update(timestamp=timezone.now() - timedelta(days=365))
+        archive_history()
+        self.assertTrue(Message.objects.filter(pk=last.pk).exists())
+        response = self.client.get(f'/api/conversations/{quiet.id}/', {'fields': 'id,last_message'})
+        self.assertEqual(response.data['last_message']['id'], last.pk)
+        self.assertEqual(response.data['last_message']['text'], 'old hello')
+
+    def test_archive_hidden_from_non_participants(self):
+        old_id = Message.objects.order_by('id').first().id
+        archive_history()
+        outsider = User.objects.create_user(username='carol', password='password')
+        self.client.force_authenticate(user=outsider)
+        self.assertEqual(self.client.get('/api/messages/', {'conversation_id': self.conversation.id}).data, [])
+        self.assertEqual(self.client.get(f'/api/messages/{old_id}/').status_code, 404)
+
+    def test_command_and_purge(self):
+        out = StringIO()
+        call_command('archive_history', '--dry-run', stdout=out)
+        self.assertIn('message: 5 rows would be archived', out.getvalue())
+        call_command('archive_history', '--kind', 'message', stdout=StringIO())
+        self.assertEqual(Notification.objects.count(), 2)
+        path = ArchiveSegment.objects.get().path
+        self.conversation.delete()
+        self.assertFalse(ArchiveSegment.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media.name, path)))
+
+
+class QuoteEngineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.renter = User.objects.create_user(username='renter', password='password')
+        self.item = Item.objects.create(
+            name='Tent', description='4 person tent', price_per_day='100.00', security_deposit='500.00',
+            weekly_discount_percent='10', monthly_discount_percent='25',
+            category=Category.objects.create(name='Camping'), owner_id=str(self.owner.id),
+        )
+
+    def quote(self, payload):
+        return self.client.post(f'/api/items/{self.item.id}/quote/', payload, format='json')
+
+    def test_single_quote(self):
+        response = self.quote({'start_date': '2026-03-10', 'end_date': '2026-03-12'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['days'], 3)
+        self.assertEqual(response.data['total_price'], Decimal('300.00'))
+        self.assertEqual(response.data['amount_due'], Decimal('800.00'))
+        self.assertIsNone(response.data['discount'])
+
+    def test_batch_quotes_apply_discount_tiers(self):
+        response = self.quote({'periods': [
+            {'start_date': '2026-03-01', 'end_date': '2026-03-07'},
+            {'start_date': '2026-03-01', 'end_date': '2026-03-30'},
+        ]})
+        weekly, monthly = response.data['quotes']
+        self.assertEqual((weekly['discount'], weekly['total_price']), ('weekly', Decimal('630.00')))
+        self.assertEqual((monthly['discount'], monthly['total_price']), ('monthly', Decimal('2250.00')))
+
+    def test_invalid_periods(self):
+        self.assertEqual(self.quote({'start_date': '2026-03-12', 'end_date': '2026-03-10'}).status_code, 400)
+        self.assertEqual(self.quote({'periods': ['2026-03-10']}).status_code, 400)
+        self.assertEqual(self.client.post('/api/items/999/quote/', {}, format='json').status_code, 404)
+
+    def test_blackouts_and_cache_invalidation(self):
+        period = {'start_date': '2026-03-10', 'end_date': '2026-03-12'}
+        self.quote(period)
+        with self.assertNumQueries(0):
+            self.quote(period)
+
+        ItemBlackout.objects.create(item=self.item, start_date='2026-03-12', end_date='2026-03-15', reason='Maintenance')
+        response = self.quote(period)
+        self.assertFalse(response.data['available'])
+        self.assertEqual(response.data['blackout']['reason'], 'Maintenance')
+
+        self.item.price_per_day = '80.00'
+        self.item.save()
+        self.assertEqual(get_price_sheet(self.item.id).daily_rate, Decimal('80.00'))
+
+    def test_blackout_partial_update(self):
+        blackout = ItemBlackout.objects.create(item=self.item, start_date='2026-03-12', end_date='2026-03-15')
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.patch(f'/api/item-blackouts/{blackout.id}/', {'end_date': '2026-03-20'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['end_date'], '2026-03-20')
+
+        other = Item.objects.create(
+            name='Stove', description='Camp stove', price_per_day='20.00',
+            category=self.item.category, owner_id=str(self.renter.id),
+        )
+        response = self.client.patch(f'/api/item-blackouts/{blackout.id}/', {'item': other.id}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_rental_request_uses_engine(self):
+        self.client.force_authenticate(user=self.renter)
+        response = self.client.post('/api/requests/', {
+            'item': self.item.id, 'requester_name': 'Renter', 'owner_name': 'Owner',
+            'start_date': '2026-03-10', 'end_date': '2026-03-12', 'total_price': 1.0,
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('300.00'))
+        self.assertEqual(Decimal(response.data['deposit_amount']), Decimal('500.00'))
+
+        ItemBlackout.objects.create(item=self.item, start_date='2026-04-01', end_date='2026-04-02')
+        response = self.client.post('/api/requests/', {
+            'item': self.item.id, 'requester_name': 'Renter', 'owner_name': 'Owner',
+            'start_date': '2026-03-30', 'end_date': '2026-04-01',
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_rental_request_date_change_is_repriced(self):
+        self.client.force_authenticate(user=self.renter)
+        response = self.client.post('/api/requests/', {
+            'item': self.item.id, 'requester_name': 'Renter', 'owner_name': 'Owner',
+            'start_date': '2026-03-10', 'end_date': '2026-03-10',
+        })
+        url = f"/api/requests/{response.data['id']}/"
+        RentalRequest.objects.filter(pk=response.data['id']).update(status='Approved')  # blocks its own days
+
+        response = self.client.patch(url, {'end_date': '2026-03-12'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('300.00'))
+
+        RentalRequest.objects.create(
+            item=self.item, requester_name='Other', owner_name='Owner', requester_id='99', owner_id=str(self.owner.id),
+            start_date='2026-03-14', end_date='2026-03-15', total_price=200, status='Paid',
+        )
+        self.assertEqual(self.client.patch(url, {'end_date': '2026-03-14'}, format='json').status_code, 400)
+        ItemBlackout.objects.create(item=self.item, start_date='2026-03-20', end_date='2026-03-20')
+        self.assertEqual(self.client.patch(url, {'start_date': '2026-03-19', 'end_date': '2026-03-21'},
+                                           format='json').status_code, 400)
+        self.assertEqual(self.client.patch(url, {'requester_name': 'R'}, format='json').status_code, 200)
+        self.assertEqual(RentalRequest.objects.get(pk=response.data['id']).total_price, Decimal('300.00'))
+
+
+class CalendarTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.owner = User.objects.create_user(username='owner', password='password')
+        category = Category.objects.create(name='Camping')
+        self.item = Item.objects.create(name='Tent', description='Tent', price_per_day=100, category=category, owner_id=str(self.owner.id))
+        self.other = Item.objects.create(name='Stove', description='Stove', price_per_day=50, category=category, owner_id=str(self.owner.id))
+        self.booking = self.book(self.item, '2026-03-05', '2026-03-07', 'Paid')
+        self.book(self.item, '2026-03-08', '2026-03-09', 'InHand')
+        self.book(self.item, '2026-03-20', '2026-03-21', 'Pending')
+        ItemBlackout.objects.create(item=self.item, start_date='2026-03-15', end_date='2026-03-15')
+
+    def book(self, item, start, end, status):
+        return RentalRequest.objects.create(
+            item=item, requester_name='r', owner_name='o', requester_id='99', owner_id=item.owner_id,
+            start_date=start, end_date=end, status=status, total_price=0,
+        )
+
+    def test_ranges_and_bitmap(self):
+        params = {'from': '2026-03-01', 'to': '2026-03-31'}
+        response = self.client.get(f'/api/items/{self.item.id}/calendar/', params)
+        self.assertEqual(response.status_code, 200)
+        ranges = [[str(s), str(e)] for s, e in response.data['ranges']]
+        self.assertEqual(ranges, [['2026-03-05', '2026-03-09'], ['2026-03-15', '2026-03-15']])
+        self.assertEqual(response.data['blocked_days'], 6)
+
+        response = self.client.get(f'/api/items/{self.item.id}/calendar/', {**params, 'encoding': 'bitmap'})
+        bits = int.from_bytes(base64.b64decode(response.data['bitmap']), 'little')
+        self.assertEqual([day for day in range(31) if bits >> day & 1], [4, 5, 6, 7, 8, 14])
+
+        self.assertEqual(self.client.get(f'/api/items/{self.item.id}/calendar/', {'from': '2026-03-31', 'to': '2026-03-01'}).status_code, 400)
+
+    def test_cached_until_status_change(self):
+        params = {'from': '2026-03-01', 'to': '2026-03-31'}
+        self.client.get(f'/api/items/{self.item.id}/calendar/', params)
+        with self.assertNumQueries(1):  # the item existence check only
+            self.client.get(f'/api/items/{self.item.id}/calendar/', params)
+
+        self.booking.status = 'Cancelled'
+        self.booking.save()
+        response = self.client.get(f'/api/items/{self.item.id}/calendar/', params)
+        self.assertEqual(response.data['blocked_days'], 3)
+
+    def test_batch(self):
+        response = self.client.get('/api/items/calendar/', {
+            'ids': f'{self.item.id},{self.other.id},9999', 'from': '2026-03-01', 'to': '2026-03-31',
+        })
+        calendars = response.data['calendars']
+        self.assertEqual(sorted(calendars), [self.item.id, self.other.id])
+        self.assertEqual(calendars[self.other.id]['blocked_days'], 0)
+        self.assertEqual(self.client.get('/api/items/calendar/', {'ids': 'abc'}).status_code, 400)
+
+    def test_booked_dates_cannot_be_quoted_or_requested(self):
+        period = {'start_date': '2026-03-06', 'end_date': '2026-03-06'}
+        response = self.client.post(f'/api/items/{self.item.id}/quote/', period, format='json')
+        self.assertTrue(response.data['booked'])
+        self.assertFalse(response.data['available'])
+
+        self.client.force_authenticate(user=User.objects.create_user(username='renter', password='password'))
+        response = self.client.post('/api/requests/', {
+            'item': self.item.id, 'requester_name': 'Renter', 'owner_name': 'Owner', **period,
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+class AvailabilityReconciliationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.category = Category.objects.create(name='Tools')
+        self.items = [
+            Item.objects.create(name=f'Item {n}', description='Test', price_per_day=10, category=self.category, owner_id=str(self.owner.id))
+            for n in range(6)
+        ]
+
+    def rent(self, item, status):
+        return RentalRequest.objects.create(
+            item=item, requester_name='r', owner_name='o', requester_id='99', owner_id=item.owner_id,
+            start_date='2026-03-01', end_date='2026-03-02', status=status, total_price=0,
+        )
+
+    def available(self, item):
+        return Item.objects.values_list('is_available', flat=True).get(pk=item.pk)
+
+    def test_transitions_keep_flag_in_step(self):
+        item = self.items[0]
+        request = self.rent(item, 'InHand')
+        self.assertFalse(self.available(item))
+        request.status = 'Cancelled'
+        request.save()
+        self.assertTrue(self.available(item))
+
+        request.status = 'Disputed'
+        request.save()
+        Dispute.objects.create(rental_request=request, reporter_id='99', reason='Damaged')
+        self.assertFalse(self.available(item))
+        request.dispute.status = 'Resolved'
+        request.dispute.save()
+        self.assertTrue(self.available(item))
+        self.assertEqual(Category.objects.get(pk=self.category.pk).available_item_count, 6)
+
+    def test_owner_cannot_relist_item_out_on_rental(self):
+        item = self.items[0]
+        self.rent(item, 'InHand')
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.patch(f'/api/items/{item.id}/', {'is_available': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.available(item))
+
+        self.client.patch(f'/api/items/{item.id}/', {'is_available': 'false'})
+        item.requests.update(status='Completed')
+        sync_availability()
+        self.assertFalse(self.available(item))  # unlisted by the owner stays unavailable
+
+    def test_command_fixes_drift_in_batches(self):
+        for item in self.items[:2]:
+            self.rent(item, 'InHand')
+        Item.objects.update(is_available=True)                    # drift: rented items look available
+        Item.objects.filter(pk__in=[i.pk for i in self.items[3:]]).update(is_available=False)
+
+        out = StringIO()
+        call_command('reconcile_availability', '--dry-run', stdout=out)
+        self.assertIn('2 items would be marked unavailable, 3 would be marked available', out.getvalue())
+
+        with CaptureQueriesContext(connection) as queries:
+            call_command('reconcile_availability', '--batch-size', '2', stdout=StringIO())
+        item_updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "core_item"')]
+        self.assertEqual(len(item_updates), 3)  # one per batch: 2 + 3 drifted rows, 2 per batch
+        self.assertEqual([self.available(i) for i in self.items], [False, False, True, True, True, True])
+        self.assertEqual(Category.objects.get(pk=self.category.pk).available_item_count, 4)
+        self.assertEqual(sync_availability(), {'made_unavailable': 0, 'made_available': 0})
+
+
+@override_settings(THROTTLING={'RATES': {'user': '3/min', 'anon': '2/min'}})
+class ThrottlingTest(TestCase):
+    def setUp(self):
+        bucket_store.clear()
+        bucket_store.reset_metrics()
+        self.client = APIClient()
+
+    def tearDown(self):
+        bucket_store.clear()
+
+    def test_anonymous_clients_share_ip_bucket(self):
+        statuses = [self.client.get('/api/items/').status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        response = self.client.get('/api/items/')
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_users_have_own_buckets_and_writes_are_free(self):
+        alice = User.objects.create_user(username='alice', password='password')
+        bob = User.objects.create_user(username='bob', password='password')
+        self.client.force_authenticate(user=alice)
+        self.assertEqual([self.client.get('/api/notifications/').status_code for _ in range(4)], [200, 200, 200, 429])
+        self.assertEqual(self.client.post('/api/notifications/', {}).status_code, 400)
+        self.client.force_authenticate(user=bob)
+        self.assertEqual(self.client.get('/api/notifications/').status_code, 200)
+
+        registry_text = registry.render()
+        self.assertIn('api_throttle_decisions_total{scope="user",result="throttled"} 1', registry_text)
+
+    def test_buckets_refill(self):
+        allowed = [bucket_store.consume('k', 2, 1.0, now=100.0)[0] for _ in range(3)]
+        self.assertEqual(allowed, [True, True, False])
+        self.assertTrue(bucket_store.consume('k', 2, 1.0, now=101.5)[0])
+
+
+class SingleFlightTest(TestCase):
+    def test_concurrent_calls_share_one_computation(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'result'
+
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', compute, 5)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do('key', compute, 5))) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        time.sleep(0.2)  # let the followers reach the wait
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        self.assertEqual(results, ['result'] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats, {'leaders': 1, 'coalesced': 3})
+        # Nothing is cached once the call finishes
+        flight.do('key', compute, 5)
+        self.assertEqual(len(calls), 2)
+
+    def test_list_view_goes_through_single_flight(self):
+        single_flight.reset_metrics()
+        bucket_store.clear()
+        APIClient().get('/api/items/?fields=id')
+        self.assertEqual(single_flight.stats['leaders'], 1)
+
+
+class AdminTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='password', email='a@example.com')
+        self.client.force_login(self.admin)
+        self.category = Category.objects.create(name='Tools')
+        self.items = [
+            Item.objects.create(name=f'Item {n}', description='Test', price_per_day=10, category=self.category, owner_id='1')
+            for n in range(3)
+        ]
+        self.requests = [
+            RentalRequest.objects.create(
+                item=item, requester_name='r', owner_name='o', requester_id='2', owner_id='1',
+                start_date='2026-03-01', end_date='2026-03-02', status=status, total_price=20,
+            )
+            for item, status in zip(self.items, ['Pending', 'Approved', 'InHand'])
+        ]
+
+    def test_changelists_do_not_query_per_row(self):
+        for request in self.requests:
+            Transaction.objects.create(rental_request=request, amount=20, transaction_type='Payment')
+        for n in range(5):
+            Notification.objects.create(target_user_id='2', event_type='info', title=f'N{n}', message='m')
+        pages = ['rentalrequest', 'transaction', 'dispute', 'notification', 'message', 'item', 'conversation', 'category']
+        for page in pages:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f'/admin/core/{page}/')
+            self.assertEqual(response.status_code, 200, page)
+            self.assertLess(len(queries), 12, page)
+
+    def test_cancel_action_skips_requests_already_in_hand(self):
+        self.assertFalse(Item.objects.get(pk=self.items[2].pk).is_available)
+        response = self.client.post('/admin/core/rentalrequest/', {
+            'action': 'cancel_requests', '_selected_action': [r.pk for r in self.requests],
+        })
+        self.assertEqual(response.status_code, 302)
+        statuses = list(RentalRequest.objects.order_by('pk').values_list('status', flat=True))
+        self.assertEqual(statuses, ['Cancelled', 'Cancelled', 'InHand'])
+
+    def test_resolve_action_frees_disputed_items(self):
+        request = self.requests[2]
+        request.status = 'Disputed'
+        request.save()
+        dispute = Dispute.objects.create(rental_request=request, reporter_id='2', reason='Damaged')
+        self.assertFalse(Item.objects.get(pk=request.item_id).is_available)
+        self.client.post('/admin/core/dispute/', {'action': 'resolve_disputes', '_selected_action': [dispute.pk]})
+        self.assertEqual(Dispute.objects.get(pk=dispute.pk).status, 'Resolved')
+        self.assertTrue(Item.objects.get(pk=request.item_id).is_available)
+
+    def test_estimated_count_is_capped(self):
+        for n in range(5):
+            Notification.objects.create(target_user_id='2', event_type='info', title=f'N{n}', message='m')
+        paginator = EstimatedCountPaginator(Notification.objects.order_by('-pk'), 2)
+        paginator.MAX_COUNT = 3
+        self.assertEqual(paginator.count, 4)
+        self.assertTrue(paginator.capped)
+        self.assertEqual(paginator.num_pages, 2)
+        self.assertEqual(len(paginator.page(2)), 2)
+
+        with mock.patch.object(EstimatedCountPaginator, 'MAX_COUNT', 3):
+            response = self.client.get('/admin/core/notification/')
+        self.assertIn('Only the first 3 matches are counted', response.content.decode())
+        self.assertNotIn('Only the first', self.client.get('/admin/core/notification/').content.decode())
+
+
+class StartupProfileTest(TestCase):
+    def test_cold_start_stays_within_budget(self):
+        out = StringIO()
+        call_command('startup_profile', '--runs', '1', '--json', '--check', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['eager_imports'], [])
+        self.assertEqual(report['status'], '200 OK')
+        self.assertEqual(list(report['stages']), ['setup', 'first_request', 'first_api_request'])
+        self.assertIn('rest_framework', dict(report['imports']['first_api_request']))
+
+    def test_lazy_routes_build_once(self):
+        calls = []
+        routes = LazyRoutes(lambda: calls.append(1) or ['pattern'])
+        self.assertFalse(routes.loaded)
+        self.assertEqual(routes.urlpatterns, ['pattern'])
+        self.assertEqual(routes.urlpatterns, ['pattern'])
+        self.assertEqual(len(calls), 1)
+
+    def test_health_check_and_lazy_api_routes_resolve(self):
+        self.assertEqual(self.client.get('/api/health/').json()['status'], 'ok')
+        self.assertEqual(self.client.get('/api/categories/').status_code, 200)
+        self.assertTrue(api_routes.loaded)
+
+
+class BlobStorageTest(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media.name)
+        self.settings_override.enable()
+        self.category = Category.objects.create(name='Tools')
+        self.items = [
+            Item.objects.create(name=f'Item {n}', description='Test', price_per_day=10, category=self.category, owner_id='1')
+            for n in range(2)
+        ]
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media.cleanup()
+
+    def upload(self, item, content=b'same photo', name='photo.JPG'):
+        return ItemImage.objects.create(item=item, image=SimpleUploadedFile(name, content))
+
+    def stored_files(self):
+        return [os.path.join(root, f) for root, _, files in os.walk(self.media.name) for f in files]
+
+    def test_same_content_is_stored_once_and_collected_when_released(self):
+        first, second = self.upload(self.items[0]), self.upload(self.items[1], name='copy.jpg')
+        self.upload(self.items[1], content=b'other photo')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^cas/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(len(self.stored_files()), 2)
+        self.assertEqual(Blob.objects.get(name=first.image.name).ref_count, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.get(name=second.image.name).ref_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        blob = Blob.objects.get(name=second.image.name)
+        self.assertEqual(blob.ref_count, 0)
+        self.assertIsNotNone(blob.released_at)
+        self.assertEqual(collect_blobs(), {'deleted': 0, 'bytes': 0, 'repaired': 0})  # still in its grace period
+
+        out = StringIO()
+        call_command('collect_blobs', '--grace-hours', '0', stdout=out)
+        self.assertIn('1 blobs (10 bytes) were deleted', out.getvalue())
+        self.assertEqual(len(self.stored_files()), 1)
+        self.assertFalse(Blob.objects.filter(name=second.image.name).exists())
+
+    def test_collection_repairs_blobs_still_referenced(self):
+        image = self.upload(self.items[0])
+        Blob.objects.update(ref_count=0, released_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(collect_blobs(), {'deleted': 0, 'bytes': 0, 'repaired': 1})
+        self.assertEqual(Blob.objects.get(name=image.image.name).ref_count, 1)
+        self.assertTrue(image.image.storage.exists(image.image.name))
+
+        Blob.objects.update(ref_count=5)
+        call_command('collect_blobs', '--recount', stdout=StringIO())
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+    def test_blob_urls_are_cacheable_forever(self):
+        image = self.upload(self.items[0])
+        self.assertEqual(image.image.url, f'/media/{image.image.name}')
+        response = self.client.get(image.image.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'same photo')
+        self.assertIn('immutable', response['Cache-Control'])
+        cached = self.client.get(image.image.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(self.client.get('/media/cas/../../settings.py').status_code, 404)
+
+
+class SimilarItemsTest(TestCase):
+    def setUp(self):
+        tools = Category.objects.create(name='Tools')
+        camping = Category.objects.create(name='Camping')
+        specs = [
+            ('Cordless drill', 'Power drill with two batteries', tools, 25),
+            ('Hammer drill', 'Heavy power drill for concrete', tools, 30),
+            ('Drill press', 'Bench drill for precise holes', tools, 40),
+            ('Family tent', 'Six person camping tent', camping, 35),
+            ('Hiking tent', 'Light two person tent for camping trips', camping, 20),
+        ]
+        self.items = [
+            Item.objects.create(name=name, description=description, category=category, price_per_day=price, owner_id='1')
+            for name, description, category, price in specs
+        ]
+        self.client = APIClient()
+
+    def similar_ids(self, item):
+        return list(SimilarItem.objects.filter(item=item).order_by('rank').values_list('similar_id', flat=True))
+
+    def test_neighbours_are_ranked_and_served_in_one_query(self):
+        self.assertEqual(build_similar_items(), {'items': 5, 'neighbours': 20})
+        drill, tent = self.items[0], self.items[3]
+        self.assertEqual(set(self.similar_ids(drill)[:2]), {self.items[1].pk, self.items[2].pk})
+        self.assertEqual(self.similar_ids(tent)[0], self.items[4].pk)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/items/{drill.id}/similar/?limit=2')
+        results = response.data['results']
+        self.assertEqual(len(results), 2)
+        self.assertGreaterEqual(results[0]['score'], results[1]['score'])
+        self.assertEqual(set(results[0]), {'id', 'name', 'image_url', 'price_per_day', 'score'})
+        self.assertEqual(self.client.get('/api/items/999/similar/').status_code, 404)
+
+    @override_settings(SIMILAR_ITEMS={'NEIGHBOURS': 2})
+    def test_rebuild_only_touches_affected_items(self):
+        kitchen = Category.objects.create(name='Kitchen')
+        mixers = [
+            Item.objects.create(name=name, description='Kitchen appliance', category=kitchen, price_per_day=200, owner_id='1')
+            for name in ('Stand mixer', 'Espresso machine', 'Food processor')
+        ]
+        build_similar_items()
+        self.assertEqual(build_similar_items(), {'items': 0, 'neighbours': 0})
+        built_at = Item.objects.get(pk=mixers[0].pk).similar_built_at
+
+        tent = self.items[4]
+        tent.name, tent.description, tent.category = 'Impact drill', 'Power drill for screws', self.items[0].category
+        tent.save()
+        build_similar_items()
+        self.assertIn(tent.pk, self.similar_ids(self.items[0]))
+        self.assertEqual(Item.objects.get(pk=mixers[0].pk).similar_built_at, built_at)  # nothing in common: untouched
+
+        listers = set(SimilarItem.objects.filter(similar=self.items[1]).values_list('item_id', flat=True))
+        self.items[1].delete()
+        build_similar_items()
+        self.assertTrue(all(len(self.similar_ids(pk)) == 2 for pk in listers))
+        self.assertNotIn(self.items[1].pk, SimilarItem.objects.values_list('similar_id', flat=True))
+
+    def test_unindexed_item_falls_back_to_its_category(self):
+        response = self.client.get(f'/api/items/{self.items[3].id}/similar/')
+        self.assertEqual([row['id'] for row in response.data['results']], [self.items[4].id])
+        self.assertIsNone(response.data['results'][0]['score'])
+
+
+@override_settings(SUGGEST={'SNAPSHOT_PATH': None, 'RELOAD_SECONDS': 900})
+class SuggestTest(TestCase):
+    def setUp(self):
+        suggest.reset_index()
+        self.tools = Category.objects.create(name='Power Tools')
+        self.items = [
+            Item.objects.create(name=name, description='Test', category=self.tools, price_per_day=10, owner_id='1',
+                                location=location, rating=rating, reviews_count=reviews)
+            for name, location, rating, reviews in [
+                ('Cordless power drill', 'Portland', 4.0, 10),
+                ('Hammer drill', 'Portland', 4.8, 50),
+                ('Drain snake', 'Denver', 3.0, 0),
+                ('Power washer', 'Porto', 5.0, 2),
+            ]
+        ]
+        self.client = APIClient()
+
+    def tearDown(self):
+        suggest.reset_index()
+
+    def names(self, query, kind='items'):
+        return [row['name'] for row in suggest.suggest(query)[kind]]
+
+    def test_matches_word_prefixes_ranked_by_popularity(self):
+        self.assertEqual(self.names('dr'), ['Hammer drill', 'Cordless power drill', 'Drain snake'])
+        self.assertEqual(self.names('power d'), ['Cordless power drill'])
+        self.assertEqual(self.names('POW'), ['Cordless power drill', 'Power washer'])  # 4.0 with 10 reviews beats 5.0 with 2
+        self.assertEqual(self.names('tools', 'categories'), ['Power Tools'])
+        self.assertEqual(suggest.suggest('por')['locations'], [{'name': 'Portland', 'count': 2}, {'name': 'Porto', 'count': 1}])
+        self.assertEqual(suggest.suggest('  ')['items'], [])
+
+    def test_endpoint_does_not_query_once_loaded(self):
+        self.client.get('/api/search/suggest/', {'q': 'x'})
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/search/suggest/', {'q': 'hammer', 'limit': 3})
+        self.assertEqual(response.data['items'], [{'id': self.items[1].id, 'name': 'Hammer drill'}])
+
+    def test_signals_keep_index_in_sync(self):
+        suggest.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.objects.create(name='Drill press', description='Test', category=self.tools, price_per_day=10,
+                                owner_id='1', location='Denver', rating=5, reviews_count=100)
+        self.assertEqual(self.names('dr')[0], 'Drill press')
+        self.assertEqual(suggest.suggest('den')['locations'], [{'name': 'Denver', 'count': 2}])
+
+        drill = self.items[1]
+        drill.is_listed = False
+        with self.captureOnCommitCallbacks(execute=True):
+            drill.save()
+            self.items[2].delete()
+        self.assertNotIn('Hammer drill', self.names('dr'))
+        self.assertNotIn('Drain snake', self.names('dr'))
+        self.assertEqual(suggest.suggest('por')['locations'][0], {'name': 'Portland', 'count': 1})
+
+    def test_bulk_import_updates_index(self):
+        suggest.get_index()
+        owner = User.objects.create_user(username='seller', password='password')
+        rows = [(1, {'name': 'Drill press', 'description': 'Bench drill', 'price_per_day': '30',
+                     'category': str(self.tools.id), 'location': 'Denver'})]
+        with self.captureOnCommitCallbacks(execute=True):
+            ItemImporter(owner.id).run(rows)
+        self.assertIn('Drill press', self.names('dr'))
+        self.assertEqual(suggest.suggest('den')['locations'], [{'name': 'Denver', 'count': 2}])
+
+    def test_limit_is_bounded(self):
+        self.assertEqual(len(self.names('dr')), 3)
+        self.assertEqual(len(suggest.suggest('dr', limit=-3)['items']), 1)
+        response = self.client.get('/api/search/suggest/', {'q': 'dr', 'limit': -3})
+        self.assertEqual(response.status_code, 400)
+
+    def test_snapshot_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'suggest.json.gz')
+            out = StringIO()
+            call_command('build_suggest_index', '--path', path, stdout=out)
+            self.assertIn('4 items, 1 categories and 3 locations', out.getvalue())
+            with override_settings(SUGGEST={'SNAPSHOT_PATH': path}), self.assertNumQueries(0):
+                suggest.reset_index()
+                self.assertEqual(self.names('dr'), ['Hammer drill', 'Cordless power drill', 'Drain snake'])
+                self.assertEqual(suggest.suggest('port')['locations'][0]['count'], 2)
+
+
+@override_settings(READ_REPLICAS={'ALIASES': ['replica'], 'PIN_SECONDS': 5, 'RETRY_SECONDS': 30})
+class ReplicaRoutingTest(TestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        routers.reset()
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.category = Category.objects.create(name='Tools')
+        self.item = Item.objects.create(name='Drill', description='Test', category=self.category,
+                                        price_per_day=10, owner_id=str(self.owner.id))
+        # The stand-in replica lags behind: same rows, older name; bulk_create fires no signals
+        Category.objects.using('replica').bulk_create([Category(pk=self.category.pk, name='Tools')])
+        Item.objects.using('replica').bulk_create([
+            Item(pk=self.item.pk, name='Drill (stale)', description='Test', category_id=self.category.pk,
+                 price_per_day=10, owner_id=str(self.owner.id)),
+        ])
+        self.client = APIClient(raise_request_exception=False)
+        self.url = f'/api/items/{self.item.pk}/'
+
+    def tearDown(self):
+        routers.reset()
+        cache.clear()
+
+    def test_safe_requests_read_from_replica(self):
+        self.assertEqual(self.client.get(self.url).data['name'], 'Drill (stale)')
+        self.assertEqual(routers.stats['replica'], 1)
+        # Outside a request everything uses the primary
+        self.assertEqual(Item.objects.get(pk=self.item.pk).name, 'Drill')
+
+    def test_write_pins_client_to_primary(self):
+        token = Token.objects.create(user=self.owner)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = self.client.patch(self.url, {'name': 'Hammer drill'}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(self.url).data['name'], 'Hammer drill')
+        self.assertEqual(routers.stats['pinned'], 1)
+
+        other = APIClient(REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(other.get(self.url).data['name'], 'Drill (stale)')
+        cache.clear()  # the pin expired
+        self.assertEqual(self.client.get(self.url).data['name'], 'Drill (stale)')
+
+    def test_failed_replica_falls_back_to_primary(self):
+        with connections['replica'].cursor() as cursor:
+            cursor.execute('DROP TABLE core_item')
+        with self.assertLogs('django.request', 'ERROR'), self.assertLogs('core.performance', 'WARNING') as logs:
+            response = self.client.get(self.url)
+        self.assertIn('retrying on the primary', logs.output[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Drill')
+        self.assertEqual(routers.healthy_replicas(), [])
+
+        # Skipped until RETRY_SECONDS pass, without another failed attempt
+        with self.assertNoLogs('django.request', 'ERROR'):
+            self.assertEqual(self.client.get(self.url).data['name'], 'Drill')
+        self.assertIn('db_replica_fallbacks_total 1', registry.render())
+
+
+    def test_failed_replica_does_not_rerun_a_batch(self):
+        with connections['replica'].cursor() as cursor:
+            cursor.execute('DROP TABLE core_item')
+        self.client.force_authenticate(user=self.owner)
+        with mock.patch('core.views.run_batch', side_effect=batch.run_batch) as run, \
+                self.assertLogs('django.request', 'ERROR'), self.assertLogs('core.performance', 'WARNING') as logs:
+            response = self.client.post('/api/batch/', {'requests': [{'path': f'/items/{self.item.pk}/'}]}, format='json')
+        self.assertEqual(run.call_count, 1)  # its body was already read
+        self.assertNotIn('retrying', logs.output[0])
+        self.assertEqual(response.data['responses'][0]['status'], 500)
+        self.assertEqual(routers.healthy_replicas(), [])
+
+@override_settings(PAYMENTS={'WEBHOOK_SECRET': 'whsec_test', 'FLUSH_WINDOW_MS': 0, 'BATCH_SIZE': 50})
+class PaymentEventsTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Tools')
+        self.item = Item.objects.create(name='Drill', description='Test', category=self.category,
+                                        price_per_day=10, owner_id='1')
+        self.requests = [
+            RentalRequest.objects.create(
+                item=self.item, requester_name='Renter', owner_name='Owner', requester_id='2', owner_id='1',
+                start_date=timezone.now().date() + timedelta(days=i * 3), end_date=timezone.now().date() + timedelta(days=i * 3 + 1),
+                total_price=20, deposit_amount=5, status='Approved',
+            )
+            for i in range(10)
+        ]
+
+    def event(self, event_id, event_type, object_id, request, amount=2500):
+        return {'id': event_id, 'type': event_type, 'data': {'object': {
+            'id': object_id, 'amount': amount, 'metadata': {'rental_request_id': str(request.pk)},
+        }}}
+
+    def post(self, payload, secret='whsec_test'):
+        body = json.dumps(payload).encode()
+        return self.client.post('/api/payments/webhook/', body, content_type='application/json',
+                                HTTP_PAYMENT_SIGNATURE=sign(body, secret))
+
+    def test_webhook_verifies_dedupes_and_queues(self):
+        event = self.event('evt_1', 'payment_intent.succeeded', 'pi_1', self.requests[0])
+        self.assertEqual(self.post(event).data, {'received': 1})
+        self.assertEqual(self.post([event, self.event('evt_2', 'customer.created', 'cus_1', self.requests[0])]).data,
+                         {'received': 1})
+        self.assertEqual(self.post(event, secret='wrong').status_code, 400)
+        self.assertEqual(self.post({'type': 'payment_intent.succeeded'}).status_code, 400)
+
+        queued = PaymentEvent.objects.get()
+        self.assertEqual((queued.event_id, queued.stripe_id, queued.status), ('evt_1', 'pi_1', 'Pending'))
+        self.assertEqual(queued.amount, Decimal('25.00'))
+        self.assertEqual(self.requests[0].transactions.count(), 0)  # nothing applied in the request
+
+    def test_webhook_refuses_unsigned_events_without_opt_in(self):
+        event = self.event('evt_1', 'payment_intent.succeeded', 'pi_1', self.requests[0])
+        with override_settings(PAYMENTS={'FLUSH_WINDOW_MS': 0}):
+            self.assertEqual(self.post(event).status_code, 403)
+        with override_settings(PAYMENTS={'FLUSH_WINDOW_MS': 0, 'ALLOW_UNSIGNED': True}):
+            self.assertEqual(self.post(event).data, {'received': 1})
+
+    def test_malformed_event_is_a_bad_request(self):
+        for data in ('x', {'object': 'x'}, {'object': {'id': 'pi_1', 'metadata': 'x'}}):
+            event = {'id': 'evt_1', 'type': 'payment_intent.succeeded', 'data': data}
+            self.assertEqual(self.post(event).status_code, 400, data)
+
+    def test_concurrent_worker_inserting_same_transaction(self):
+        rental_request = self.requests[0]
+        ingest_buffer.submit([parse_event(self.event('evt_1', 'payment_intent.succeeded', 'pi_1', rental_request))])
+        bulk_create = Transaction.objects.bulk_create
+
+        def racing(rows, **kwargs):
+            # Another worker's batch failed the same payment intent in the meantime
+            Transaction.objects.create(rental_request=rental_request, amount=25, transaction_type='Payment',
+                                       stripe_id='pi_1', status='Failed')
+            return bulk_create(rows, **kwargs)
+
+        with mock.patch.object(Transaction.objects, 'bulk_create', side_effect=racing):
+            self.assertEqual(apply_events(), {'Applied': 1})
+        self.assertEqual(Transaction.objects.get(stripe_id='pi_1').status, 'Success')
+        rental_request.refresh_from_db()
+        self.assertEqual(rental_request.status, 'Paid')
+
+    def test_underpayment_fails(self):
+        rental_request = self.requests[0]
+        ingest_buffer.submit([parse_event(self.event('evt_1', 'payment_intent.succeeded', 'pi_1', rental_request, amount=100))])
+        self.assertEqual(apply_events(), {'Failed': 1})
+        self.assertEqual(PaymentEvent.objects.get().error, 'Underpayment: received 1.00, due 25.00.')
+        self.assertFalse(Transaction.objects.exists())
+        rental_request.refresh_from_db()
+        self.assertEqual(rental_request.status, 'Approved')
+
+    def test_worker_applies_events_in_order(self):
+        first, second = self.requests[:2]
+        ingest_buffer.submit([parse_event(e) for e in [
+            self.event('evt_1', 'payment_intent.payment_failed', 'pi_1', first),
+            self.event('evt_2', 'payment_intent.succeeded', 'pi_1', first),
+            self.event('evt_3', 'payment_intent.payment_failed', 'pi_1', first),  # late, after success
+            self.event('evt_4', 'payment_intent.succeeded', 'pi_2', second),
+            self.event('evt_5', 'charge.refunded', 're_2', second, amount=500),
+            {**self.event('evt_6', 'payment_intent.succeeded', 'pi_3', first), 'data': {'object': {
+                'id': 'pi_3', 'amount': 100, 'metadata': {'rental_request_id': '999999'}}}},
+        ]])
+        with self.captureOnCommitCallbacks(execute=True):
+            report = apply_events()
+        self.assertEqual(report, {'Applied': 4, 'Ignored': 1, 'Failed': 1})
+
+        self.assertEqual(Transaction.objects.get(stripe_id='pi_1').status, 'Success')
+        self.assertEqual(Transaction.objects.get(stripe_id='re_2').transaction_type, 'Refund')
+        self.assertEqual(Transaction.objects.get(stripe_id='re_2').amount, Decimal('5.00'))
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'Paid')
+        self.assertTrue(Notification.objects.filter(target_user_id='2', title='Payment Confirmed').exists())
+        self.assertEqual(PaymentEvent.objects.get(event_id='evt_6').error, 'Unknown rental request.')
+        self.assertEqual(apply_events(), {})
+
+    def test_replayed_burst_applies_with_constant_queries(self):
+        deliveries = fake_events([(r.pk, r.total_price + r.deposit_amount) for r in self.requests],
+                                 duplicate_ratio=0.5, failure_ratio=0.5, refund_ratio=0.2, seed=7)
+        for delivery in deliveries:
+            self.post(delivery)
+        self.assertEqual(PaymentEvent.objects.count(), len({d['id'] for d in deliveries}))
+
+        with CaptureQueriesContext(connection) as queries:
+            apply_events()
+        self.assertLess(len(queries), 30)  # one batch: not a query per event
+        self.assertEqual(RentalRequest.objects.filter(status='Paid').count(), 10)
+        self.assertEqual(Transaction.objects.filter(transaction_type='Payment', status='Success').count(), 10)
+        self.assertFalse(PaymentEvent.objects.exclude(status__in=['Applied', 'Ignored']).exists())
+
+
+class RequestStatusHistoryTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.renter = User.objects.create_user(username='renter', password='password')
+        self.admin = User.objects.create_superuser(username='admin', password='password')
+        self.category = Category.objects.create(name='Tools')
+        self.item = Item.objects.create(name='Drill', description='Test', category=self.category,
+                                        price_per_day=10, owner_id='1')
+
+    def create_request(self, status='Pending', day=0):
+        start = timezone.now().date() + timedelta(days=day)
+        return RentalRequest.objects.create(
+            item=self.item, requester_name='Renter', owner_name='Owner', requester_id=str(self.renter.id),
+            owner_id='1', start_date=start, end_date=start, total_price=10, status=status,
+        )
+
+    def transitions(self, rental_request):
+        return list(rental_request.status_changes.order_by('pk').values_list('from_status', 'to_status', 'source'))
+
+    def test_saves_log_each_transition(self):
+        rental_request = self.create_request()
+        rental_request.status = 'Approved'
+        rental_request.save()
+        rental_request.save()  # unchanged
+        rental_request.rating_given = 5
+        rental_request.save(update_fields=['rating_given'])
+        deferred = RentalRequest.objects.only('id').get(pk=rental_request.pk)
+        deferred.status = 'AwaitingPayment'
+        deferred.save()
+        self.assertEqual(self.transitions(rental_request), [
+            ('', 'Pending', 'api'), ('Pending', 'Approved', 'api'), ('Approved', 'AwaitingPayment', 'api'),
+        ])
+
+    def test_bulk_changes_are_logged(self):
+        stale, fresh = self.create_request(), self.create_request(day=3)
+        RentalRequest.objects.filter(pk=stale.pk).update(requested_at=timezone.now() - timedelta(days=2))
+        call_command('expire_requests', stdout=StringIO())
+        self.assertEqual(self.transitions(stale)[-1], ('Pending', 'Cancelled', 'expire'))
+        self.assertEqual(self.transitions(fresh), [('', 'Pending', 'api')])
+
+    def test_timeline_endpoint(self):
+        rental_request = self.create_request()
+        rental_request.status = 'Approved'
+        rental_request.save()
+        self.client.force_authenticate(user=self.renter)
+        response = self.client.get(f'/api/requests/{rental_request.pk}/timeline/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(t['from'], t['to']) for t in response.data['transitions']],
+                         [(None, 'Pending'), ('Pending', 'Approved')])
+        self.assertGreaterEqual(response.data['transitions'][0]['seconds'], 0)
+        self.assertIsNone(response.data['transitions'][1]['seconds'])
+
+    def test_status_stats_use_windowed_sql(self):
+        first, second = self.create_request(), self.create_request(day=3)
+        RequestStatusChange.objects.all().delete()
+        t0 = timezone.now().replace(microsecond=0) - timedelta(days=10)
+        RequestStatusChange.objects.bulk_create([
+            RequestStatusChange(rental_request=request, from_status=old, to_status=new, changed_at=t0 + timedelta(hours=h))
+            for request, old, new, h in [
+                (first, '', 'Pending', 0), (first, 'Pending', 'Approved', 1), (first, 'Approved', 'Paid', 3),
+                (second, '', 'Approved', 0), (second, 'Approved', 'AwaitingPayment', 1),
+                (second, 'AwaitingPayment', 'Paid', 5),
+            ]
+        ])
+        self.client.force_authenticate(user=self.admin)
+        day = t0.date()
+        params = {'since': str(day - timedelta(days=1)), 'until': str(day + timedelta(days=1)), 'from': 'Approved', 'to': 'Paid'}
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/requests/status-stats/', params)
+        self.assertEqual(response.status_code, 200)
+        transition = response.data['transition']
+        self.assertEqual((transition['count'], transition['min_seconds'], transition['max_seconds']), (2, 7200, 18000))
+        self.assertAlmostEqual(transition['avg_seconds'], 12600, places=0)
+        statuses = {row['status']: row for row in response.data['statuses']}
+        self.assertEqual((statuses['Approved']['entered'], statuses['Approved']['left']), (2, 2))
+        self.assertAlmostEqual(statuses['Approved']['avg_seconds'], 5400, places=0)
+        self.assertAlmostEqual(statuses['AwaitingPayment']['max_seconds'], 14400, places=0)
+        self.assertEqual((statuses['Paid']['left'], statuses['Paid']['avg_seconds']), (0, None))
+
+        self.assertEqual(self.client.get('/api/requests/status-stats/', {'from': 'Paid'}).status_code, 400)
+        self.client.force_authenticate(user=self.renter)
+        self.assertEqual(self.client.get('/api/requests/status-stats/').status_code, 403)
+
+
+class HandoverScanTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.renter = User.objects.create_user(username='renter', password='password')
+        self.category = Category.objects.create(name='Tools')
+        self.item = Item.objects.create(name='Drill', description='Test', category=self.category,
+                                        price_per_day=10, owner_id=str(self.owner.id))
+        self.request = self.create_request('Paid')
+
+    def create_request(self, status, **kwargs):
+        start = timezone.now().date()
+        return RentalRequest.objects.create(
+            item=self.item, requester_name='renter', owner_name='owner', requester_id=str(self.renter.id),
+            owner_id=str(self.owner.id), start_date=start, end_date=start + timedelta(days=1), total_price=20,
+            status=status, **kwargs,
+        )
+
+    def scan(self, code, user=None):
+        self.client.force_authenticate(user=user or self.owner)
+        return self.client.post('/api/requests/scan/', {'code': code}, format='json')
+
+    def test_codes_are_unique_per_row(self):
+        other = self.create_request('Pending', handover_code=self.request.handover_code)  # collides, redrawn
+        codes = {self.request.handover_code, self.request.return_code, other.handover_code, other.return_code}
+        self.assertEqual(len(codes), 4)
+        self.assertTrue(all(len(code) == 8 and set(code) <= set('23456789ABCDEFGHJKLMNPQRSTUVWXYZ') for code in codes))
+
+    def test_scan_confirms_handover_then_return(self):
+        code = self.request.handover_code
+        with CaptureQueriesContext(connection) as queries:
+            response = self.scan(f'{code[:4].lower()}-{code[4:]}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['request'], response.data['request_status']), (self.request.pk, 'InHand'))
+        touching = [q['sql'] for q in queries if 'core_rentalrequest' in q['sql']]
+        self.assertTrue(touching[0].startswith('UPDATE'))  # resolved and moved by the UPDATE itself
+        self.item.refresh_from_db()
+        self.assertFalse(self.item.is_available)
+
+        self.assertEqual(self.scan(code).status_code, 400)  # already used
+        self.assertEqual(self.scan(self.request.return_code, user=self.renter).data['request_status'], 'Returned')
+        self.assertEqual(
+            list(self.request.status_changes.order_by('pk').values_list('to_status', 'source'))[-2:],
+            [('InHand', 'scan'), ('Returned', 'scan')],
+        )
+        self.assertTrue(Notification.objects.filter(target_user_id=str(self.owner.id), title='Item Returned').exists())
+
+    def test_scan_without_update_returning(self):
+        with mock.patch('core.handover.update_returning', return_value=False):
+            response = self.scan(self.request.handover_code)
+        self.assertEqual(response.data['request_status'], 'InHand')
+        self.assertEqual(self.scan(self.request.handover_code).status_code, 400)
+
+    def test_scan_needs_a_participant_and_the_right_status(self):
+        stranger = User.objects.create_user(username='stranger', password='password')
+        self.assertEqual(self.scan(self.request.handover_code, user=stranger).status_code, 400)
+        self.assertEqual(self.scan(self.request.return_code).status_code, 400)  # not handed over yet
+        self.assertEqual(self.scan('nope').status_code, 400)
+        self.request.refresh_from_db()
+        self.assertEqual(self.request.status, 'Paid')
+
+
+class BatchApiTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='renter', password='password')
+        self.category = Category.objects.create(name='Tools')
+        self.item = Item.objects.create(name='Drill', description='Test', category=self.category,
+                                        price_per_day=10, owner_id=str(self.user.id))
+        Notification.objects.create(target_user_id=str(self.user.id), title='Hello', message='Hi')
+        token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def batch(self, *paths, **extra):
+        return self.client.post('/api/batch/', {'requests': [{'path': path} for path in paths], **extra}, format='json')
+
+    def test_runs_reads_in_order_with_one_authentication(self):
+        token_cache.clear()
+        with mock.patch.object(CachedTokenAuthentication, 'authenticate',
+                               autospec=True, side_effect=CachedTokenAuthentication.authenticate) as authenticate:
+            response = self.batch('/users/me/', f'/items/{self.item.pk}/?fields=id,name',
+                                  f'/notifications/?user_id={self.user.id}', '/categories/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(authenticate.call_count, 1)
+        me, item, notifications, categories = response.data['responses']
+        self.assertEqual((me['status'], me['body']['username']), (200, 'renter'))
+        self.assertEqual(item['body'], {'id': self.item.pk, 'name': 'Drill'})
+        self.assertEqual([n['title'] for n in notifications['body']], ['Hello'])
+        self.assertEqual(categories['path'], '/categories/')
+
+    def test_sub_requests_keep_their_own_status(self):
+        self.client.credentials()
+        response = self.batch('/users/me/', '/nope/', '/batch/', f'/items/{self.item.pk}/')
+        self.assertEqual([r['status'] for r in response.data['responses']], [403, 404, 400, 200])
+
+    def test_rejects_malformed_batches(self):
+        self.assertEqual(self.batch().status_code, 400)
+        self.assertEqual(self.batch('items/').status_code, 400)
+        response = self.client.post('/api/batch/', {'requests': [{'path': '/items/', 'method': 'DELETE'}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        with override_settings(BATCH_API={'MAX_REQUESTS': 2}):
+            self.assertEqual(self.batch('/items/', '/items/', '/items/').status_code, 400)
+
+    @override_settings(READ_REPLICAS={'ALIASES': ['replica'], 'PIN_SECONDS': 5, 'RETRY_SECONDS': 30})
+    def test_batch_reads_from_replica_without_pinning(self):
+        routers.reset()
+        self.addCleanup(routers.reset)
+        with mock.patch.object(routers, 'choose_replica', return_value=None) as choose:
+            self.batch('/items/')
+            self.batch('/items/')
+        # Both batches were offered a replica: neither pinned the client to the primary
+        self.assertEqual((choose.call_count, routers.stats['pinned']), (2, 0))
+
+
+class ParallelBatchTest(TransactionTestCase):
+    def test_parallel_sub_requests_match_sequential_ones(self):
+        user = User.objects.create_user(username='renter', password='password')
+        category = Category.objects.create(name='Tools')
+        for name in ('Drill', 'Saw', 'Ladder'):
+            Item.objects.create(name=name, description='Test', category=category,
+                                price_per_day=10, owner_id=str(user.id))
+        client = APIClient()
+        client.force_authenticate(user=user)
+        paths = [{'path': '/users/me/'}, {'path': '/items/?fields=name'}, {'path': '/categories/'}]
+        sequential = client.post('/api/batch/', {'requests': paths}, format='json').data
+        before = batch.stats['parallel']
+        parallel = client.post('/api/batch/', {'requests': paths, 'parallel': True}, format='json').data
+        self.assertEqual(batch.stats['parallel'] - before, 3)
+        self.assertEqual(parallel, sequential)
+        self.assertEqual(sorted(i['name'] for i in parallel['responses'][1]['body']), ['Drill', 'Ladder', 'Saw'])
+
+
+class ResponseFormatTest(TestCase):
+    def setUp(self):
+        compression.body_cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.category = Category.objects.create(name='Tools')
+        for n in range(20):
+            Item.objects.create(name=f'Drill {n}', description='Cordless drill with two batteries', category=self.category,
+                                price_per_day=10, owner_id=str(self.owner.id))
+        self.client = APIClient()
+
+    def test_negotiates_encoding_by_quality_then_preference(self):
+        encodings = ['zstd', 'br', 'gzip']
+        self.assertEqual(compression.negotiate('gzip, deflate, br, zstd', encodings), 'zstd')
+        self.assertEqual(compression.negotiate('br;q=0.8, zstd;q=0.5, gzip;q=0.9', encodings), 'gzip')
+        self.assertEqual(compression.negotiate('zstd;q=0, *;q=0.3', encodings), 'br')
+        self.assertEqual(compression.negotiate('deflate, identity', encodings), None)
+        self.assertEqual(compression.negotiate('', encodings), None)
+
+    def test_compresses_and_caches_bodies(self):
+        plain = self.client.get('/api/items/')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        for encoding in compression.available_encodings():
+            response = self.client.get('/api/items/', HTTP_ACCEPT_ENCODING=encoding)
+            self.assertEqual(response['Content-Encoding'], encoding)
+            self.assertEqual(int(response['Content-Length']), len(response.content))
+            self.assertEqual(json.loads(compression.decompress(response.content, encoding)), json.loads(plain.content))
+
+        hits = compression.body_cache.stats['hits']
+        self.client.get('/api/items/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(compression.body_cache.stats['hits'], hits + 1)
+        # Small bodies aren't worth it
+        small = self.client.get(f'/api/items/{Item.objects.first().pk}/?fields=id', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+    def test_msgpack_responses_and_requests(self):
+        response = self.client.get('/api/items/', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), json.loads(self.client.get('/api/items/').content))
+
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.post('/api/categories/get_or_create/', pack({'name': 'Garden'}),
+                                    content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['name'], 'Garden')
+        response = self.client.post('/api/categories/get_or_create/', b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
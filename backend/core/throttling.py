@@ -0,0 +1,193 @@
+"""
+Token-bucket throttling and single-flight coalescing for hot read endpoints.
+
+``TokenBucketThrottle`` gives every authenticated user (or, for anonymous
+clients, every IP) a bucket of ``N`` tokens refilled at ``N`` per period,
+so short bursts pass and sustained polling is capped. Buckets live in a
+bounded per-process LRU, or in the Django cache named by
+``THROTTLING['SHARED_CACHE']`` so all workers share one budget. The shared
+backend uses plain get/set and can let a few extra requests through under
+contention, which is fine for abuse protection.
+
+``CoalescedListMixin`` makes identical concurrent list requests share one
+computation: the first request for a key builds the data and the others
+arriving while it runs wait for it and reuse the result.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import registry
+
+DEFAULTS = {
+    'ENABLED': True,
+    'RATES': {'user': '120/min', 'anon': '60/min'},
+    'SHARED_CACHE': None,   # Django cache alias, e.g. 'default'
+    'MAX_ENTRIES': 100000,  # local buckets kept before the least recent is dropped
+    'COALESCE_TIMEOUT': 10, # seconds a follower waits for the leader before computing itself
+}
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'THROTTLING', {})}
+
+
+def parse_rate(rate):
+    """``'120/min'`` -> ``(capacity, tokens per second)``."""
+    count, period = rate.split('/')
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period.strip().lower()]
+
+
+def take_token(state, capacity, refill, now):
+    """Apply one request to ``(tokens, updated_at)``; returns ``(allowed, new_state)``."""
+    tokens, updated = state if state else (capacity, now)
+    tokens = min(capacity, tokens + (now - updated) * refill)
+    if tokens >= 1:
+        return True, (tokens - 1, now)
+    return False, (tokens, now)
+
+
+class BucketStore:
+    """Bounded in-process store of bucket states, plus the shared backend."""
+
+    def __init__(self):
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        self.stats = {'allowed': {}, 'throttled': {}}
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def count(self, outcome, scope):
+        with self._lock:
+            self.stats[outcome][scope] = self.stats[outcome].get(scope, 0) + 1
+
+    def consume(self, key, capacity, refill, now=None):
+        """Take a token for ``key``; returns ``(allowed, seconds until the next token)``."""
+        now = time.time() if now is None else now
+        config = get_config()
+        if config['SHARED_CACHE']:
+            cache = caches[config['SHARED_CACHE']]
+            allowed, state = take_token(cache.get(key), capacity, refill, now)
+            cache.set(key, state, int(capacity / refill) + 1)
+        else:
+            with self._lock:
+                allowed, state = take_token(self._buckets.get(key), capacity, refill, now)
+                self._buckets[key] = state
+                self._buckets.move_to_end(key)
+                while len(self._buckets) > config['MAX_ENTRIES']:
+                    self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - state[0]) / refill
+
+
+bucket_store = BucketStore()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Per-user (or per-IP when anonymous) token bucket; only safe methods are counted."""
+
+    def allow_request(self, request, view):
+        config = get_config()
+        if not config['ENABLED'] or request.method not in ('GET', 'HEAD'):
+            return True
+        if request.user and request.user.is_authenticated:
+            scope, ident = 'user', request.user.pk
+        else:
+            scope, ident = 'anon', self.get_ident(request)
+        capacity, refill = parse_rate(config['RATES'][scope])
+        allowed, self.wait_seconds = bucket_store.consume(f'throttle:{scope}:{ident}', capacity, refill)
+        bucket_store.count('allowed' if allowed else 'throttled', scope)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class SingleFlight:
+    """Runs one call per key at a time; callers arriving meanwhile get its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {'leaders': 0, 'coalesced': 0}
+
+    def reset_metrics(self):
+        self.stats = {'leaders': 0, 'coalesced': 0}
+
+    def do(self, key, fn, timeout):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+                self.stats['leaders'] += 1
+        if not leader:
+            if call['done'].wait(timeout) and call['error'] is None:
+                with self._lock:
+                    self.stats['coalesced'] += 1
+                return call['result']
+            return fn()
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as exc:
+            call['error'] = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+
+single_flight = SingleFlight()
+
+
+class CoalescedListMixin:
+    """
+    Shares ``list`` results between identical concurrent requests.
+
+    The key is the view, the full query string and, when
+    ``coalesce_per_user`` is set, the user, so per-user lists never leak.
+    """
+    coalesce_per_user = False
+
+    def list(self, request, *args, **kwargs):
+        key = (type(self).__name__, request.get_full_path(), request.accepted_renderer.format)
+        if self.coalesce_per_user:
+            key += (request.user.pk,)
+
+        def compute():
+            response = super(CoalescedListMixin, self).list(request, *args, **kwargs)
+            return response.data, response.status_code
+
+        data, status_code = single_flight.do(key, compute, get_config()['COALESCE_TIMEOUT'])
+        return Response(data, status=status_code)
+
+
+def collect_throttling_metrics():
+    stats = bucket_store.stats
+    samples = {}
+    for outcome in ('allowed', 'throttled'):
+        for scope, value in stats[outcome].items():
+            samples[f'scope="{scope}",result="{outcome}"'] = value
+    return [
+        ('api_throttle_decisions_total', 'Throttled read requests by scope and result.', 'counter', samples),
+        ('api_coalesced_requests_total', 'List requests served from a concurrent identical request.', 'counter',
+         {'': single_flight.stats['coalesced']}),
+        ('api_coalesce_leaders_total', 'List requests that computed a result (possibly shared).', 'counter',
+         {'': single_flight.stats['leaders']}),
+    ]
+
+
+registry.register_collector(collect_throttling_metrics)
@@ -1,27 +1,48 @@
 from django.urls import path, include
-from rest_framework.routers import DefaultRouter
-from .views import (
-    health_check, ItemViewSet, CategoryViewSet, RentalRequestViewSet, 
-    NotificationViewSet, ConversationViewSet, MessageViewSet,
-    ItemImageViewSet, TransactionViewSet, DisputeViewSet,
-    UserViewSet, RegisterAPI, LoginAPI
-)
+from .startup import LazyRoutes, get_config, health_check
 
-router = DefaultRouter()
-router.register(r'users', UserViewSet)
-router.register(r'items', ItemViewSet)
-router.register(r'item-images', ItemImageViewSet)
-router.register(r'categories', CategoryViewSet)
-router.register(r'requests', RentalRequestViewSet)
-router.register(r'transactions', TransactionViewSet)
-router.register(r'disputes', DisputeViewSet)
-router.register(r'notifications', NotificationViewSet)
-router.register(r'conversations', ConversationViewSet)
-router.register(r'messages', MessageViewSet)
+
+def api_urlpatterns():
+    from rest_framework.routers import DefaultRouter
+    from .views import (
+        ItemViewSet, CategoryViewSet, RentalRequestViewSet,
+        NotificationViewSet, ConversationViewSet, MessageViewSet,
+        ItemImageViewSet, ItemBlackoutViewSet, TransactionViewSet, DisputeViewSet,
+        UserViewSet, RegisterAPI, LoginAPI, RotateTokenAPI, auth_cache_stats, metrics, search_suggest,
+        payment_webhook, batch,
+    )
+
+    router = DefaultRouter()
+    router.register(r'users', UserViewSet)
+    router.register(r'items', ItemViewSet)
+    router.register(r'item-images', ItemImageViewSet)
+    router.register(r'item-blackouts', ItemBlackoutViewSet)
+    router.register(r'categories', CategoryViewSet)
+    router.register(r'requests', RentalRequestViewSet)
+    router.register(r'transactions', TransactionViewSet)
+    router.register(r'disputes', DisputeViewSet)
+    router.register(r'notifications', NotificationViewSet)
+    router.register(r'conversations', ConversationViewSet)
+    router.register(r'messages', MessageViewSet)
+
+    return [
+        path('metrics/', metrics, name='metrics'),
+        path('auth/register/', RegisterAPI.as_view(), name='register'),
+        path('auth/login/', LoginAPI.as_view(), name='login'),
+        path('auth/token/rotate/', RotateTokenAPI.as_view(), name='rotate_token'),
+        path('auth/cache-stats/', auth_cache_stats, name='auth_cache_stats'),
+        path('search/suggest/', search_suggest, name='search_suggest'),
+        path('payments/webhook/', payment_webhook, name='payment_webhook'),
+        path('batch/', batch, name='batch'),
+        path('', include(router.urls)),
+    ]
+
+
+# The health check answers without importing DRF or the views; everything
+# else is built on the first request that needs it (COLD_START['LAZY_ROUTES']).
+api_routes = LazyRoutes(api_urlpatterns)
 
 urlpatterns = [
     path('health/', health_check, name='health_check'),
-    path('auth/register/', RegisterAPI.as_view(), name='register'),
-    path('auth/login/', LoginAPI.as_view(), name='login'),
-    path('', include(router.urls)),
+    path('', (api_routes, None, None) if get_config()['LAZY_ROUTES'] else include(api_urlpatterns())),
 ]
@@ -1,19 +1,116 @@
+import json
+import math
 from rest_framework import viewsets, generics, permissions, status
-from rest_framework.decorators import api_view, action
+from rest_framework.decorators import api_view, action, authentication_classes, permission_classes
 from rest_framework.response import Response
-from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from django.core.exceptions import FieldDoesNotExist
 from django.db import models
+from django.conf import settings
+from django.db.models import Exists, F, Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.contrib.auth import authenticate
-from .models import Item, Category, RentalRequest, Notification, Conversation, Message, ItemImage, Transaction, Dispute
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.contrib.auth.models import User
+from .archive import (
+    MESSAGE as ARCHIVE_MESSAGE, NOTIFICATION as ARCHIVE_NOTIFICATION, archived_rows, find_archived, segments_for,
+)
+from .availability import (
+    MAX_BATCH_ITEMS as MAX_CALENDAR_ITEMS, calendar as occupancy_calendar, clip, get_occupancy, is_booked, parse_window,
+    sync_availability,
+)
+from .authentication import get_valid_token, rotate_token, token_cache
+from .batch import parse_batch, run_batch
+from .bulk import FORMATS as BULK_FORMATS, ItemImporter, detect_format, export_rows, read_rows, text_stream
+from .categories import get_category_tree, subtree_filter
+from .formats import MessagePackParser
+from .geo import bbox_filter, bounding_box, distance_sq_expression, parse_bbox, parse_point
+from .handover import scan as scan_code
+from .history import parse_stats_params, time_in_status, timeline as request_timeline, transition_time
+from .messaging import MAX_LONG_POLL_SECONDS, inbox_hub, mark_conversation_read, refresh_unread_count, send_message
+from .metrics import registry
+from .payments import SIGNATURE_HEADER, ingest_buffer, parse_event, verify_signature, webhook_enabled
+from .pricing import MAX_QUOTE_RANGES, QuoteError, get_price_sheet, get_quote, parse_period, quote_item
+from .models import (
+    Item, Category, RentalRequest, Notification, Conversation, ConversationParticipant, Message, ItemImage,
+    ItemBlackout, Transaction, Dispute, SimilarItem,
+)
 from .serializers import (
     ItemSerializer, CategorySerializer, RentalRequestSerializer,
     NotificationSerializer, ConversationSerializer, MessageSerializer,
-    UserSerializer, RegisterSerializer, ItemImageSerializer, 
-    TransactionSerializer, DisputeSerializer
+    UserSerializer, RegisterSerializer, ItemImageSerializer, ItemBlackoutSerializer, ItemSummarySerializer,
+    TransactionSerializer, DisputeSerializer, get_field_selection, parse_field_list
 )
-from rest_framework.parsers import MultiPartParser, FormParser
+from .suggest import suggest
+from .throttling import CoalescedListMixin, TokenBucketThrottle
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+
+
+class FieldSelectionMixin:
+    """
+    Shapes the queryset around the fields the serializer will render.
+
+    ``related_fields`` maps serializer field names to the relation (or
+    ``Prefetch``) they read; a relation is only joined or prefetched when its
+    field is selected. On ``list``/``retrieve`` requests using ``?fields=`` or
+    ``?expand=`` the remaining columns are trimmed with ``only()``.
+    """
+    related_fields = {}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer_fields = self.get_serializer().fields
+        model = queryset.model
+
+        for name, relation in self.related_fields.items():
+            if name not in serializer_fields:
+                continue
+            if isinstance(relation, Prefetch):
+                queryset = queryset.prefetch_related(relation)
+                continue
+            model_field = model._meta.get_field(relation.split('__')[0])
+            if model_field.many_to_one or model_field.one_to_one:
+                queryset = queryset.select_related(relation)
+            else:
+                queryset = queryset.prefetch_related(relation)
+
+        fields, expand = get_field_selection(self.request)
+        if (fields is not None or expand is not None) and self.action in ('list', 'retrieve'):
+            columns = self.get_selected_columns(serializer_fields, model)
+            # Foreign keys followed by select_related can't be deferred
+            if isinstance(queryset.query.select_related, dict):
+                columns.update(queryset.query.select_related)
+            queryset = queryset.only(*columns)
+        return queryset
+
+    def get_selected_columns(self, serializer_fields, model):
+        dependencies = getattr(self.get_serializer_class().Meta, 'field_dependencies', {})
+        columns = {model._meta.pk.name}
+        for name, field in serializer_fields.items():
+            if name in dependencies:
+                columns.update(dependencies[name])
+                continue
+            if field.source == '*':
+                continue
+            try:
+                model_field = model._meta.get_field(field.source_attrs[0])
+            except FieldDoesNotExist:
+                continue
+            if model_field.concrete:
+                columns.add(model_field.name)
+        return columns
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+
+def select_fields(rows, request):
+    """Apply ``?fields=`` to already serialized rows (e.g. from the archive)."""
+    fields, _ = get_field_selection(request)
+    if fields is None:
+        return list(rows)
+    return [{name: value for name, value in row.items() if name in fields} for row in rows]
+
+
+class UserViewSet(FieldSelectionMixin, viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -30,45 +127,175 @@ class RegisterAPI(generics.GenericAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
-        token, created = Token.objects.get_or_create(user=user)
+        token = get_valid_token(user)
         return Response({
             "user": UserSerializer(user, context=self.get_serializer_context()).data,
             "token": token.key
         })
 
 class LoginAPI(generics.GenericAPIView):
+    # A stale or expired token header must not block logging in again
+    authentication_classes = []
+
     def post(self, request, *args, **kwargs):
         username = request.data.get('username')
         password = request.data.get('password')
         user = authenticate(username=username, password=password)
         if user:
-            token, created = Token.objects.get_or_create(user=user)
+            token = get_valid_token(user)
             return Response({
                 "user": UserSerializer(user).data,
                 "token": token.key
             })
         return Response({"error": "Invalid Credentials"}, status=status.HTTP_401_UNAUTHORIZED)
 
+class RotateTokenAPI(generics.GenericAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        token = rotate_token(request.user)
+        return Response({"token": token.key})
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([permissions.AllowAny])
+def search_suggest(request):
+    """Item, category and location suggestions for ``?q=`` from the in-memory index (no queries)."""
+    try:
+        limit = int(request.query_params.get('limit', 0)) or None
+    except ValueError:
+        return Response({"error": "limit must be a number."}, status=status.HTTP_400_BAD_REQUEST)
+    if limit is not None and limit < 0:
+        return Response({"error": "limit must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+    query = request.query_params.get('q', '')
+    return Response({'q': query, **suggest(query, limit)})
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([permissions.AllowAny])
+def payment_webhook(request):
+    """Queue provider events (one event or a list); ``manage.py apply_payment_events`` applies them."""
+    if not webhook_enabled():
+        return Response({"error": "Payment webhooks are disabled: no webhook secret is configured."},
+                        status=status.HTTP_403_FORBIDDEN)
+    if not verify_signature(request.body, request.headers.get(SIGNATURE_HEADER)):
+        return Response({"error": "Invalid signature."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        payload = json.loads(request.body)
+        events = [event for event in map(parse_event, payload if isinstance(payload, list) else [payload]) if event]
+    except ValueError as exc:
+        return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    if events:
+        ingest_buffer.submit(events)
+    return Response({"received": len(events)})
+
+@api_view(['POST'])
+def batch(request):
+    """Run several GET requests (``{"requests": [{"path": ...}]}``) in one round trip; see core/batch.py."""
+    try:
+        paths, parallel = parse_batch(request.data)
+    except ValueError as exc:
+        return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    root = request.path_info[:-len('batch/')]
+    return Response({"responses": run_batch(request, root, paths, parallel)})
+
+# Only runs GETs, so replica routing treats it like one
+batch.reads_only = True
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def auth_cache_stats(request):
+    return Response(token_cache.metrics())
+
 @api_view(['GET'])
-def health_check(request):
-    return Response({"status": "ok", "message": "Backend is running"})
+@permission_classes([permissions.IsAdminUser])
+def metrics(request):
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(FieldSelectionMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
-class ItemViewSet(viewsets.ModelViewSet):
-    queryset = Item.objects.select_related('category').prefetch_related('item_images').all()
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        name = self.request.query_params.get('name')
+        if name:
+            queryset = queryset.filter(name_key=name.strip().lower())
+        parent_id = self.request.query_params.get('parent_id')
+        if parent_id:
+            queryset = queryset.filter(parent_id=parent_id)
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """Nested categories with own and subtree available item counts (cached)."""
+        return Response(get_category_tree())
+
+    @action(detail=False, methods=['post'])
+    def get_or_create(self, request):
+        name = str(request.data.get('name', '')).strip()
+        if not name:
+            return Response({"name": ["This field is required."]}, status=status.HTTP_400_BAD_REQUEST)
+        parent = None
+        parent_id = request.data.get('parent')
+        if parent_id:
+            parent = Category.objects.filter(pk=parent_id).first()
+            if parent is None:
+                return Response({"parent": ["Unknown category."]}, status=status.HTTP_400_BAD_REQUEST)
+        category, created = Category.objects.get_or_create_by_name(name, parent=parent)
+        return Response(
+            self.get_serializer(category).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+class ItemViewSet(CoalescedListMixin, FieldSelectionMixin, viewsets.ModelViewSet):
+    queryset = Item.objects.all()
     serializer_class = ItemSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    throttle_classes = [TokenBucketThrottle]
     parser_classes = [MultiPartParser, FormParser]
+    related_fields = {
+        'category_name': 'category',
+        'item_images': 'item_images',
+    }
 
     def get_queryset(self):
-        queryset = self.queryset
+        queryset = super().get_queryset()
         category_id = self.request.query_params.get('category_id')
         if category_id:
-            queryset = queryset.filter(category_id=category_id)
+            if self.request.query_params.get('include_descendants') in ('1', 'true'):
+                path = Category.objects.filter(pk=category_id).values_list('path', flat=True).first()
+                queryset = queryset.filter(subtree_filter(path, 'category__path')) if path else queryset.none()
+            else:
+                queryset = queryset.filter(category_id=category_id)
+        return self.filter_location(queryset)
+
+    def filter_location(self, queryset):
+        """
+        ``?near=lat,lon`` (or a place name) with ``radius_km`` returns items
+        within the radius sorted by distance; ``?bbox=min_lon,min_lat,max_lon,max_lat``
+        restricts to a box. Both use the indexed geohash column.
+        """
+        params = self.request.query_params
+        near = params.get('near')
+        bbox = params.get('bbox')
+        try:
+            if near:
+                latitude, longitude = parse_point(near)
+                radius_km = float(params.get('radius_km', 10))
+                if not 0 < radius_km < math.inf:
+                    raise ValueError('radius_km must be a positive number.')
+                queryset = (
+                    queryset.filter(bbox_filter(*bounding_box(latitude, longitude, radius_km)))
+                    .annotate(distance_sq=distance_sq_expression(latitude, longitude))
+                    .filter(distance_sq__lte=radius_km ** 2)
+                    .order_by('distance_sq', 'id')
+                )
+            if bbox:
+                queryset = queryset.filter(bbox_filter(*parse_bbox(bbox)))
+        except (ValueError, OverflowError) as exc:
+            raise ValidationError({'detail': str(exc)})
         return queryset
 
     def perform_create(self, serializer):
@@ -84,26 +311,254 @@ class ItemViewSet(viewsets.ModelViewSet):
                 is_primary=(i == 0) # First one is primary
             )
 
-class ItemImageViewSet(viewsets.ModelViewSet):
+    def perform_update(self, serializer):
+        item = serializer.save()
+        if 'is_available' in serializer.validated_data:
+            # Relisting an item that is out on rental keeps it unavailable
+            sync_availability(Item.objects.filter(pk=item.pk))
+
+    @action(detail=True, methods=['post'], parser_classes=[JSONParser, MessagePackParser, FormParser], permission_classes=[permissions.AllowAny])
+    def quote(self, request, pk=None):
+        """
+        Price one period (``start_date``/``end_date``) or a batch of them
+        (``{"periods": [{...}, ...]}``): total, deposit and availability.
+        """
+        periods = request.data.get('periods')
+        single = periods is None
+        if single:
+            periods = [request.data]
+        if (not isinstance(periods, list) or not 0 < len(periods) <= MAX_QUOTE_RANGES
+                or not all(isinstance(period, dict) for period in periods)):
+            return Response(
+                {"error": f"periods must be a list of 1 to {MAX_QUOTE_RANGES} date ranges."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            sheet = get_price_sheet(int(pk))
+        except (Item.DoesNotExist, ValueError):
+            raise Http404
+        try:
+            quotes = [get_quote(sheet, *parse_period(period)) for period in periods]
+        except QuoteError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        # Bookings change more often than prices, so they are checked outside the quote cache
+        occupancy = get_occupancy([sheet.item_id])[sheet.item_id]
+        for quote in quotes:
+            quote['booked'] = bool(clip(occupancy, quote['start_date'], quote['end_date']))
+            quote['available'] = quote['available'] and not quote['booked']
+        return Response(quotes[0] if single else {"quotes": quotes})
+
+    @action(detail=True, methods=['get'])
+    def calendar(self, request, pk=None):
+        """Blocked days in ``?from=&to=`` as ranges or ``?encoding=bitmap``."""
+        start, end, encoding = self.get_calendar_window()
+        if not pk.isdigit() or not Item.objects.filter(pk=pk).exists():
+            raise Http404
+        item_id = int(pk)
+        return Response({'item': item_id, **occupancy_calendar(get_occupancy([item_id])[item_id], start, end, encoding)})
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """
+        Precomputed similar items (``manage.py build_similar_items``), best first,
+        available ones only. Items not indexed yet fall back to their category.
+        """
+        try:
+            limit = min(int(request.query_params.get('limit', 8)), settings.SIMILAR_ITEMS['NEIGHBOURS'])
+        except ValueError:
+            raise ValidationError({'detail': 'limit must be a number.'})
+        if not pk.isdigit():
+            raise Http404
+        links = list(
+            SimilarItem.objects.filter(item_id=pk, similar__is_available=True)
+            .select_related('similar').order_by('rank')[:max(limit, 0)]
+        )
+        if links:
+            results = [{**ItemSummarySerializer(link.similar).data, 'score': round(link.score, 4)} for link in links]
+        else:
+            item = Item.objects.filter(pk=pk).only('category_id').first()
+            if item is None:
+                raise Http404
+            fallback = (
+                Item.objects.filter(category_id=item.category_id, is_available=True).exclude(pk=item.pk)
+                .order_by('-rating', '-id')[:max(limit, 0)]
+            )
+            results = [{**row, 'score': None} for row in ItemSummarySerializer(fallback, many=True).data]
+        return Response({'item': int(pk), 'results': results})
+
+    @action(detail=False, methods=['get'], url_path='calendar')
+    def calendars(self, request):
+        """Batch calendar for ``?ids=1,2,3`` (e.g. search result badges)."""
+        start, end, encoding = self.get_calendar_window()
+        ids = parse_field_list(request.query_params.get('ids')) or set()
+        if not ids or len(ids) > MAX_CALENDAR_ITEMS or not all(i.isdigit() for i in ids):
+            return Response(
+                {"error": f"ids must list 1 to {MAX_CALENDAR_ITEMS} item ids."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        item_ids = sorted(Item.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        occupancy = get_occupancy(item_ids)
+        return Response({
+            'from': start,
+            'to': end,
+            'calendars': {item_id: occupancy_calendar(occupancy[item_id], start, end, encoding) for item_id in item_ids},
+        })
+
+    def get_calendar_window(self):
+        try:
+            return parse_window(self.request.query_params, timezone.localdate())
+        except ValueError as exc:
+            raise ValidationError({'detail': str(exc)})
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[permissions.IsAuthenticated])
+    def bulk_import(self, request):
+        """Create many items from an uploaded CSV or NDJSON ``file``."""
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "Upload a CSV or NDJSON file as 'file'."}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = detect_format(upload.name, request.data.get('file_format'))
+        if file_format not in BULK_FORMATS:
+            return Response({"error": f"file_format must be one of {', '.join(BULK_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        importer = ItemImporter(
+            owner_id=request.user.id,
+            dry_run=str(request.data.get('dry_run', '')).lower() in ('1', 'true'),
+        )
+        report = importer.run(read_rows(text_stream(upload.file), file_format))
+        if report['created'] == 0 and report['failed']:
+            return Response(report, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report, status=status.HTTP_201_CREATED if report['created'] else status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def export(self, request):
+        """Stream the user's items as CSV (default) or NDJSON (``?file_format=ndjson``)."""
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in BULK_FORMATS:
+            return Response({"error": f"file_format must be one of {', '.join(BULK_FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = Item.objects.filter(owner_id=str(request.user.id))
+        category_id = request.query_params.get('category_id')
+        if category_id:
+            queryset = queryset.filter(category_id=category_id)
+
+        content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(export_rows(queryset, file_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="items.{file_format}"'
+        return response
+
+class ItemBlackoutViewSet(FieldSelectionMixin, viewsets.ModelViewSet):
+    queryset = ItemBlackout.objects.all()
+    serializer_class = ItemBlackoutSerializer
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+
+    def get_queryset(self):
+        queryset = super().get_queryset().order_by('start_date')
+        item_id = self.request.query_params.get('item_id')
+        if item_id:
+            queryset = queryset.filter(item_id=item_id)
+        if self.request.method not in permissions.SAFE_METHODS:
+            queryset = queryset.filter(item__owner_id=str(self.request.user.id))
+        return queryset
+
+    def perform_create(self, serializer):
+        self.check_item_owner(serializer.validated_data['item'])
+        serializer.save()
+
+    def perform_update(self, serializer):
+        # A partial update may leave the item out; it can also move the blackout to another item
+        self.check_item_owner(serializer.validated_data.get('item', serializer.instance.item))
+        serializer.save()
+
+    def check_item_owner(self, item):
+        if item.owner_id != str(self.request.user.id):
+            raise PermissionDenied("Only the owner can block out dates.")
+
+class ItemImageViewSet(FieldSelectionMixin, viewsets.ModelViewSet):
     queryset = ItemImage.objects.all()
     serializer_class = ItemImageSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
-class RentalRequestViewSet(viewsets.ModelViewSet):
-    queryset = RentalRequest.objects.select_related('item').all()
+class RentalRequestViewSet(FieldSelectionMixin, viewsets.ModelViewSet):
+    queryset = RentalRequest.objects.all()
     serializer_class = RentalRequestSerializer
     permission_classes = [permissions.IsAuthenticated]
+    related_fields = {
+        'item_details': 'item',
+        'dispute': 'dispute',
+        'transactions': Prefetch('transactions', queryset=Transaction.objects.order_by('created_at')),
+    }
 
     def get_queryset(self):
         user_id = str(self.request.user.id)
-        return self.queryset.filter(models.Q(requester_id=user_id) | models.Q(owner_id=user_id))
+        return super().get_queryset().filter(models.Q(requester_id=user_id) | models.Q(owner_id=user_id))
 
     def perform_create(self, serializer):
         item = serializer.validated_data['item']
-        serializer.save(
-            requester_id=str(self.request.user.id),
-            owner_id=item.owner_id
-        )
+        serializer.save(requester_id=str(self.request.user.id), **self.price(item, serializer.validated_data))
+
+    def perform_update(self, serializer):
+        instance = serializer.instance
+        data = serializer.validated_data
+        item = data.get('item', instance.item)
+        period = {
+            'start_date': data.get('start_date', instance.start_date),
+            'end_date': data.get('end_date', instance.end_date),
+        }
+        moved = period != {'start_date': instance.start_date, 'end_date': instance.end_date}
+        if item.pk == instance.item_id and not moved:
+            serializer.save()
+            return
+        # New dates or a new item: quote and check availability again, ignoring this request's own days
+        serializer.save(**self.price(item, period, exclude_request=instance.pk))
+
+    def price(self, item, data, exclude_request=None):
+        """Server-side price fields for renting ``item`` over ``data``'s dates; raises if it can't be booked."""
+        try:
+            start, end = parse_period(data)
+        except QuoteError as exc:
+            raise ValidationError({'detail': str(exc)})
+        quote = quote_item(item, start, end)
+        if not quote['available'] or is_booked(item.pk, start, end, exclude_request=exclude_request):
+            raise ValidationError({'detail': 'The item is not available for the selected dates.'})
+        return {'owner_id': item.owner_id, 'total_price': quote['total_price'], 'deposit_amount': quote['deposit_amount']}
+
+    @action(detail=True, methods=['get'])
+    def timeline(self, request, pk=None):
+        """The request's status transitions with the time spent in each status."""
+        rental_request = self.get_object()
+        return Response({
+            'request': rental_request.pk,
+            'status': rental_request.status,
+            'transitions': request_timeline(rental_request),
+        })
+
+    @action(detail=False, methods=['get'], url_path='status-stats', permission_classes=[permissions.IsAdminUser])
+    def status_stats(self, request):
+        """
+        Time in each status for requests that entered it in ``since``..``until``
+        and, given ``from`` and ``to``, the time between those two statuses.
+        """
+        try:
+            since, until, from_status, to_status = parse_stats_params(request.query_params, timezone.localdate())
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        data = {'since': since, 'until': until, 'statuses': time_in_status(since, until)}
+        if from_status:
+            data['transition'] = {'from': from_status, 'to': to_status,
+                                  **transition_time(from_status, to_status, since, until)}
+        return Response(data)
+
+    @action(detail=False, methods=['post'])
+    def scan(self, request):
+        """Confirm a handover or return from the scanned code alone (no request id needed)."""
+        rental_request = scan_code(request.data.get('code'), request.user.id)
+        if rental_request is None:
+            return Response({"error": "Invalid or already used code."}, status=status.HTTP_400_BAD_REQUEST)
+        messages = {
+            'InHand': "Handover confirmed. Happy renting!",
+            'Returned': "Return confirmed. Item is now back with the owner.",
+        }
+        return Response({"request": rental_request.pk, "status": messages[rental_request.status],
+                         "request_status": rental_request.status})
 
     @action(detail=True, methods=['post'])
     def confirm_handover(self, request, pk=None):
@@ -115,12 +570,7 @@ class RentalRequestViewSet(viewsets.ModelViewSet):
             
         if code == rental_request.handover_code:
             rental_request.status = 'InHand'
-            rental_request.save()
-            
-            # Update item availability
-            item = rental_request.item
-            item.is_available = False
-            item.save()
+            rental_request.save() # Item availability follows via core.signals
             
             return Response({"status": "Handover confirmed. Happy renting!"})
             
@@ -136,12 +586,7 @@ class RentalRequestViewSet(viewsets.ModelViewSet):
             
         if code == rental_request.return_code:
             rental_request.status = 'Returned'
-            rental_request.save()
-            
-            # Item is back, but needs owner final inspection or just make it available
-            item = rental_request.item
-            item.is_available = True
-            item.save()
+            rental_request.save() # Item is back and, unless unlisted, available again
             
             return Response({"status": "Return confirmed. Item is now back with the owner."})
             
@@ -166,26 +611,26 @@ class RentalRequestViewSet(viewsets.ModelViewSet):
         rental_request.save()
         return Response({"status": "Payment simulated successfully."})
 
-class TransactionViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(FieldSelectionMixin, viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         user_id = str(self.request.user.id)
-        return self.queryset.filter(
+        return super().get_queryset().filter(
             models.Q(rental_request__requester_id=user_id) | 
             models.Q(rental_request__owner_id=user_id)
         )
 
-class DisputeViewSet(viewsets.ModelViewSet):
+class DisputeViewSet(FieldSelectionMixin, viewsets.ModelViewSet):
     queryset = Dispute.objects.all()
     serializer_class = DisputeSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         user_id = str(self.request.user.id)
-        return self.queryset.filter(
+        return super().get_queryset().filter(
             models.Q(rental_request__requester_id=user_id) | 
             models.Q(rental_request__owner_id=user_id)
         )
@@ -196,22 +641,42 @@ class DisputeViewSet(viewsets.ModelViewSet):
         rental_request.save()
         serializer.save(reporter_id=str(self.request.user.id))
 
-class NotificationViewSet(viewsets.ModelViewSet):
+class NotificationViewSet(CoalescedListMixin, FieldSelectionMixin, viewsets.ModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [TokenBucketThrottle]
+    coalesce_per_user = True
 
     def get_queryset(self):
-        return self.queryset.filter(target_user_id=str(self.request.user.id)).order_by('-timestamp')
+        return super().get_queryset().filter(target_user_id=str(self.request.user.id)).order_by('-timestamp')
 
-class ConversationViewSet(viewsets.ModelViewSet):
-    queryset = Conversation.objects.select_related('item_context').prefetch_related('messages').all()
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get('include_archived', '').lower() in ('1', 'true'):
+            # Archived notifications are all older than the hot ones
+            segments = segments_for(ARCHIVE_NOTIFICATION, request.user.id)
+            response.data = list(response.data) + select_fields(archived_rows(segments, newest_first=True), request)
+        return response
+
+class ConversationViewSet(FieldSelectionMixin, viewsets.ModelViewSet):
+    queryset = Conversation.objects.all()
     serializer_class = ConversationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    related_fields = {
+        'item_details': 'item_context',
+        'messages': 'messages',
+    }
 
     def get_queryset(self):
+        # Inbox: one range of the (user_id, -last_activity_at) participant index
         user_id = str(self.request.user.id)
-        return self.queryset.filter(participant_ids__contains=user_id)
+        return (
+            super().get_queryset()
+            .filter(memberships__user_id=user_id)
+            .annotate(unread_count=F('memberships__unread_count'), last_activity_at=F('memberships__last_activity_at'))
+            .order_by('-last_activity_at')
+        )
 
     def perform_create(self, serializer):
         participant_ids = self.request.data.get('participant_ids', [])
@@ -220,7 +685,51 @@ class ConversationViewSet(viewsets.ModelViewSet):
             participant_ids.append(user_id)
         serializer.save(participant_ids=participant_ids)
 
-class MessageViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        """Mark every message received in the conversation as read."""
+        conversation = self.get_object()
+        mark_conversation_read(conversation, request.user.id)
+        return Response({"unread_count": 0})
+
+    @action(detail=False, methods=['get'])
+    def updates(self, request):
+        """
+        Long-poll for conversations with activity after ``?since=`` (ISO 8601).
+
+        Returns at once when there is something new, otherwise waits up to
+        ``?timeout=`` seconds (capped by ``MESSAGING_LONG_POLL_SECONDS``, 0 by
+        default, so a short poll) for a message to arrive. Pass the returned
+        ``cursor`` as the next ``since``.
+        """
+        try:
+            since = parse_datetime(request.query_params.get('since', ''))
+        except ValueError:
+            since = None
+        if since is None:
+            return Response({"error": "since must be an ISO 8601 timestamp."}, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        limit = min(settings.MESSAGING_LONG_POLL_SECONDS, MAX_LONG_POLL_SECONDS)
+        try:
+            timeout = max(0.0, min(float(request.query_params.get('timeout', limit)), limit))
+        except ValueError:
+            return Response({"error": "timeout must be a number of seconds."}, status=status.HTTP_400_BAD_REQUEST)
+
+        user_id = str(request.user.id)
+        version = inbox_hub.version(user_id)
+        queryset = self.get_queryset().filter(last_activity_at__gt=since)
+        changed = list(queryset)
+        if not changed and timeout and inbox_hub.wait(user_id, version, timeout):
+            changed = list(queryset.all())
+
+        cursor = max((conv.last_activity_at for conv in changed), default=since)
+        return Response({
+            "conversations": self.get_serializer(changed, many=True).data,
+            "cursor": cursor.isoformat(),
+        })
+
+class MessageViewSet(FieldSelectionMixin, viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -228,14 +737,45 @@ class MessageViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         conversation_id = self.request.query_params.get('conversation_id')
         user_id = str(self.request.user.id)
-        
+        queryset = super().get_queryset().filter(conversation__memberships__user_id=user_id)
+
         if conversation_id:
-            conv = Conversation.objects.filter(id=conversation_id, participant_ids__contains=user_id).first()
-            if conv:
-                return self.queryset.filter(conversation_id=conversation_id).order_by('timestamp')
-            return self.queryset.none()
-        
-        return self.queryset.filter(conversation__participant_ids__contains=user_id).order_by('timestamp')
+            queryset = queryset.filter(conversation_id=conversation_id)
+        return queryset.order_by('timestamp')
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        conversation_id = request.query_params.get('conversation_id', '')
+        if conversation_id.isdigit():
+            # A conversation's history reads through to its archived (older) messages
+            segments = segments_for(ARCHIVE_MESSAGE, conversation_id).filter(Exists(
+                ConversationParticipant.objects.filter(conversation_id=conversation_id, user_id=str(request.user.id))
+            ))
+            archived = select_fields(archived_rows(segments), request)
+            if archived:
+                response.data = archived + list(response.data)
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            pk = kwargs.get('pk', '')
+            row = find_archived(ARCHIVE_MESSAGE, int(pk)) if pk.isdigit() else None
+            if row is None or not ConversationParticipant.objects.filter(
+                conversation_id=row['conversation'], user_id=str(request.user.id)
+            ).exists():
+                raise
+            return Response(select_fields([row], request)[0])
 
     def perform_create(self, serializer):
-        serializer.save(sender_id=str(self.request.user.id))
+        conversation = serializer.validated_data['conversation']
+        user = self.request.user
+        if not conversation.memberships.filter(user_id=str(user.id)).exists():
+            raise PermissionDenied("You are not a participant in this conversation.")
+        serializer.instance = send_message(conversation, user.id, serializer.validated_data['text'], user.username)
+
+    def perform_update(self, serializer):
+        message = serializer.save()
+        if 'is_read' in serializer.validated_data:
+            refresh_unread_count(message.conversation_id, str(self.request.user.id))
@@ -19,7 +19,8 @@ export default function RequestsPage() {
   const fetchRequests = async (userId: string) => {
     setIsLoading(true);
     try {
-      // Fetch both sent and received requests
+      // Fetch both sent and received requests, batched into one round trip
+      await requestsService.prefetchForUser(userId).catch(() => undefined);
       const [sent, received] = await Promise.all([
         requestsService.getAll({ requester: userId }),
         requestsService.getAll({ owner: userId })
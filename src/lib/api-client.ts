@@ -110,6 +110,33 @@ class ApiClient {
         return response.text() as T;
     }
 
+    private getQueryString(params?: Record<string, any>): string {
+        return params
+            ? '?' + new URLSearchParams(Object.entries(params).filter(([_, v]) => v != null)).toString()
+            : '';
+    }
+
+    /**
+     * Load several GET endpoints with one POST /batch/ and cache each result,
+     * so the get() calls that follow are answered without another round trip.
+     */
+    async prefetch(requests: Array<[string, Record<string, any>?]>): Promise<void> {
+        const missing = requests.filter(([endpoint, params]) =>
+            this.getFromCache(this.getCacheKey(endpoint, params)) === null);
+        if (missing.length < 2) return; // a single read gains nothing from a batch
+
+        const data = await this.post<{ responses: { path: string; status: number; body: any }[] }>('/batch/', {
+            requests: missing.map(([endpoint, params]) => ({ path: `${endpoint}${this.getQueryString(params)}` })),
+            parallel: true,
+        });
+        data.responses.forEach((response, index) => {
+            if (response.status >= 200 && response.status < 300) {
+                const [endpoint, params] = missing[index];
+                this.setCache(this.getCacheKey(endpoint, params), response.body);
+            }
+        });
+    }
+
     async get<T>(endpoint: string, params?: Record<string, any>, useCache: boolean = true): Promise<T> {
         const cacheKey = this.getCacheKey(endpoint, params);
 
@@ -121,11 +148,7 @@ class ApiClient {
             }
         }
 
-        const queryString = params
-            ? '?' + new URLSearchParams(Object.entries(params).filter(([_, v]) => v != null)).toString()
-            : '';
-
-        const response = await fetch(`${this.baseURL}${endpoint}${queryString}`, {
+        const response = await fetch(`${this.baseURL}${endpoint}${this.getQueryString(params)}`, {
             method: 'GET',
             headers: this.getAuthHeaders(),
         });
@@ -56,6 +56,24 @@ export async function fetchApi(endpoint: string, options: RequestInit = {}) {
     return data;
 }
 
+// Loads several GET endpoints with one POST /batch/ and caches each result,
+// so the fetchApi calls that follow are answered without another round trip.
+export async function prefetchApi(endpoints: string[]) {
+    const missing = endpoints.filter(endpoint =>
+        !(cache[endpoint] && (Date.now() - cache[endpoint].timestamp < CACHE_TTL)));
+    if (missing.length === 0) return;
+
+    const data = await fetchApi('/batch/', {
+        method: 'POST',
+        body: JSON.stringify({ requests: missing.map(path => ({ path })), parallel: true }),
+    });
+    for (const response of data.responses) {
+        if (response.status >= 200 && response.status < 300) {
+            cache[response.path] = { data: response.body, timestamp: Date.now() };
+        }
+    }
+}
+
 export function clearApiCache(endpoint?: string) {
     if (endpoint) {
         delete cache[endpoint];
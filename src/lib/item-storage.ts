@@ -50,15 +50,10 @@ export async function getItemById(id: string): Promise<RentalItem | null> {
 }
 
 export async function addItem(itemData: Omit<RentalItem, 'id' | 'owner' | 'rating' | 'reviewsCount' | 'availabilityStatus' | 'availableFromDate' | 'imageUrl'> & { files?: File[]; imageUrl?: string }): Promise<RentalItem> {
-  let categories = await fetchApi('/categories/');
-  let category = categories.find((c: any) => c.name.toLowerCase() === itemData.category.toLowerCase());
-
-  if (!category) {
-    category = await fetchApi('/categories/', {
-      method: 'POST',
-      body: JSON.stringify({ name: itemData.category })
-    });
-  }
+  const category = await fetchApi('/categories/get_or_create/', {
+    method: 'POST',
+    body: JSON.stringify({ name: itemData.category })
+  });
 
   const formData = new FormData();
   formData.append('name', itemData.name);
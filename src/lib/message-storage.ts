@@ -2,9 +2,7 @@ import type { Conversation, Message, UserProfile } from '@/types';
 import { fetchApi, clearApiCache } from './api';
 
 function mapBackendConversation(conv: any, loggedInUserId: string): Conversation {
-    const lastMsg = conv.messages && conv.messages.length > 0
-        ? conv.messages[conv.messages.length - 1]
-        : null;
+    const lastMsg = conv.last_message;
 
     return {
         id: conv.id.toString(),
@@ -19,9 +17,9 @@ function mapBackendConversation(conv: any, loggedInUserId: string): Conversation
             senderId: lastMsg.sender_id,
             text: lastMsg.text,
             timestamp: new Date(lastMsg.timestamp),
-            isRead: lastMsg.is_read
+            isRead: lastMsg.sender_id === loggedInUserId || !conv.unread_count
         } : undefined,
-        unreadCount: conv.messages ? conv.messages.filter((m: any) => m.sender_id !== loggedInUserId && !m.is_read).length : 0,
+        unreadCount: conv.unread_count ?? 0,
         itemContext: conv.item_details ? {
             id: conv.item_details.id.toString(),
             name: conv.item_details.name
@@ -29,6 +27,8 @@ function mapBackendConversation(conv: any, loggedInUserId: string): Conversation
     };
 }
 
+export const inboxEndpoint = (userId: string) => `/conversations/?user_id=${userId}&expand=participants_details,item_details`;
+
 function mapBackendMessage(msg: any): Message {
     return {
         id: msg.id.toString(),
@@ -42,7 +42,8 @@ function mapBackendMessage(msg: any): Message {
 
 export async function getConversations(userId: string): Promise<Conversation[]> {
     try {
-        const data = await fetchApi(`/conversations/?user_id=${userId}`);
+        // The inbox only needs the summary; skip the full message history
+        const data = await fetchApi(inboxEndpoint(userId));
         return data.map((c: any) => mapBackendConversation(c, userId));
     } catch (error) {
         console.error("Failed to fetch conversations:", error);
@@ -71,7 +72,7 @@ export async function sendMessage(conversationId: string, senderId: string, text
             })
         });
         clearApiCache(`/messages/?conversation_id=${conversationId}`);
-        clearApiCache(`/conversations/?user_id=${senderId}`);
+        clearApiCache(inboxEndpoint(senderId));
         return mapBackendMessage(data);
     } catch (error) {
         console.error("Failed to send message:", error);
@@ -88,7 +89,7 @@ export async function createConversation(participantIds: string[], itemId?: stri
                 item_context: itemId
             })
         });
-        clearApiCache(`/conversations/?user_id=${participantIds[0]}`);
+        clearApiCache(inboxEndpoint(participantIds[0]));
         return mapBackendConversation(data, participantIds[0]);
     } catch (error) {
         console.error("Failed to create conversation:", error);
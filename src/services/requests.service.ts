@@ -41,6 +41,13 @@ export const requestsService = {
         return response.results || response as any as RentalRequest[];
     },
 
+    /**
+     * Load a user's sent and received requests in one round trip (see apiClient.prefetch)
+     */
+    async prefetchForUser(userId: string): Promise<void> {
+        await apiClient.prefetch([['/requests/', { requester: userId }], ['/requests/', { owner: userId }]]);
+    },
+
     /**
      * Get requests by requester ID
      */